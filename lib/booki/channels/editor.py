@@ -31,6 +31,7 @@ from booktype import constants
 from django.conf import settings
 
 from booktype.utils import config
+from booktype.apps.edit import locks
 
 try:
     OBJAVI_URL = settings.OBJAVI_URL
@@ -55,28 +56,28 @@ def getTOCForBook(version):
     """
 
     results = []
-    for chap in version.getTOC():
-        parent_id = chap.parent.id if chap.parent else None
+    for chap in version.get_toc_rows():
+        parent_id = chap['parent']
 
         # is it a section or chapter?
-        if chap.chapter:
+        if chap['chapter']:
             results.append([
-                chap.chapter.id,
-                chap.chapter.title,
-                chap.chapter.url_title,
-                chap.typeof,
-                chap.chapter.status.id,
+                chap['chapter'],
+                chap['chapter__title'],
+                chap['chapter__url_title'],
+                chap['typeof'],
+                chap['chapter__status'],
                 parent_id,
-                chap.has_children
+                chap['has_children']
             ])
         else:
             results.append([
-                's%s' % chap.id,
-                chap.name,
-                chap.name,
-                chap.typeof,
+                's%s' % chap['id'],
+                chap['name'],
+                chap['name'],
+                chap['typeof'],
                 parent_id,
-                chap.has_children
+                chap['has_children']
             ])
     return results
 
@@ -238,8 +239,8 @@ def remote_init_editor(request, message, bookid, version):
                                     "/booki/book/%s/%s/" % (bookid, version),
                                     {"command": "user_add",
                                      "username": request.user.username,
-                                     "mood": moodMessage}
-                                    )
+                                     "mood": moodMessage},
+                                    coalesce="user_add:%s" % request.user.username)
 
     ## get online users and their mood messages
 
@@ -254,29 +255,8 @@ def remote_init_editor(request, message, bookid, version):
 
     onlineUsers = [x for x in [_getUser(x) for x in _onlineUsers] if x]
 
-    # for now, this is one big temp here
-
-    import time, decimal, re
-    _now = time.time()
-    locks = {}
-
-    try:
-        for key in sputnik.rkeys("booki:*:locks:*"):
-            lastAccess = sputnik.get(key)
-
-            if type(lastAccess) in [type(' '), type(u' ')]:
-                try:
-                    lastAccess = decimal.Decimal(lastAccess)
-                except:
-                    continue
-
-                if lastAccess and decimal.Decimal("%f" % _now) - lastAccess <= 30:
-                    m = re.match("booki:(\d+):locks:(\d+):(\w+)", key)
-                    if m:
-                        if m.group(1) == bookid:
-                            locks[m.group(2)] = m.group(3)
-    except:
-        pass
+    ## get locked chapters
+    book_locks = locks.get_locks(bookid)
 
     bookSecurity = security.getUserSecurityForBook(request.user, book)
 
@@ -286,7 +266,7 @@ def remote_init_editor(request, message, bookid, version):
             "hold": holdChapters,
             "users": users,
             "is_admin":  bookSecurity.isAdmin(),
-            "locks": locks,
+            "locks": book_locks,
             "statuses": statuses,
             "attachments": attachments,
             "onlineUsers": list(onlineUsers)}
@@ -387,13 +367,14 @@ def remote_chapter_status(request, message, bookid, version):
     """
 
     if message["status"] == "normal":
-        sputnik.rdelete("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username))
+        locks.remove_lock(bookid, message["chapterID"], request.user.username)
 
     sputnik.addMessageToChannel(request, "/booki/book/%s/%s/" % (bookid, version),
                                 {"command": "chapter_status",
                                  "chapterID": message["chapterID"],
                                  "status": message["status"],
-                                 "username": request.user.username})
+                                 "username": request.user.username},
+                                coalesce="chapter_status:%s" % message["chapterID"])
 
     return {}
 
@@ -521,9 +502,10 @@ def remote_chapter_save(request, message, bookid, version):
                                     {"command": "chapter_status",
                                      "chapterID": message["chapterID"],
                                      "status": "normal",
-                                     "username": request.user.username})
+                                     "username": request.user.username},
+                                    coalesce="chapter_status:%s" % message["chapterID"])
 
-        sputnik.rdelete("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username))
+        locks.remove_lock(bookid, message["chapterID"], request.user.username)
 
     # fire the signal
     import booki.editor.signals
@@ -647,7 +629,8 @@ def remote_chapter_rename(request, message, bookid, version):
                                     {"command": "chapter_status",
                                      "chapterID": message["chapterID"],
                                      "status": "normal",
-                                     "username": request.user.username})
+                                     "username": request.user.username},
+                                    coalesce="chapter_status:%s" % message["chapterID"])
 
         sputnik.addMessageToChannel(request, "/booki/book/%s/%s/" % (bookid, version),
                                     {"command": "chapter_rename",
@@ -815,16 +798,15 @@ def remote_get_chapter(request, message, bookid, version):
     if not message.get("lock", True):
         return res
 
-    import time
-
     # set the initial timer for editor
-    sputnik.set("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username), time.time())
+    locks.set_lock(bookid, message["chapterID"], request.user.username)
 
     sputnik.addMessageToChannel(request, "/booki/book/%s/%s/" % (bookid, version),
                                 {"command": "chapter_status",
                                  "chapterID": message["chapterID"],
                                  "status": "edit",
-                                 "username": request.user.username})
+                                 "username": request.user.username},
+                                coalesce="chapter_status:%s" % message["chapterID"])
 
     return res
 
@@ -847,13 +829,10 @@ def remote_book_notification(request, message, bookid, version):
 
     res = {}
 
-    import time
-
-    # rcon.delete(key)
     # set the initial timer for editor
 
     if request.user.username and request.user.username != '':
-        sputnik.set("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username), time.time())
+        locks.set_lock(bookid, message["chapterID"], request.user.username)
 
         if '%s' % sputnik.get("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], request.user.username)) == '1':
             sputnik.rdelete("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], request.user.username))
@@ -1021,7 +1000,7 @@ def remote_create_chapter(request, message, bookid, version):
         # this should be solved in better way
         # should have createChapter in booki.utils.book module
 
-        toc_items = len(book_version.getTOC())+1
+        toc_items = book_version.getTOC().count()+1
 
         for itm in models.BookToc.objects.filter(version = book_version, book = book).order_by("-weight"):
             itm.weight = toc_items
@@ -1176,7 +1155,7 @@ def remote_clone_chapter(request, message, bookid, version):
         # this should be solved in better way
         # should have createChapter in booki.utils.book module
 
-        toc_items = len(book_version.getTOC())+1
+        toc_items = book_version.getTOC().count()+1
 
         for itm in models.BookToc.objects.filter(version = book_version, book = book):
             itm.weight = toc_items
@@ -1813,17 +1792,13 @@ def remote_unlock_chapter(request, message, bookid, version):
     @param version: Book version
     """
 
-    import re
-
     book = models.Book.objects.get(id=bookid)
 
     bookSecurity = security.getUserSecurityForBook(request.user, book)
 
     if bookSecurity.isAdmin():
-        for key in sputnik.rkeys("booki:%s:locks:%s:*" % (bookid, message["chapterID"])):
-            m = re.match("booki:(\d+):locks:(\d+):(\w+)", key)
-            if m:
-                sputnik.set("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], m.group(3)), 1)
+        for username in locks.get_lock_owners(bookid, message["chapterID"]):
+            sputnik.set("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], username), 1)
 
     return {}
 
@@ -1898,7 +1873,7 @@ def create_new_version(book, book_ver, message, major, minor):
                                      created=datetime.datetime.now())
     new_version.save()
 
-    for toc in book_ver.getTOC():
+    for toc in book_ver.get_toc_items(content=True):
         nchap = None
 
         if toc.chapter:
@@ -14,14 +14,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
-import re
-import decimal
 
 def remote_ping(request, message):
     """
-    Sends ping to the server. Just so we know client is still alive. It also removes old locks. This is not the place to do it at all, 
-    but once we have normal scheduled calls, will put it there.
+    Sends ping to the server. Just so we know client is still alive. Stale chapter locks are released by
+    Sputnik maintenance (see L{sputnik.maintenance}).
 
     @type request: C{django.http.HttpRequest}
     @param request: Client Request object
@@ -31,36 +28,8 @@ def remote_ping(request, message):
 
     import sputnik
 
-    sputnik.addMessageToChannel(request, "/booki/", {})
+    sputnik.addMessageToChannel(request, "/booki/", {}, coalesce="ping")
 
-    _now = time.time()
-
-    try:
-        locks = sputnik.rkeys("booki:*:locks:*") 
-    except:
-        return
-
-    for key in locks:
-        
-        lastAccess = sputnik.get(key)
-
-        if type(lastAccess) in [type(' '), type(u' ')]:
-            try:
-                lastAccess = decimal.Decimal(lastAccess)
-            except:
-                continue
-
-        if lastAccess and decimal.Decimal("%f" % _now) - lastAccess > 30:
-            sputnik.rdelete(key)
-
-            m = re.match("booki:(\d+):locks:(\d+):(\w+)", key)
-            
-            if m:
-                sputnik.addMessageToChannel(request, "/booki/book/%s/" % m.group(1), {"command": "chapter_status", 
-                                                                                      "chapterID": m.group(2), 
-                                                                                      "status": "normal", 
-                                                                                      "username": m.group(3)},
-                                            myself = True)
 # FIXME not implemented
 def remote_disconnect(request, message):
     pass
@@ -118,6 +87,10 @@ def remote_connect(request, message):
     if not clientID:
         return
 
+    # set our username, it has to be set before client is added to channels
+    if request.user and request.user.username.strip() != '' and request.sputnikID and request.sputnikID.find(' ') == -1:
+        sputnik.set("ses:%s:username" % request.sputnikID, request.user.username)
+
     # subscribe to this channels
     for chnl in message["channels"]:
         if not sputnik.hasChannel(chnl):
@@ -125,13 +98,8 @@ def remote_connect(request, message):
 
         sputnik.addClientToChannel(chnl, request.sputnikID)
 
-    # set our username
-    if request.user and request.user.username.strip() != '' and request.sputnikID and request.sputnikID.find(' ') == -1:
-        sputnik.set("ses:%s:username" % request.sputnikID, request.user.username)
-
     # set our last access
-    if request.sputnikID and request.sputnikID.strip() != '' and request.sputnikID and request.sputnikID.find(' ') == -1:
-        sputnik.set("ses:%s:last_access" % request.sputnikID, time.time())
+    sputnik.setLastAccess(request.sputnikID)
 
     return ret
     
@@ -76,10 +76,7 @@ def remote_group_create(request, message, profileid):
         group = create_booktype_group(groupName, groupDescription, request.user)
         group.members.add(request.user)
     except BooktypeGroupExist:
-        transaction.rollback()
         return {"created": False}
-    else:
-        transaction.commit()
 
     return {"created": True}
 
@@ -135,6 +132,9 @@ def remote_mood_set(request, message, profileid):
     ## html tags are removed
     moodMessage = strip_tags(message.get("value",""))[:30]
 
+    # transaction is committed by the dispatcher
+    sid = transaction.savepoint()
+
     import booktype.apps.account.signals
     booktype.apps.account.signals.account_status_changed.send(sender = request.user, message = message.get('value', ''))
 
@@ -145,9 +145,9 @@ def remote_mood_set(request, message, profileid):
     try:
         profile.save()
     except:
-        transaction.rollback()
+        transaction.savepoint_rollback(sid)
     else:
-        transaction.commit()
+        transaction.savepoint_commit(sid)
 
         ## propagate to other users
         ## probably should only send it to /booki/ channel
@@ -174,7 +174,6 @@ def remote_hide_book(request, message, profileid):
         book.hidden = False
 
     book.save()
-    transaction.commit()
 
     return {"result": True}
 
@@ -228,28 +227,19 @@ def remote_change_password(request, message, profileid):
 
     from django.contrib.auth.models import User
 
-#    except:
-#        transaction.rollback()
-#    else:
-#        transaction.commit()
-
     try:
         user = User.objects.get(username=profileid)
     except User.DoesNotExist:
-        transaction.rollback()
         return {"result": False}
 
     if user.username != request.user.username:
-        transaction.rollback()
         return {"result": False}
 
     if not user.check_password(message.get('password0', '')):
-        transaction.rollback()
         # invalid password
         return {"result": True, "status": 2}
 
     if message.get('password1','') != message.get('password2', ''):
-        transaction.rollback()
         # invalid password
         return {"result": True, "status": 3}
         
@@ -410,7 +410,7 @@ def exportBook(book_version):
     bzip = bookizip.BookiZip(zname, info=info)
     chapter_n = 1
 
-    for i, chapter in enumerate(models.BookToc.objects.filter(version=book_version).order_by("-weight")):
+    for i, chapter in enumerate(book_version.get_toc_items(content=True)):
         if chapter.chapter:
             # It's a real chapter! With content!
             try:
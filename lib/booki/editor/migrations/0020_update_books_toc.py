@@ -3,7 +3,6 @@ import datetime
 from south.db import db
 from south.v2 import DataMigration
 from django.db import models
-from booki.editor.models import BookVersion
 
 class Migration(DataMigration):
 
@@ -11,16 +10,17 @@ class Migration(DataMigration):
 
     def forwards(self, orm):
         "Write your forwards methods here."
-        for book_version in BookVersion.objects.all():
+        # frozen models, live ones have fields added by later migrations
+        for book_version in orm['editor.BookVersion'].objects.all():
             prev_section = None
 
-            for toc_item in book_version.get_toc():
+            for toc_item in orm['editor.BookToc'].objects.filter(version=book_version).order_by("-weight"):
                 # if item is section, the parent remains in None 
                 # but assign it as prev_section
-                if toc_item.is_section():
+                if toc_item.typeof == 0:
                     prev_section = toc_item
                 # if item is chapter, we assign prev_section as parent
-                elif toc_item.is_chapter():
+                elif toc_item.typeof == 1:
                     if prev_section:
                         toc_item.parent = prev_section
                         toc_item.save()
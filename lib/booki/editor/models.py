@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
 import os
-import time
+import json
 import datetime
+import mimetypes
 
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.utils.translation import ugettext_lazy as _
 
+import sputnik
+from booktype.utils import thumbnails
+
 # import booki.editor.signals
 
 
@@ -377,9 +381,114 @@ class BookVersion(models.Model):
         default=datetime.datetime.now)
     # add published
 
+    # materialized TOC, see get_toc_tree
+    toc_tree = models.TextField(_('toc tree'), blank=True, default='')
+    toc_revision = models.IntegerField(_('toc revision'), default=0)
+
     def get_toc(self):
         return BookToc.objects.filter(version=self).order_by("-weight")
 
+    def get_toc_items(self, content=False):
+        """
+        Returns TOC items together with their chapters and chapter statuses
+        in one query. Chapter content is not loaded unless C{content} is True.
+        """
+
+        items = self.get_toc().select_related('chapter', 'chapter__status')
+
+        if not content:
+            items = items.defer('chapter__content')
+
+        return items
+
+    def get_toc_rows(self):
+        """
+        Returns TOC as list of dictionaries in one query, without creating
+        model objects. Keys are C{id}, C{name}, C{typeof}, C{weight},
+        C{parent}, C{chapter}, C{chapter__title}, C{chapter__url_title},
+        C{chapter__status} and C{has_children}. C{parent}, C{chapter} and
+        C{chapter__status} are ids or None.
+        """
+
+        rows = list(self.get_toc().values(
+            'id', 'name', 'typeof', 'weight', 'parent', 'chapter',
+            'chapter__title', 'chapter__url_title', 'chapter__status'))
+
+        parents = set(row['parent'] for row in rows)
+
+        for row in rows:
+            row['has_children'] = row['id'] in parents
+
+        return rows
+
+    def build_toc_tree(self):
+        """
+        Builds nested TOC from the database. Every item is a dictionary with
+        keys C{id}, C{name}, C{typeof}, C{chapter}, C{title}, C{url_title},
+        C{status} and C{children}. Chapter fields are None for sections.
+        """
+
+        rows = self.get_toc_rows()
+        items = {}
+        tree = []
+
+        for row in rows:
+            items[row['id']] = {
+                'id': row['id'],
+                'name': row['name'],
+                'typeof': row['typeof'],
+                'chapter': row['chapter'],
+                'title': row['chapter__title'],
+                'url_title': row['chapter__url_title'],
+                'status': row['chapter__status'],
+                'children': []
+            }
+
+        for row in rows:
+            if row['parent'] in items:
+                items[row['parent']]['children'].append(items[row['id']])
+            else:
+                tree.append(items[row['id']])
+
+        return tree
+
+    def rebuild_toc(self):
+        """
+        Stores freshly built TOC tree and increments TOC revision. Must be
+        called in the same transaction which changed the TOC. Version row is
+        locked first, so concurrent changes are stored one after another.
+
+        @rtype: C{list}
+        @return: Returns TOC tree
+        """
+
+        revision = BookVersion.objects.select_for_update().filter(
+            pk=self.pk).values_list('toc_revision', flat=True)[0]
+
+        tree = self.build_toc_tree()
+
+        self.toc_tree = json.dumps(tree)
+        self.toc_revision = revision + 1
+
+        BookVersion.objects.filter(pk=self.pk).update(
+            toc_tree=self.toc_tree, toc_revision=self.toc_revision)
+
+        return tree
+
+    def get_toc_tree(self):
+        """
+        Returns materialized TOC tree (see L{build_toc_tree}) without going
+        through TOC items. It is built on first use.
+
+        @rtype: C{list}
+        @return: Returns TOC tree
+        """
+
+        if not self.toc_tree:
+            return self.rebuild_toc()
+
+        return json.loads(self.toc_tree)
+
     def get_hold_chapters(self):
         return Chapter.objects.raw('SELECT editor_chapter.* FROM editor_chapter LEFT OUTER JOIN editor_booktoc ON (editor_chapter.id=editor_booktoc.chapter_id)  WHERE editor_chapter.book_id=%s AND editor_chapter.version_id=%s AND editor_booktoc.chapter_id IS NULL', (self.book.id, self.id))
 
@@ -503,34 +612,94 @@ class Attachment(models.Model):
     status = models.ForeignKey(BookStatus, null=False, verbose_name=_("status"))
     created = models.DateTimeField(_('created'), null=False, auto_now=False, default=datetime.datetime.now)
 
+    # filled in when file is stored, see update_metadata
+    size = models.IntegerField(_('size'), null=True, blank=True)
+    mime_type = models.CharField(_('mime type'), max_length=100, blank=True, default='')
+    width = models.IntegerField(_('width'), null=True, blank=True)
+    height = models.IntegerField(_('height'), null=True, blank=True)
+    thumbnail_path = models.CharField(_('thumbnail path'), max_length=2500, blank=True, default='')
+
     def get_name(self):
         name = self.attachment.name
         return name[name.rindex('/')+1:]
 
+    def save(self, *args, **kwargs):
+        if self.attachment and self.size is None:
+            self.update_metadata()
+
+        super(Attachment, self).save(*args, **kwargs)
+
+        if self.width and not self.thumbnail_path:
+            self.update_thumbnail()
+
+    def update_metadata(self):
+        """
+        Reads size, mime type and image dimensions of the stored file. It is
+        called when attachment is saved for the first time with a file, so
+        listings never have to open the files.
+        """
+
+        self.size = self.attachment.size
+        self.mime_type = mimetypes.guess_type(self.attachment.name)[0] or ''
+        self.width = self.height = None
+        self.thumbnail_path = ''
+
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image
+
+        try:
+            im = Image.open(self.attachment.name)
+            self.width, self.height = im.size
+            self.mime_type = Image.MIME.get(im.format, self.mime_type)
+        except Exception:
+            pass
+
+    def update_thumbnail(self):
+        """
+        Stores name of the thumbnail if it already exists, otherwise
+        schedules its creation. Thumbnail name is stored by the task when
+        thumbnail is ready.
+        """
+
+        from booktype.apps.edit.tasks import create_attachment_thumbnails
+
+        name = thumbnails.get_thumbnail_name(thumbnails.get_digest(self.attachment.name),
+                                           thumbnails.get_sizes('attachment')[0])
+
+        if os.path.exists(thumbnails.get_thumbnail_path(name)):
+            self.thumbnail_path = name
+            Attachment.objects.filter(pk=self.pk).update(thumbnail_path=name)
+            return
+
+        # attachment must be in the database when task is executed
+        sputnik.after_commit(thumbnails.schedule, create_attachment_thumbnails, self.pk)
+
+    def get_thumbnail_url(self):
+        """
+        Returns URL of the thumbnail, URL of the placeholder if thumbnail is
+        not created yet or None if attachment is not an image.
+        """
+
+        if not self.width:
+            return None
+
+        return thumbnails.get_thumbnail_url(self.thumbnail_path)
+
     def delete(self):
         self.attachment.delete(save=False)
 
+        # thumbnails are shared by all images with the same content
+        if self.thumbnail_path and not Attachment.objects.filter(
+                thumbnail_path=self.thumbnail_path).exclude(pk=self.pk).exists():
+            thumbnails.delete_thumbnails(thumbnails.get_thumbnail_digest(self.thumbnail_path), 'attachment')
+
         super(Attachment, self).delete()
 
     def __unicode__(self):
         return self.attachment.name
 
-
-    def thumbnail(self, size=(100, 100)):
-        '''returns URL for a thumbnail with the specified size'''
-        from booki.utils.misc import createThumbnail
-        filename, ext = os.path.splitext(os.path.basename(self.attachment.url))
-        w, h = size
-        filename = '%s_%s_%s_%sx%s%s' % (filename, self.pk,
-                                         time.mktime(self.created.timetuple()),
-                                         w, h, ext)
-        im_path = uploadAttachmentTo(self, filename)
-        im_url =  getAttachmentUrl(self, filename)
-        if not os.path.exists(im_path):
-            im = createThumbnail(self.attachment, size=size)
-            im.save(im_path, 'JPEG')
-        return im_url
-
     class Meta:
         verbose_name = _('Attachment')
         verbose_name_plural = _('Attachments')
@@ -19,6 +19,7 @@ import re
 import os
 import string
 import json
+import mimetypes
 from random import choice
 
 from django.contrib import messages
@@ -40,6 +41,7 @@ from django.conf import settings
 from braces.views import LoginRequiredMixin
 from booktype.utils import config
 from booktype.utils import misc
+from booktype.utils import thumbnails
 from booki.messaging.views import get_endpoint_or_none
 from booktype.utils.book import check_book_availability, create_book
 from booki.editor.models import Book, License, BookHistory, BookiGroup
@@ -506,20 +508,21 @@ def profilethumbnail(request, profileid):
         name = u.get_profile().image.path
 
     try:
-        from PIL import Image
-    except ImportError:
-        import Image
+        width = int(request.GET.get('width', 24))
+    except ValueError:
+        width = 24
 
-    # Don't do much in case of Image handling errors
+    # only configured sizes are served, they are created by celery task and
+    # default image is shown until they are ready
+    size = thumbnails.get_size('profile', width)
 
     try:
-        image = Image.open(name)
-    except IOError:
-        image = Image.open(_get_default_profile())
+        path = thumbnails.get_thumbnail(name, 'profile', size)
+    except (IOError, OSError):
+        path = thumbnails.get_thumbnail(_get_default_profile(), 'profile', size)
 
-    image.thumbnail((int(request.GET.get('width', 24)), int(request.GET.get('width', 24))), Image.ANTIALIAS)
+    if path is None:
+        path = _get_default_profile()
 
-    response = HttpResponse(mimetype="image/jpg")
-    image.save(response, "JPEG")
-
-    return response
+    with open(path, 'rb') as f:
+        return HttpResponse(f.read(), mimetype=mimetypes.guess_type(path)[0])
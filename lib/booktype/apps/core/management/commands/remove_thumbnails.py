@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from booki.editor.models import Attachment, BookCover
+from booktype.apps.account.models import UserProfile
+from booktype.utils import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Removes thumbnails of images which are not used by any \
+        attachment, cover or profile image anymore'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--min-age', action='store', type='int', dest='min_age',
+            default=60 * 60,
+            help='Keep thumbnails younger than this many seconds'
+        ),
+    )
+
+    def get_image_paths(self):
+        "Returns paths of covers and profile images, they have no thumbnail stored in the database."
+
+        for cover in BookCover.objects.only('attachment').iterator():
+            yield cover.attachment.path
+
+        for profile in UserProfile.objects.exclude(image='').exclude(image__isnull=True).only('image').iterator():
+            yield profile.image.path
+
+        yield '%s/account/images/%s' % (settings.STATIC_ROOT, getattr(settings, 'DEFAULT_PROFILE_IMAGE', 'anonymous.png'))
+
+    def handle(self, *args, **options):
+        digests = set(thumbnails.get_thumbnail_digest(name) for name in
+                      Attachment.objects.exclude(thumbnail_path='').values_list('thumbnail_path', flat=True))
+
+        for path in self.get_image_paths():
+            try:
+                digests.add(thumbnails.get_digest(path))
+            except (IOError, OSError):
+                # image is gone, its thumbnails are not used
+                pass
+
+        removed = thumbnails.remove_orphans(digests, min_age=options['min_age'])
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write("Removed %d unused thumbnails.\n" % removed)
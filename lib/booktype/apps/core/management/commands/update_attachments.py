@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from booki.editor.models import Attachment
+
+
+class Command(BaseCommand):
+    help = 'Stores size, mime type, image dimensions and thumbnail for \
+        attachments uploaded before they were kept in the database'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--all', action='store_true',
+            help='Update all attachments, not just the ones without metadata'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        attachments = Attachment.objects.select_related('book', 'version')
+
+        if not options['all']:
+            attachments = attachments.filter(size__isnull=True)
+
+        updated = 0
+        missing = 0
+
+        for att in attachments.iterator():
+            try:
+                att.update_metadata()
+            except (IOError, OSError):
+                # file is gone, there is nothing to read
+                missing += 1
+                continue
+
+            att.save()
+            updated += 1
+
+        if int(options['verbosity']) > 0:
+            self.stdout.write("Updated %d attachments.\n" % updated)
+
+        if missing:
+            self.stderr.write("Could not read files of %d attachments.\n" % missing)
+
@@ -168,7 +168,8 @@
     var _isInitialized = false;
     var _messages = null;
     var _uid = 1;
-    var options = {'poll': true, 'iteration': 5000 };
+    var _socket = null;
+    var options = {'poll': true, 'iteration': 5000, 'longpoll': 0, 'websocket': '' };
       
     var Sputnik = function () {
       this.init();
@@ -205,6 +206,9 @@
 
         if (_isInitialized) { return; }
 
+        options['longpoll'] = win.booktype.sputnikLongPoll || 0;
+        options['websocket'] = win.booktype.sputnikWebSocketURL || '';
+
         this.interval();
 
         _isInitialized = true;
@@ -229,6 +233,12 @@
         _results[_uid] = [function (result) {
           win.booktype.clientID = result.clientID;
           $this.sendData();
+
+          if (options['websocket'] && win.WebSocket) {
+            $this.openSocket();
+          } else if (options['longpoll']) {
+            $this.longPoll();
+          }
         }, null];
         
         _uid += 1;
@@ -267,7 +277,9 @@
             if(d.getTime()-_lastAccess < 2000) {
             }
           */
-          if (win.booktype.clientID && _messages.length === 0) {
+          // with long polling there is always a request waiting on the server so ping is not needed
+          // and gateway is keeping connected clients alive
+          if (win.booktype.clientID && _messages.length === 0 && !options['longpoll'] && !_socket) {
             a.sendMessage({'channel': '/booki/', 'command': 'ping'}, function () {});
           }
 
@@ -279,6 +291,58 @@
         }, options['iteration']);
       },
         
+      longPoll: function () {
+        var a = this;
+
+        jquery.ajax({
+          'type': 'POST',
+          'url': win.booktype.sputnikDispatcherURL,
+          'data': {'clientID': win.booktype.clientID, 'messages': '[]', 'longpoll': options['longpoll']},
+          'dataType': 'json',
+          'timeout': (options['longpoll'] + 10) * 1000,
+          'global': false,
+          'success': function (data) {
+            if (data) {
+              jquery.each(data.messages, function (i, msg) {
+                a.receiveMessage(msg, data.result);
+              });
+            }
+
+            a.longPoll();
+          },
+          'error': function () {
+            // do not hammer the server if something is wrong
+            setTimeout(function () { a.longPoll(); }, options['iteration']);
+          }
+        });
+      },
+
+      openSocket: function () {
+        var a = this;
+        var socket = new win.WebSocket(options['websocket']);
+
+        socket.onopen = function () {
+          _socket = socket;
+          // register this client with the gateway
+          socket.send(JSON.stringify({'clientID': win.booktype.clientID, 'messages': []}));
+        };
+
+        socket.onmessage = function (event) {
+          var data = JSON.parse(event.data);
+
+          jquery.each(data.messages, function (i, msg) {
+            a.receiveMessage(msg, data.result);
+          });
+        };
+
+        socket.onclose = function () {
+          _socket = null;
+
+          // fall back to HTTP and try to connect again later
+          setTimeout(function () { a.openSocket(); }, options['iteration']);
+        };
+      },
+
       receiveMessage: function (message, result) {
         if (message.uid) {
           var res = _results[message.uid];
@@ -328,7 +392,11 @@
 
         _messages = [];
 
-      
+        if (_socket) {
+          _socket.send('{"clientID": ' + JSON.stringify(win.booktype.clientID) + ', "messages": ' + msgs + '}');
+          return;
+        }
+
         /*
           what to do in case of errors?!
         */
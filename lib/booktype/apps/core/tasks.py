@@ -0,0 +1,12 @@
+import celery
+
+from booktype.utils import thumbnails
+
+
+@celery.task
+def create_thumbnails(path, kind):
+    """
+    Creates thumbnails for the image in all sizes configured for this kind of image.
+    """
+
+    thumbnails.create_thumbnails(path, kind)
@@ -21,7 +21,7 @@ from lxml import etree, html
 
 from django.db.models import Q
 from django.conf import settings
-from django.db import transaction
+from django.db import connection
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 
@@ -31,6 +31,8 @@ from booki.utils.log import logBookHistory, logChapterHistory
 
 from booktype.utils.misc import booktype_slugify
 from booktype.apps.core.models import Role, BookRole
+from booktype.apps.edit import locks, snapshot
+from booktype.apps.account.models import UserProfile
 
 
 # this couple of functions should go to models.BookVersion
@@ -45,29 +47,29 @@ def get_toc_for_book(version):
     """
 
     results = []
-    for chap in version.get_toc():
-        parent_id = chap.parent.id if chap.parent else "root"
+    for chap in version.get_toc_rows():
+        parent_id = chap['parent'] or "root"
 
         # is it a section or chapter?
-        if chap.chapter:
+        if chap['chapter']:
             results.append((
-                chap.chapter.id,
-                chap.chapter.title,
-                chap.chapter.url_title,
-                chap.typeof,
-                chap.chapter.status.id,
+                chap['chapter'],
+                chap['chapter__title'],
+                chap['chapter__url_title'],
+                chap['typeof'],
+                chap['chapter__status'],
                 parent_id,
-                chap.id
+                chap['id']
             ))
         else:
             results.append((
-                chap.id,
-                chap.name,
-                chap.name,
-                chap.typeof,
+                chap['id'],
+                chap['name'],
+                chap['name'],
+                chap['typeof'],
                 None, # fake status
                 parent_id,
-                chap.id
+                chap['id']
             ))
     return results
 
@@ -95,38 +97,27 @@ def get_attachments(book_version):
       - dimension (tuple with width and height for image)
       - status (status id for this attachment)
       - name (name of the attachment)
+      - preview (URL of the thumbnail)
       - created (when attachmend was created)
       - size (size of attachment in bytes)
 
+    Everything is read from the database, files are not opened. Size,
+    dimensions and thumbnail are stored when attachment is uploaded.
+
     @type book_version: C{booki.editor.models.BookVersion}
     @param book_version: Booki version object
     @rtype: C{list}
     @return: Returns list of dictionaries with info about attachment
     """
 
-    import os.path
-    try:
-        from PIL import Image
-    except ImportError:
-        import Image
-
-    def _getDimension(att):
-        try:
-            im = Image.open(att.attachment.name)
-            return im.size
-        except:
-            pass
-
-        return None
-
     attachments = [{"id":        att.id,
-                    "dimension": _getDimension(att),
-                    "status":    att.status.id,
+                    "dimension": (att.width, att.height) if att.width else None,
+                    "status":    att.status_id,
                     "name":      os.path.split(att.attachment.name)[1],
-                    "preview":   att.thumbnail(),
+                    "preview":   att.get_thumbnail_url(),
                     "created":   str(att.created.strftime("%d.%m.%Y %H:%M:%S")),
-                    "size":      att.attachment.size}
-                   for att in book_version.get_attachments().order_by("attachment") if att.attachment]
+                    "size":      att.size}
+                   for att in book_version.get_attachments().select_related('book', 'version').order_by("attachment") if att.attachment]
 
     return attachments
 
@@ -170,6 +161,10 @@ def remote_init_editor(request, message, bookid, version):
      - attachments - result of getAttachments function
      - onlineUsers - list of online users
 
+    Chapters, hold chapters, statuses, attachments and metadata are kept in
+    the editor snapshot (see L{booktype.apps.edit.snapshot}) and are read from
+    the database only after they were changed.
+
     @type request: C{django.http.HttpRequest}
     @param request: Client Request object
     @type message: C{dict}
@@ -184,9 +179,17 @@ def remote_init_editor(request, message, bookid, version):
 
     book, book_version, book_security = get_book(request, bookid, version)
 
-    ## get chapters
-    chapters = get_toc_for_book(book_version)
-    holdChapters = get_hold_chapters(book_version)
+    ## get chapters, workflow statuses, attachments and metadata
+    parts = snapshot.get_parts(book_version, {
+        'toc': lambda: {'chapters': get_toc_for_book(book_version),
+                        'hold': get_hold_chapters(book_version)},
+        'statuses': lambda: [(status.id, status.name) for status in models.BookStatus.objects.filter(book=book).order_by("-weight")],
+        'attachments': lambda: get_attachments(book_version),
+        'metadata': lambda: [{'name': v.name, 'value': v.get_value()} for v in models.Info.objects.filter(book=book)]
+    })
+
+    toc = parts['toc'] or {'chapters': get_toc_for_book(book_version),
+                           'hold': get_hold_chapters(book_version)}
 
     ## get users
     def _get_username(a):
@@ -199,18 +202,6 @@ def remote_init_editor(request, message, bookid, version):
     except:
         users = []
 
-    ## get workflow statuses
-    statuses = [(status.id, status.name) for status in models.BookStatus.objects.filter(book=book).order_by("-weight")]
-
-    ## get attachments
-    try:
-        attachments = get_attachments(book_version)
-    except:
-        attachments = []
-
-    ## get metadata
-    metadata = [{'name': v.name, 'value': v.get_value()} for v in models.Info.objects.filter(book=book)]
-
     ## notify others
     sputnik.addMessageToChannel(request, "/chat/%s/" % bookid,
                                 {"command": "user_joined",
@@ -256,63 +247,32 @@ def remote_init_editor(request, message, bookid, version):
                                      "first_name": request.user.first_name,
                                      "last_name": request.user.last_name,
                                      "email": request.user.email,
-                                     "mood": moodMessage}
-                                    )
+                                     "mood": moodMessage},
+                                    coalesce="user_add:%s" % request.user.username)
 
     ## get online users and their mood messages
+    profiles = dict((p.user.username, p) for p in UserProfile.objects.filter(user__username__in=_onlineUsers).select_related('user'))
 
-    from django.contrib.auth.models import User
-
-    def _getUser(_user):
-        try:
-            _u = User.objects.get(username=_user)
-            return {
-                    'username':_user,
-                    'email': _u.email,
-                    'first_name': _u.first_name,
-                    'last_name': _u.last_name,
-                    'mood':_u.get_profile().mood
-                   }
-        except:
-            return None
-
-    onlineUsers = filter(bool, [x for x in [_getUser(x) for x in _onlineUsers] if x])
-
-    # for now, this is one big temp here
-
-    import time, decimal, re
+    onlineUsers = [{'username': _user,
+                    'email': profiles[_user].user.email,
+                    'first_name': profiles[_user].user.first_name,
+                    'last_name': profiles[_user].user.last_name,
+                    'mood': profiles[_user].mood}
+                   for _user in _onlineUsers if _user in profiles]
 
-    _now = time.time()
-    locks = {}
-
-    try:
-        for key in sputnik.rkeys("booki:*:locks:*"):
-            lastAccess = sputnik.get(key)
-
-            if type(lastAccess) in [type(' '), type(u' ')]:
-                try:
-                    lastAccess = decimal.Decimal(lastAccess)
-                except:
-                    continue
-
-                if lastAccess and decimal.Decimal("%f" % _now) - lastAccess <= 30:
-                    m = re.match("booki:(\d+):locks:(\d+):(\w+)", key)
-                    if m:
-                        if m.group(1) == bookid:
-                            locks[m.group(2)] = m.group(3)
-    except:
-        pass
+    ## get locked chapters
+    book_locks = locks.get_locks(bookid)
 
     return {"licenses": licenses,
-            "chapters": chapters,
-            "metadata": metadata,
-            "hold": holdChapters,
+            "chapters": toc['chapters'],
+            "metadata": parts['metadata'] or [],
+            "hold": toc['hold'],
             "users": users,
             "is_admin":  book_security.isAdmin(),
-            "locks": locks,
-            "statuses": statuses,
-            "attachments": attachments,
-            "onlineUsers": list(onlineUsers)}
+            "locks": book_locks,
+            "statuses": parts['statuses'] or [],
+            "attachments": parts['attachments'] or [],
+            "onlineUsers": onlineUsers}
 
 
 def remote_attachments_list(request, message, bookid, version):
@@ -334,12 +294,11 @@ def remote_attachments_list(request, message, bookid, version):
 
     book, book_version, book_security = get_book(request, bookid, version)
 
-    try:
-        attachments = get_attachments(book_version)
-    except:
-        attachments = []
+    parts = snapshot.get_parts(book_version, {
+        'attachments': lambda: get_attachments(book_version)
+    })
 
-    return {"attachments": attachments}
+    return {"attachments": parts['attachments'] or []}
 
 
 def remote_attachments_delete(request, message, bookid, version):
@@ -405,13 +364,14 @@ def remote_chapter_status(request, message, bookid, version):
     """
 
     if message["status"] == "normal":
-        sputnik.rdelete("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username))
+        locks.remove_lock(bookid, message["chapterID"], request.user.username)
 
     sputnik.addMessageToChannel(request, "/booktype/book/%s/%s/" % (bookid, version),
                                         {"command": "chapter_status",
                                          "chapterID": message["chapterID"],
                                          "status": message["status"],
-                                         "username": request.user.username})
+                                         "username": request.user.username},
+                                        coalesce="chapter_status:%s" % message["chapterID"])
 
     return {}
 
@@ -446,6 +406,7 @@ def remote_change_status(request, message, bookid, version):
     chapter.status = status
 
     chapter.save()
+    book_version.rebuild_toc()
 
     sputnik.addMessageToChannel(request, "/booktype/book/%s/%s/" % (bookid, version),
                                 {"command": "change_status",
@@ -552,9 +513,10 @@ def remote_chapter_save(request, message, bookid, version):
                                     {"command": "chapter_status",
                                      "chapterID": message["chapterID"],
                                      "status": "normal",
-                                     "username": request.user.username})
+                                     "username": request.user.username},
+                                    coalesce="chapter_status:%s" % message["chapterID"])
 
-        sputnik.rdelete("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username))
+        locks.remove_lock(bookid, message["chapterID"], request.user.username)
 
     # fire the signal
     import booki.editor.signals
@@ -597,6 +559,7 @@ def remote_chapter_delete(request, message, bookid, version):
     chap = models.Chapter.objects.get(
         id__exact=int(message["chapterID"]), version=book_version)
     chap.delete()
+    book_version.rebuild_toc()
 
     # MUST DELETE FROM TOC ALSO
 
@@ -702,6 +665,7 @@ def remote_section_delete(request, message, bookid, version):
         kind='section_delete'
     )
     sec.delete()
+    book_version.rebuild_toc()
 
     sputnik.addMessageToChannel(
         request, "/booktype/book/%s/%s/" % (bookid, version), {
@@ -754,6 +718,7 @@ def remote_chapter_rename(request, message, bookid, version):
     old_title = chapter.title
     chapter.title = message["chapter"]
     chapter.save()
+    book_version.rebuild_toc()
 
     logBookHistory(
         book=chapter.book,
@@ -824,6 +789,7 @@ def remote_section_rename(request, message, bookid, version):
     old_title = toc_item.name
     toc_item.name = message["chapter"]
     toc_item.save()
+    book_version.rebuild_toc()
 
     logBookHistory(
         book=book,
@@ -857,6 +823,85 @@ def remote_section_rename(request, message, bookid, version):
     return dict(result=True)
 
 
+# number of TOC items changed with one UPDATE statement
+TOC_UPDATE_BATCH = 300
+
+
+def reorder_toc(book_version, items):
+    """
+    Sets order and parents of TOC items. All TOC items of the version are
+    loaded with one query and only items which weight or parent changed
+    are written, with a few bulk updates.
+
+    Items which are not in this version are ignored and parent which is not
+    in this version is treated as "root".
+
+    @type book_version: C{booki.editor.models.BookVersion}
+    @param book_version: Book version object
+    @type items: C{list}
+    @param items: List of tuples (toc_item_id, parent_id) in TOC order.
+        Parent id is "root" for top level items.
+    @rtype: C{int}
+    @return: Returns number of changed TOC items
+    """
+
+    toc = dict((item['id'], item) for item in models.BookToc.objects.filter(
+        version=book_version).values('id', 'weight', 'parent'))
+
+    weights = {}
+    parents = {}
+    weight = len(items)
+
+    for item_id, parent_id in items:
+        try:
+            item_id = int(item_id)
+        except (TypeError, ValueError):
+            item_id = None
+
+        try:
+            parent_id = int(parent_id)
+        except (TypeError, ValueError):
+            parent_id = None
+
+        if parent_id not in toc:
+            parent_id = None
+
+        if item_id in toc:
+            if toc[item_id]['weight'] != weight:
+                weights[item_id] = weight
+
+            if toc[item_id]['parent'] != parent_id:
+                parents.setdefault(parent_id, []).append(item_id)
+
+        weight -= 1
+
+    for parent_id, ids in parents.iteritems():
+        models.BookToc.objects.filter(id__in=ids).update(parent=parent_id)
+
+    ids = weights.keys()
+    cursor = connection.cursor()
+
+    for n in range(0, len(ids), TOC_UPDATE_BATCH):
+        batch = ids[n:n + TOC_UPDATE_BATCH]
+        params = []
+
+        for item_id in batch:
+            params += [item_id, weights[item_id]]
+
+        cursor.execute("UPDATE %s SET weight = CASE id %s END WHERE id IN (%s)" % (
+            connection.ops.quote_name(models.BookToc._meta.db_table),
+            " ".join(["WHEN %s THEN %s"] * len(batch)),
+            ", ".join(["%s"] * len(batch))), params + batch)
+
+    changed = len(set(weights.keys()).union(*parents.values()))
+
+    if changed:
+        # bulk updates do not send signals
+        snapshot.invalidate(book_version.book_id, 'toc', book_version.id)
+
+    return changed
+
+
 def remote_chapters_changed(request, message, bookid, version):
     """
     Reorders the TOC.
@@ -884,8 +929,6 @@ def remote_chapters_changed(request, message, bookid, version):
 
     book, book_version, book_security = get_book(request, bookid, version)
 
-    weight = len(lst)
-
     logBookHistory(
        book = book,
        version = book_version,
@@ -893,28 +936,7 @@ def remote_chapters_changed(request, message, bookid, version):
        kind = "chapter_reorder"
     )
 
-    for chap in lst:
-        try:
-            toc_item =  models.BookToc.objects.get(id__exact=int(chap[0]), version=book_version)
-            toc_item.weight = weight
-
-            # check if toc item has parent
-            parent = None
-            if chap[1] != 'root':
-                try:
-                    parent = models.BookToc.objects.get(
-                        id__exact=int(chap[1]),
-                        version=book_version
-                    )
-                except Exception, e:
-                    pass
-
-            toc_item.parent = parent
-            toc_item.save()
-        except Exception, e:
-            print e
-
-        weight -= 1
+    reorder_toc(book_version, lst)
 
     if message["kind"] == "remove":
         if type(message["chapter_id"]) == type(u' ') and message["chapter_id"][0] == 's':
@@ -924,6 +946,8 @@ def remote_chapters_changed(request, message, bookid, version):
             m =  models.BookToc.objects.get(chapter__id__exact=int(message["chapter_id"]), version=book_version)
             m.delete()
 
+    book_version.rebuild_toc()
+
 #        addMessageToChannel(request, "/chat/%s/%s/" % (projectid, bookid), {"command": "message_info", "from": request.user.username, "message": 'User %s has rearranged chapters.' % request.user.username})
 
     sputnik.addMessageToChannel(
@@ -950,6 +974,7 @@ def remote_chapter_hold(request, message, bookid, version):
     toc_item = models.BookToc.objects.get(chapter__id__exact=chapterID, version=book_version)
     toc_id = toc_item.id
     toc_item.delete()
+    book_version.rebuild_toc()
 
     sputnik.addMessageToChannel(
         request, "/booktype/book/%s/%s/" % (bookid, version), {
@@ -978,6 +1003,7 @@ def remote_chapter_unhold(request, message, bookid, version):
         typeof = 1
     )
     toc_item.save()
+    book_version.rebuild_toc()
 
     sputnik.addMessageToChannel(
         request, "/booktype/book/%s/%s/" % (bookid, version), {
@@ -1044,16 +1070,15 @@ def remote_get_chapter(request, message, bookid, version):
     if not message.get("lock", True):
         return res
 
-    import time
-
     # set the initial timer for editor
-    sputnik.set("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username), time.time())
+    locks.set_lock(bookid, message["chapterID"], request.user.username)
 
     sputnik.addMessageToChannel(request, "/booki/book/%s/%s/" % (bookid, version),
                                 {"command": "chapter_status",
                                  "chapterID": message["chapterID"],
                                  "status": "edit",
-                                 "username": request.user.username})
+                                 "username": request.user.username},
+                                coalesce="chapter_status:%s" % message["chapterID"])
 
     return res
 
@@ -1122,7 +1147,7 @@ def remote_create_chapter(request, message, bookid, version):
     )
     chapter.save()
 
-    weight = len(book_version.get_toc()) + 1
+    weight = book_version.get_toc().count() + 1
     for itm in models.BookToc.objects.filter(
         version=book_version, book=book
     ).order_by("-weight"):
@@ -1141,6 +1166,7 @@ def remote_create_chapter(request, message, bookid, version):
         typeof=1
     )
     toc_item.save()
+    book_version.rebuild_toc()
 
     history = logChapterHistory(
         chapter=chapter,
@@ -1300,7 +1326,7 @@ def remote_clone_chapter(request, message, bookid, version):
     # this should be solved in better way
     # should have createChapter in booki.utils.book module
 
-    toc_items = len(book_version.get_toc())+1
+    toc_items = book_version.get_toc().count()+1
 
     for itm in models.BookToc.objects.filter(version = book_version, book = book):
         itm.weight = toc_items
@@ -1316,6 +1342,7 @@ def remote_clone_chapter(request, message, bookid, version):
                         typeof = 1)
 
     tc.save()
+    book_version.rebuild_toc()
 
     history = logChapterHistory(chapter = chapter,
                                 content = chapter.content,
@@ -1427,6 +1454,7 @@ def remote_create_section(request, message, bookid, version):
 
     result = True
     c.save()
+    book_version.rebuild_toc()
 
     logBookHistory(
         book=book,
@@ -1781,8 +1809,6 @@ def remote_cover_load(request, message, bookid, version):
 
     licenses = [(elem.abbrevation, elem.name) for elem in models.License.objects.all().order_by("name")]
 
-    transaction.commit()
-
     return {"result": True, "cover": cover, "licenses": licenses}
 
 
@@ -1929,8 +1955,6 @@ def remote_license_attributions_save(request, message, bookid, version):
         a = models.AttributionExclude(book = book, user = u)
         a.save()
 
-    transaction.commit()
-
     return {"result": True}
 
 
@@ -2057,9 +2081,7 @@ def remote_book_status_rename(request, message, bookid, version):
         bs.name = strip_tags(message["status_name"].strip())
         bs.save()
     except models.BookStatus.DoesNotExist:
-        transaction.rollback()
-    else:
-        transaction.commit()
+        pass
 
     qs = models.BookStatus.objects.filter(book=book).order_by("-weight")
     all_statuses = [(status.id, status.name) for status in qs ]
@@ -2479,13 +2501,10 @@ def remote_book_notification(request, message, bookid, version):
 
     res = {"result": True}
 
-    import time
-
-    # rcon.delete(key)
     # set the initial timer for editor
 
     if request.user.username and request.user.username != '':
-        sputnik.set("booki:%s:locks:%s:%s" % (bookid, message["chapterID"], request.user.username), time.time())
+        locks.set_lock(bookid, message["chapterID"], request.user.username)
 
         if '%s' % sputnik.get("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], request.user.username)) == '1':
             sputnik.rdelete("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], request.user.username))
@@ -2842,15 +2861,11 @@ def remote_unlock_chapter(request, message, bookid, version):
     @param version: Book version
     """
 
-    import re
-
     book, book_version, book_security = get_book(request, bookid, version)
 
     if book_security.isAdmin():
-        for key in sputnik.rkeys("booki:%s:locks:%s:*" % (bookid, message["chapterID"])):
-            m = re.match("booki:(\d+):locks:(\d+):(\w+)", key)
-            if m:
-                sputnik.set("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], m.group(3)), 1)
+        for username in locks.get_lock_owners(bookid, message["chapterID"]):
+            sputnik.set("booki:%s:killlocks:%s:%s" % (bookid, message["chapterID"], username), 1)
 
     return {"result": True}
 
@@ -2924,7 +2939,7 @@ def create_new_version(book, book_ver, message, major, minor):
                                      created=datetime.datetime.now())
     new_version.save()
 
-    for toc in book_ver.get_toc():
+    for toc in book_ver.get_toc_items(content=True):
         nchap = None
 
         if toc.chapter:
@@ -2969,6 +2984,8 @@ def create_new_version(book, book_ver, message, major, minor):
         a.attachment.save(att.get_name(), att.attachment, save = False)
         a.save()
 
+    new_version.rebuild_toc()
+
     book.version = new_version
     book.save()
 
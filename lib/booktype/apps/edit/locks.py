@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Chapter locks for the editor.
+
+Chapter is locked while somebody is editing it. Editor is sending heartbeat
+and lock is released if there was no heartbeat for LOCK_TIMEOUT seconds.
+
+Redis keys:
+  - booki:<book_id>:locks - Redis Hash of locks for one book. Field is
+    "<chapter_id>:<username>" and value is timestamp of the last heartbeat.
+  - booki:locks - Redis Sorted Set of all locks in the system. Member is
+    "<book_id>:<chapter_id>:<username>" scored by timestamp of the last heartbeat.
+  - booki:<book_id>:killlocks:<chapter_id>:<username> - Set when admin asks
+    user to stop editing the chapter.
+"""
+
+import time
+
+import sputnik
+
+
+# lock is released if there was no heartbeat for this many seconds
+LOCK_TIMEOUT = 30
+
+# Removes locks which had no heartbeat before the deadline.
+#   KEYS[1] - Redis Sorted Set of all locks
+#   ARGV[1] - deadline
+#   ARGV[2] - maximum number of locks to remove
+# Returns list of removed locks.
+RELEASE_SCRIPT = """
+local locks = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+
+for _, lock in ipairs(locks) do
+    local sep = string.find(lock, ':', 1, true)
+
+    redis.call('ZREM', KEYS[1], lock)
+    redis.call('HDEL', 'booki:' .. string.sub(lock, 1, sep - 1) .. ':locks', string.sub(lock, sep + 1))
+end
+
+return locks
+"""
+
+release_script = sputnik.rcon.register_script(RELEASE_SCRIPT)
+
+
+def set_lock(bookid, chapterid, username, timestamp=None):
+    """
+    Creates lock for the chapter or refreshes heartbeat of existing lock.
+    """
+
+    timestamp = timestamp or time.time()
+
+    with sputnik.batch():
+        sputnik.execute('hset', 'booki:%s:locks' % bookid, '%s:%s' % (chapterid, username), timestamp)
+        sputnik.execute('zadd', 'booki:locks', **{'%s:%s:%s' % (bookid, chapterid, username): timestamp})
+
+
+def remove_lock(bookid, chapterid, username):
+    """
+    Removes lock user has on the chapter.
+    """
+
+    with sputnik.batch():
+        sputnik.execute('hdel', 'booki:%s:locks' % bookid, '%s:%s' % (chapterid, username))
+        sputnik.execute('zrem', 'booki:locks', '%s:%s:%s' % (bookid, chapterid, username))
+
+
+def get_locks(bookid):
+    """
+    Returns active locks for the book.
+
+    @rtype: C{dict}
+    @return: Returns dictionary {chapter_id: username}
+    """
+
+    _now = time.time()
+    locks = {}
+
+    for key, last_access in (sputnik.execute('hgetall', 'booki:%s:locks' % bookid) or {}).iteritems():
+        try:
+            if _now - float(last_access) > LOCK_TIMEOUT:
+                continue
+        except ValueError:
+            continue
+
+        chapterid, username = key.split(':', 1)
+        locks[chapterid] = username
+
+    return locks
+
+
+def get_lock_owners(bookid, chapterid):
+    """
+    Returns list of users who have lock on the chapter.
+    """
+
+    prefix = '%s:' % chapterid
+
+    return [key[len(prefix):] for key in sputnik.execute('hkeys', 'booki:%s:locks' % bookid) or []
+            if key.startswith(prefix)]
+
+
+def release_stale_locks(limit=sputnik.MAINTENANCE_BATCH_SIZE):
+    """
+    Removes locks which had no heartbeat for LOCK_TIMEOUT seconds and notifies
+    users on the book channel. Handles at most limit locks at once.
+
+    @rtype: C{int}
+    @return: Returns number of released locks.
+    """
+
+    locks = sputnik.evalscript(release_script, ['booki:locks'], [time.time() - LOCK_TIMEOUT, limit]) or []
+
+    with sputnik.batch():
+        for lock in locks:
+            bookid, chapterid, username = lock.split(':', 2)
+
+            sputnik.addMessageToChannel2(None, None, "/booki/book/%s/" % bookid,
+                                         {"command": "chapter_status",
+                                          "chapterID": chapterid,
+                                          "status": "normal",
+                                          "username": username},
+                                         myself=True, coalesce="chapter_status:%s" % chapterid)
+
+    return len(locks)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Editor app has no models of its own. Signal handlers below invalidate
+# cached editor snapshot when models it is built from are changed.
+
+from django.db.models import signals
+
+from booki.editor import models
+from booktype.apps.edit import snapshot
+
+
+# chapter fields which are part of the TOC
+TOC_FIELDS = ('title', 'url_title', 'status_id')
+
+
+def _toc_values(chapter):
+    return tuple(getattr(chapter, name, None) for name in TOC_FIELDS)
+
+
+def chapter_loaded(sender, instance, **kwargs):
+    instance._toc_values = _toc_values(instance)
+
+
+def chapter_saved(sender, instance, created=False, **kwargs):
+    """
+    Invalidates TOC only when chapter is created or TOC fields were changed,
+    saving chapter content does not touch the snapshot.
+    """
+
+    if created or getattr(instance, '_toc_values', None) != _toc_values(instance):
+        snapshot.invalidate(instance.book_id, 'toc', instance.version_id)
+
+    instance._toc_values = _toc_values(instance)
+
+
+def toc_changed(sender, instance, **kwargs):
+    snapshot.invalidate(instance.book_id, 'toc', instance.version_id)
+
+
+def attachments_changed(sender, instance, **kwargs):
+    snapshot.invalidate(instance.book_id, 'attachments', instance.version_id)
+
+
+def statuses_changed(sender, instance, **kwargs):
+    snapshot.invalidate(instance.book_id, 'statuses')
+
+
+def metadata_changed(sender, instance, **kwargs):
+    snapshot.invalidate(instance.book_id, 'metadata')
+
+
+signals.post_init.connect(chapter_loaded, sender=models.Chapter)
+signals.post_save.connect(chapter_saved, sender=models.Chapter)
+signals.post_delete.connect(toc_changed, sender=models.Chapter)
+
+for _sender, _handler in ((models.BookToc, toc_changed),
+                          (models.Attachment, attachments_changed),
+                          (models.BookStatus, statuses_changed),
+                          (models.Info, metadata_changed)):
+    signals.post_save.connect(_handler, sender=_sender)
+    signals.post_delete.connect(_handler, sender=_sender)
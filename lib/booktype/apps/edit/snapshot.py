@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cached parts of the editor bootstrap data.
+
+Opening the editor needs TOC, statuses, attachments and metadata of the book.
+They change much less often than editors open the book, so they are built
+once and kept in Redis as JSON until some edit operation changes them.
+
+Every part has generation counter. Edit operations only increment the
+counter (see L{invalidate} and signal handlers in
+C{booktype.apps.edit.models}) and cached data of older generation is ignored,
+so data built from the database while somebody was changing it can not
+overwrite newer data. Counter is incremented when data is changed and once
+more after the transaction is committed, because part built in between was
+built from the old rows. Cached data also expires after SNAPSHOT_TIMEOUT
+seconds.
+
+Redis keys:
+  - booki:<book_id>:snapshot - Redis Hash of generation counters. Field is
+    part name for book parts and "<part>:<version_id>" for version parts.
+  - booki:<book_id>:snapshot:<field> - Cached part as "<generation>|<json>".
+"""
+
+import json
+import logging
+
+import sputnik
+
+
+logger = logging.getLogger('booktype')
+
+# cached parts expire after this many seconds even if nothing changed
+SNAPSHOT_TIMEOUT = 60 * 60
+
+# part name -> scope, "version" parts are kept for every book version
+PARTS = {
+    'toc': 'version',
+    'attachments': 'version',
+    'statuses': 'book',
+    'metadata': 'book'
+}
+
+
+def _field(part, version_id=None):
+    if PARTS[part] == 'version':
+        return '%s:%s' % (part, version_id)
+
+    return part
+
+
+def _increment(book_id, field):
+    try:
+        sputnik.execute('hincrby', 'booki:%s:snapshot' % book_id, field, 1)
+    except Exception:
+        logger.exception('Could not invalidate editor snapshot.')
+
+
+def invalidate(book_id, part, version_id=None):
+    """
+    Marks cached part as changed. It will be built again next time editor
+    is opened. Part is marked as changed again after the transaction is
+    committed.
+
+    @type book_id: C{int}
+    @param book_id: Book id
+    @type part: C{string}
+    @param part: Part name, one of L{PARTS}
+    @type version_id: C{int}
+    @param version_id: Book version id, only for version parts
+    """
+
+    field = _field(part, version_id)
+
+    _increment(book_id, field)
+    sputnik.after_commit(_increment, book_id, field)
+
+
+def get_parts(book_version, builders):
+    """
+    Returns cached parts for the book version. Parts which are not cached or
+    are out of date are built and stored. It is one Redis round trip when
+    everything is cached.
+
+    @type book_version: C{booki.editor.models.BookVersion}
+    @param book_version: Book version object
+    @type builders: C{dict}
+    @param builders: Part name -> function without arguments which builds
+        the part from the database
+    @rtype: C{dict}
+    @return: Returns part name -> data. Data is None if builder failed.
+    """
+
+    book_id = book_version.book_id
+    names = builders.keys()
+    fields = [_field(name, book_version.id) for name in names]
+
+    with sputnik.batch() as b:
+        sputnik.execute('hmget', 'booki:%s:snapshot' % book_id, fields)
+        sputnik.execute(
+            'mget', ['booki:%s:snapshot:%s' % (book_id, f) for f in fields])
+
+    generations, cached = b.results
+    parts = {}
+    missing = []
+
+    for name, field, generation, data in zip(names, fields,
+                                             generations, cached):
+        generation = generation or '0'
+
+        if data and data.split('|', 1)[0] == generation:
+            parts[name] = json.loads(data.split('|', 1)[1])
+            continue
+
+        try:
+            parts[name] = builders[name]()
+        except Exception:
+            logger.exception('Could not build editor snapshot part %s.' % name)
+            parts[name] = None
+            continue
+
+        missing.append((field, generation, parts[name]))
+
+    if missing:
+        with sputnik.batch():
+            for field, generation, data in missing:
+                sputnik.execute(
+                    'set', 'booki:%s:snapshot:%s' % (book_id, field),
+                    '%s|%s' % (generation, json.dumps(data)),
+                    ex=SNAPSHOT_TIMEOUT)
+
+    return parts
@@ -6,6 +6,8 @@ import httplib
 import sputnik
 
 from booki.editor import models
+from booktype.utils import thumbnails
+from booktype.apps.edit import snapshot
 
 def fetch_url(url, data):
     try:
@@ -84,4 +86,23 @@ def publish_book(*args, **kwargs):
         )
 
         if dta['state'] in ['SUCCESS', 'FAILURE']:
-            break
\ No newline at end of file
+            break
+
+@celery.task
+def create_attachment_thumbnails(attachment_id):
+    """
+    Creates thumbnails for the attachment, marks them as ready and lets
+    editors know about it.
+    """
+
+    try:
+        att = models.Attachment.objects.get(pk=attachment_id)
+    except models.Attachment.DoesNotExist:
+        # removed in the meantime
+        return
+
+    names = thumbnails.create_thumbnails(att.attachment.name, 'attachment')
+    name = names[thumbnails.get_sizes('attachment')[0]]
+
+    models.Attachment.objects.filter(pk=att.pk).update(thumbnail_path=name)
+    snapshot.invalidate(att.book_id, 'attachments', att.version_id)
@@ -0,0 +1,173 @@
+import os
+import datetime
+import shutil
+import tempfile
+import StringIO
+
+import celery
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+import sputnik
+from booki.editor import models
+from booktype.utils import thumbnails
+from booktype.apps.edit.channel import get_attachments
+from booktype.apps.core.tests.factory_models import BookFactory, BookVersionFactory, BookStatusFactory
+
+
+class AttachmentMetadataTest(TestCase):
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.settings = override_settings(DATA_ROOT=self.data_root)
+        self.settings.enable()
+
+        # default storage does not allow files outside of MEDIA_ROOT
+        self.field = models.Attachment._meta.get_field('attachment')
+        self.storage = self.field.storage
+        self.field.storage = FileSystemStorage(location=self.data_root)
+
+        # thumbnails are created right away
+        self.conf = celery.current_app.conf
+        self.eager = self.conf.CELERY_ALWAYS_EAGER
+        self.conf.CELERY_ALWAYS_EAGER = True
+
+        self.book = BookFactory()
+        self.version = BookVersionFactory(book=self.book)
+        self.status = BookStatusFactory(book=self.book)
+
+    def tearDown(self):
+        sputnik.discard_after_commit()
+
+        for key in sputnik.rcon.keys('booktype:thumbnails:digest:%s*' % self.data_root):
+            sputnik.rcon.delete(key)
+
+        self.conf.CELERY_ALWAYS_EAGER = self.eager
+        self.field.storage = self.storage
+        self.settings.disable()
+        shutil.rmtree(self.data_root)
+
+    def _attach(self, name, content, commit=True):
+        att = models.Attachment(book=self.book, version=self.version, status=self.status)
+        att.attachment.save(name, ContentFile(content), save=False)
+        att.save()
+
+        # thumbnails are scheduled when transaction is committed
+        if commit:
+            sputnik.run_after_commit()
+
+        return models.Attachment.objects.get(pk=att.pk)
+
+    def _image(self, size):
+        f = StringIO.StringIO()
+        Image.new('RGB', size).save(f, 'PNG')
+
+        return f.getvalue()
+
+    def test_image(self):
+        content = self._image((300, 200))
+        att = self._attach('image.png', content)
+
+        self.assertEqual((att.width, att.height, att.size), (300, 200, len(content)))
+        self.assertEqual(att.mime_type, 'image/png')
+        self.assertTrue(att.thumbnail_path.startswith('thumbnails/'))
+        self.assertTrue(os.path.exists(os.path.join(self.data_root, att.thumbnail_path)))
+        self.assertTrue(att.get_thumbnail_url().endswith(att.thumbnail_path))
+
+        # the same image stored again shares the thumbnail
+        other = self._attach('copy.png', content)
+
+        self.assertEqual(other.thumbnail_path, att.thumbnail_path)
+
+    def test_pending_thumbnail(self):
+        att = self._attach('image.png', self._image((50, 50)), commit=False)
+
+        self.assertEqual(att.thumbnail_path, '')
+        self.assertTrue(att.get_thumbnail_url().endswith(thumbnails.PLACEHOLDER))
+
+        sputnik.run_after_commit()
+        att = models.Attachment.objects.get(pk=att.pk)
+
+        self.assertTrue(att.get_thumbnail_url().endswith('.jpg'))
+
+    def test_delete(self):
+        content = self._image((60, 60))
+        att = self._attach('image.png', content)
+        other = self._attach('copy.png', content)
+        path = os.path.join(self.data_root, att.thumbnail_path)
+
+        att.delete()
+        self.assertTrue(os.path.exists(path))
+
+        other.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_remove_orphans(self):
+        att = self._attach('image.png', self._image((70, 70)))
+        path = os.path.join(self.data_root, att.thumbnail_path)
+        orphan = os.path.join(os.path.dirname(path), 'orphan_100x100_crop.jpg')
+        shutil.copy(path, orphan)
+
+        self.assertEqual(thumbnails.remove_orphans(set([thumbnails.get_thumbnail_digest(att.thumbnail_path)]),
+                                                   min_age=0), 1)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_remove_thumbnails_command(self):
+        from django.core.management import call_command
+
+        att = self._attach('image.png', self._image((70, 70)))
+        path = os.path.join(self.data_root, att.thumbnail_path)
+
+        field = models.BookCover._meta.get_field('attachment')
+        storage = field.storage
+        field.storage = FileSystemStorage(location=self.data_root)
+
+        try:
+            cover = models.BookCover(book=self.book, user=self.book.owner, cid='test', width=0, height=0,
+                                      created=datetime.datetime.now())
+            cover.attachment.save('cover.png', ContentFile(self._image((80, 80))), save=False)
+            cover.save()
+
+            # cover thumbnails are not stored in the database
+            cover_names = thumbnails.create_thumbnails(cover.attachment.path, 'cover').values()
+            orphan = os.path.join(os.path.dirname(path), 'orphan_100x100_crop.jpg')
+            shutil.copy(path, orphan)
+
+            # digests of covers are not cached anymore
+            sputnik.rcon.delete('booktype:thumbnails:digest:%s' % cover.attachment.path)
+
+            call_command('remove_thumbnails', min_age=0, stdout=StringIO.StringIO())
+        finally:
+            field.storage = storage
+
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(orphan))
+
+        for name in cover_names:
+            self.assertTrue(os.path.exists(thumbnails.get_thumbnail_path(name)))
+
+    def test_other_file(self):
+        att = self._attach('notes.txt', 'some notes')
+
+        self.assertEqual((att.width, att.height, att.size), (None, None, 10))
+        self.assertEqual(att.mime_type, 'text/plain')
+        self.assertEqual(att.get_thumbnail_url(), None)
+
+    def test_listing(self):
+        self._attach('image.png', self._image((40, 30)))
+        self._attach('notes.txt', 'some notes')
+
+        with self.assertNumQueries(1):
+            attachments = get_attachments(self.version)
+
+        self.assertEqual([(a['name'], a['dimension']) for a in attachments],
+                         [('image.png', (40, 30)), ('notes.txt', None)])
+        self.assertTrue(attachments[0]['preview'].endswith('.jpg'))
@@ -0,0 +1,51 @@
+import time
+
+from django.test import TestCase
+
+import sputnik
+from booktype.apps.edit import locks
+
+
+class ChapterLocksTest(TestCase):
+    BOOK = '9001'
+
+    def setUp(self):
+        self._cleanup()
+
+    def tearDown(self):
+        self._cleanup()
+
+    def _cleanup(self):
+        sputnik.rdelete('booki:%s:locks' % self.BOOK)
+        sputnik.rdelete('booki:locks')
+
+    def test_get_locks(self):
+        locks.set_lock(self.BOOK, 1, 'booktype')
+        locks.set_lock(self.BOOK, 2, 'other')
+        locks.set_lock('9002', 3, 'booktype')
+
+        self.assertEqual(locks.get_locks(self.BOOK), {'1': 'booktype', '2': 'other'})
+        self.assertEqual(locks.get_lock_owners(self.BOOK, 2), ['other'])
+
+        locks.remove_lock(self.BOOK, 2, 'other')
+        locks.remove_lock('9002', 3, 'booktype')
+
+        self.assertEqual(locks.get_locks(self.BOOK), {'1': 'booktype'})
+        self.assertEqual(sputnik.rcon.zcard('booki:locks'), 1)
+
+    def test_stale_lock(self):
+        locks.set_lock(self.BOOK, 1, 'booktype', time.time() - locks.LOCK_TIMEOUT - 1)
+
+        self.assertEqual(locks.get_locks(self.BOOK), {})
+
+    def test_release_stale_locks(self):
+        locks.set_lock(self.BOOK, 1, 'booktype', time.time() - locks.LOCK_TIMEOUT - 2)
+        locks.set_lock(self.BOOK, 2, 'booktype', time.time() - locks.LOCK_TIMEOUT - 1)
+        locks.set_lock(self.BOOK, 3, 'booktype')
+
+        self.assertEqual(locks.release_stale_locks(limit=1), 1)
+        self.assertEqual(locks.release_stale_locks(), 1)
+        self.assertEqual(locks.release_stale_locks(), 0)
+
+        self.assertEqual(sputnik.rcon.hkeys('booki:%s:locks' % self.BOOK), ['3:booktype'])
+        self.assertEqual(sputnik.rcon.zrange('booki:locks', 0, -1), ['%s:3:booktype' % self.BOOK])
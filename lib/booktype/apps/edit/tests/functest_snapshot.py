@@ -0,0 +1,131 @@
+from django.db import transaction
+from django.http import HttpRequest
+from django.test import TestCase, TransactionTestCase
+
+import sputnik
+from sputnik.views import process_messages
+from booki.editor import models
+from booktype.apps.edit import snapshot
+from booktype.apps.core.tests.factory_models import BookFactory, BookVersionFactory
+from booktype.apps.core.tests.factory_models import BookStatusFactory, ChapterFactory, BookTocFactory
+
+
+class EditorSnapshotTest(TestCase):
+    def setUp(self):
+        self.book = BookFactory()
+        self.version = BookVersionFactory(book=self.book)
+        self.status = BookStatusFactory(book=self.book)
+        self.chapter = ChapterFactory(book=self.book, version=self.version, status=self.status)
+        self.built = []
+
+        self._cleanup()
+
+    def tearDown(self):
+        sputnik.discard_after_commit()
+        self._cleanup()
+
+    def _cleanup(self):
+        for key in sputnik.rcon.keys('booki:%s:snapshot*' % self.book.id):
+            sputnik.rdelete(key)
+
+    def _builder(self, name):
+        def _build():
+            self.built.append(name)
+            return [name, len(self.built)]
+
+        return _build
+
+    def _get(self):
+        return snapshot.get_parts(self.version, {
+            'toc': self._builder('toc'),
+            'statuses': self._builder('statuses')
+        })
+
+    def test_cached(self):
+        parts = self._get()
+
+        self.assertEqual(sorted(self.built), ['statuses', 'toc'])
+        self.assertEqual(self._get(), parts)
+        self.assertEqual(len(self.built), 2)
+
+    def test_invalidate(self):
+        self._get()
+
+        self.chapter.content = 'changed content'
+        self.chapter.save()
+        self._get()
+
+        self.assertEqual(len(self.built), 2)
+
+        self.chapter.title = 'Renamed chapter'
+        self.chapter.save()
+        self._get()
+
+        self.assertEqual(self.built[2:], ['toc'])
+
+        BookTocFactory.create_toc(self.book, self.version, self.chapter)
+        BookStatusFactory(book=self.book)
+        self._get()
+
+        self.assertEqual(sorted(self.built[3:]), ['statuses', 'toc'])
+
+    def test_other_version(self):
+        self._get()
+
+        other = BookVersionFactory(book=self.book, minor=1)
+        ChapterFactory(book=self.book, version=other, status=self.status)
+        self._get()
+
+        self.assertEqual(len(self.built), 2)
+
+    def test_failed_builder(self):
+        def _fail():
+            raise ValueError()
+
+        parts = snapshot.get_parts(self.version, {'toc': _fail})
+
+        self.assertEqual(parts, {'toc': None})
+        self.assertEqual(sputnik.rcon.keys('booki:%s:snapshot:*' % self.book.id), [])
+
+
+MAP = ((r'^/snapshot-test/$', 'booktype.apps.edit.tests.functest_snapshot'), )
+
+
+def remote_rename(request, message):
+    chapter = models.Chapter.objects.get(pk=message['chapter'])
+    chapter.title = 'Renamed chapter'
+    chapter.save()
+
+    # editor opened in another process before this transaction is committed
+    # still sees the old title
+    snapshot.get_parts(chapter.version, {'toc': lambda: ['Old chapter']})
+
+
+class SnapshotCommitTest(TransactionTestCase):
+    def setUp(self):
+        self.book = BookFactory()
+        self.version = BookVersionFactory(book=self.book)
+        self.status = BookStatusFactory(book=self.book)
+        self.chapter = ChapterFactory(book=self.book, version=self.version, status=self.status)
+
+    def tearDown(self):
+        for key in sputnik.rcon.keys('booki:%s:snapshot*' % self.book.id):
+            sputnik.rdelete(key)
+
+    def _toc(self):
+        return [models.Chapter.objects.get(pk=self.chapter.pk).title]
+
+    def test_read_before_commit(self):
+        messages = [{"channel": "/snapshot-test/", "command": "rename", "uid": 1, "chapter": self.chapter.pk}]
+
+        with transaction.commit_manually():
+            try:
+                results = process_messages(HttpRequest(), messages, MAP)
+            finally:
+                transaction.rollback()
+
+        self.assertEqual(results[0]['status'], True)
+
+        parts = snapshot.get_parts(self.version, {'toc': self._toc})
+
+        self.assertEqual(parts['toc'], ['Renamed chapter'])
@@ -0,0 +1,81 @@
+from django.test import TestCase
+
+from booktype.apps.edit.channel import get_toc_for_book, reorder_toc
+from booktype.apps.core.tests.factory_models import BookFactory, BookVersionFactory
+from booktype.apps.core.tests.factory_models import BookStatusFactory, ChapterFactory, BookTocFactory
+
+
+class TocLoaderTest(TestCase):
+    def setUp(self):
+        self.book = BookFactory()
+        self.version = BookVersionFactory(book=self.book)
+        self.status = BookStatusFactory(book=self.book)
+
+        self.section = BookTocFactory(book=self.book, version=self.version, name='Section',
+                                      weight=3, typeof=0)
+        self.chapters = []
+
+        for weight in (2, 1):
+            chapter = ChapterFactory(book=self.book, version=self.version, status=self.status)
+            BookTocFactory(book=self.book, version=self.version, chapter=chapter, parent=self.section,
+                           weight=weight, typeof=1)
+            self.chapters.append(chapter)
+
+    def test_get_toc_for_book(self):
+        with self.assertNumQueries(1):
+            toc = get_toc_for_book(self.version)
+
+        self.assertEqual(len(toc), 3)
+        self.assertEqual(toc[0], (self.section.id, 'Section', 'Section', 0, None, 'root', self.section.id))
+        self.assertEqual(toc[1][:6], (self.chapters[0].id, self.chapters[0].title, self.chapters[0].url_title,
+                                      1, self.status.id, self.section.id))
+
+    def test_toc_rows(self):
+        rows = self.version.get_toc_rows()
+
+        self.assertEqual([row['has_children'] for row in rows], [True, False, False])
+
+    def test_toc_items(self):
+        with self.assertNumQueries(1):
+            titles = [(item.chapter.title, item.chapter.status.name)
+                      for item in self.version.get_toc_items() if item.chapter]
+
+        self.assertEqual(titles, [(chapter.title, self.status.name) for chapter in self.chapters])
+
+    def test_toc_tree(self):
+        tree = self.version.get_toc_tree()
+
+        self.assertEqual(self.version.toc_revision, 1)
+        self.assertEqual(len(tree), 1)
+        self.assertEqual(tree[0]['name'], 'Section')
+        self.assertEqual([item['chapter'] for item in tree[0]['children']],
+                         [chapter.id for chapter in self.chapters])
+
+        self.chapters[0].title = 'Renamed chapter'
+        self.chapters[0].save()
+        self.version.rebuild_toc()
+
+        version = self.version.__class__.objects.get(pk=self.version.pk)
+
+        with self.assertNumQueries(0):
+            tree = version.get_toc_tree()
+
+        self.assertEqual(version.toc_revision, 2)
+        self.assertEqual(tree[0]['children'][0]['title'], 'Renamed chapter')
+
+    def test_reorder_toc(self):
+        toc = [(row['id'], row['parent'] or 'root') for row in self.version.get_toc_rows()]
+
+        # second chapter is moved to the top level, in front of the section
+        self.assertEqual(reorder_toc(self.version, [(toc[2][0], 'root'), toc[0], toc[1], ('999999', 'root')]), 1)
+
+        rows = self.version.get_toc_rows()
+
+        self.assertEqual([(row['id'], row['parent']) for row in rows],
+                         [(toc[2][0], None), (toc[0][0], None), (toc[1][0], self.section.id)])
+        self.assertEqual([row['weight'] for row in rows], [4, 3, 2])
+
+        # nothing changed, nothing is written
+        with self.assertNumQueries(1):
+            self.assertEqual(reorder_toc(self.version, [(row['id'], row['parent'] or 'root') for row in rows]
+                                         + [('999999', 'root')]), 0)
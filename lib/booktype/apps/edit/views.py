@@ -26,11 +26,14 @@ from django.http import Http404, HttpResponse, HttpResponseRedirect
 from braces.views import (LoginRequiredMixin, UserPassesTestMixin,
                           JSONResponseMixin)
 
+import sputnik
+
 from booki.editor import models
 from booki.utils.log import logChapterHistory, logBookHistory
 
-from booktype.utils import security
+from booktype.utils import security, thumbnails
 from booktype.apps.core import views
+from booktype.apps.core.tasks import create_thumbnails
 from booktype.utils.misc import booktype_slugify
 from booktype.apps.reader.views import BaseReaderView
 
@@ -187,6 +190,10 @@ def upload_cover(request, bookid, version=None):
     else:
         transaction.commit()
 
+        # preview is shown in the cover list right after upload
+        if filename.split('.')[-1].lower() not in ['pdf', 'psd', 'svg']:
+            thumbnails.schedule(create_thumbnails, cover.attachment.path, 'cover')
+
     response_data = {
         "files": [{
             "url": "http://127.0.0.1/",
@@ -235,42 +242,27 @@ def cover(request, bookid, cid, fname=None, version=None):
         '.' + extension, 'binary/octet-stream')
 
     if request.GET.get('preview', '') == '1':
-        try:
-            from PIL import Image
-        except ImportError:
-            import Image
-
-        try:
-            if extension.lower() in ['pdf', 'psd', 'svg']:
-                raise
+        preview_path = None
 
-            im = Image.open(cover.attachment.name)
-            im.thumbnail((300, 200), Image.ANTIALIAS)
-        except:
+        # thumbnails are created by celery task, placeholder is shown until
+        # they are ready
+        if extension not in ['pdf', 'psd', 'svg']:
             try:
-                im = Image.open('%s/edit/img/booktype-cover-%s.png' %
-                                (settings.STATIC_ROOT, extension.lower()))
-                extension = 'png'
-                content_type = 'image/png'
-            except:
+                size = thumbnails.get_sizes('cover')[0]
+                preview_path = thumbnails.get_thumbnail(document_path, 'cover', size) or \
+                    thumbnails.get_placeholder_path()
+            except Exception:
                 # Not just IOError but anything else
-                im = Image.open('%s/edit/img/booktype-cover-error.png' %
-                                settings.STATIC_ROOT)
-                extension = 'png'
-                content_type = 'image/png'
+                pass
 
-        response = HttpResponse(content_type=content_type)
-
-        extension_list = ['jpg', 'jpeg', 'png', 'gif', 'tiff', 'bmp', 'tif']
-        if extension.lower() in extension_list:
-            if extension.upper() == 'JPG':
-                extension = 'JPEG'
-        else:
-            extension = 'jpeg'
+        if preview_path is None:
+            preview_path = '%s/edit/img/booktype-cover-%s.png' % (settings.STATIC_ROOT, extension)
 
-        im.save(response, extension.upper())
+            if not os.path.exists(preview_path):
+                preview_path = '%s/edit/img/booktype-cover-error.png' % settings.STATIC_ROOT
 
-        return response
+        document_path = preview_path
+        content_type = mimetypes.guess_type(preview_path)[0]
 
     try:
         data = open(document_path, 'rb').read()
@@ -345,6 +337,8 @@ class EditBookPage(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
 
         context['base_url'] = settings.BOOKTYPE_URL
         context['static_url'] = settings.STATIC_URL
+        context['sputnik_longpoll'] = sputnik.LONGPOLL_TIMEOUT
+        context['sputnik_websocket_url'] = sputnik.WEBSOCKET_URL or ''
         context['is_admin'] = book_security.is_group_admin() or\
             book_security.is_book_admin() or book_security.is_superuser()
         context['is_owner'] = book.owner == self.request.user
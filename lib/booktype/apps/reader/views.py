@@ -31,11 +31,25 @@ from booktype.apps.core import views
 from booktype.utils import misc, security
 from booktype.utils.book import remove_book
 from booktype.apps.core.views import BasePageView
-from booki.editor.models import Book, BookHistory, BookToc, Chapter
+from booki.editor.models import Book, BookHistory, Chapter
 
 from .forms import EditBookInfoForm
 
 
+def flatten_toc(items):
+    """
+    Returns items of materialized TOC tree as flat list, in TOC order.
+    """
+
+    flat = []
+
+    for item in items:
+        flat.append(item)
+        flat.extend(flatten_toc(item['children']))
+
+    return flat
+
+
 class BaseReaderView(object):
     """
     Base Reader View Class with the common attributes
@@ -242,12 +256,11 @@ class DraftChapterView(BaseReaderView, BasePageView, DetailView):
                 )
                 return context
 
-        toc_items = BookToc.objects.filter(
-            version=book_version).order_by("-weight")
+        toc_items = flatten_toc(book_version.get_toc_tree())
 
-        for chapter in toc_items:
-            if not content and chapter.is_chapter():
-                content = chapter.chapter
+        for item in toc_items:
+            if not content and item['chapter']:
+                content = Chapter.objects.get(pk=item['chapter'])
                 break
 
         context['content'] = content
@@ -290,8 +303,7 @@ class FullView(BaseReaderView, BasePageView, DetailView):
             return context
 
         book_version = book.get_version(self.kwargs.get('version', None))
-        toc_items = BookToc.objects.filter(
-            version=book_version).order_by("-weight")
+        toc_items = book_version.get_toc_items(content=True)
 
         context['book_version'] = book_version.get_version()
         context['toc_items'] = toc_items
@@ -260,3 +260,13 @@ BOOKTYPE_CSS_ODT = ('body {} #book-title { font-size: 64pt; '
                     'img { max-width: 700px; height: auto;}')
 
 
+
+# Thumbnails are created in these sizes when image is stored. Every kind of
+# image has list of (width, height, crop) tuples, see booktype.utils.thumbnails
+THUMBNAIL_SIZES = {
+    'attachment': [(100, 100, True)],
+    'cover': [(300, 200, False)],
+    'profile': [(24, 24, True), (48, 48, True), (100, 100, True), (240, 240, True)]
+}
+
+THUMBNAIL_UPLOAD_DIR = 'thumbnails/'
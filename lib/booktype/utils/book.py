@@ -25,6 +25,7 @@ import booki.editor.signals
 from booki.editor import models
 from booki.utils.log import logBookHistory
 from .misc import booktype_slugify
+from . import thumbnails
 
 try:
     from PIL import Image
@@ -204,7 +205,7 @@ def set_book_cover(book, file_name):
 
     try:
 
-        im = Image.open(file_name)
+        im = thumbnails.open_image(file_name, (240, 240))
         im.thumbnail((240, 240), Image.ANTIALIAS)
         im.save('%s/%s%s.jpg' % (settings.MEDIA_ROOT, settings.COVER_IMAGE_UPLOAD_DIR, book.id), "JPEG")
 
@@ -40,6 +40,8 @@ from ebooklib.utils import parse_html_string
 
 from booki.editor import models
 
+from . import thumbnails
+
 try:
     from PIL import Image
 except ImportError:
@@ -356,6 +358,8 @@ def import_book_from_file(epub_file, user, **kwargs):
         # save temporarily the toc_item in parent
         parents[_elem[2]] = toc_item
 
+    book.version.rebuild_toc()
+
     return book
 
 def export_book(fileName, book_version):
@@ -388,13 +392,29 @@ def export_book(fileName, book_version):
     # parse and fetch only images which are inside
     embededImages = {}
 
-    for chapter in book_version.get_toc():
-        if chapter.chapter:
+    def _walk(items, parent_id=None):
+        for item in items:
+            yield item, parent_id
+
+            for child in _walk(item['children'], item['id']):
+                yield child
+
+    toc_items = list(_walk(book_version.get_toc_tree()))
+    chapters = models.Chapter.objects.in_bulk(
+        [item['chapter'] for item, _ in toc_items if item['chapter']])
+
+    for item, parent_id in toc_items:
+        if item['chapter']:
+            chapter = chapters.get(item['chapter'])
+
+            if not chapter:
+                continue
+
             c1 = epub.EpubHtml(
-                title=chapter.chapter.title, 
-                file_name='%s.xhtml' % (chapter.chapter.url_title, )
+                title=chapter.title, 
+                file_name='%s.xhtml' % (chapter.url_title, )
             )
-            cont = chapter.chapter.content
+            cont = chapter.content
 
             try:
                 tree = parse_html_string(cont.encode('utf-8'))
@@ -425,19 +445,19 @@ def export_book(fileName, book_version):
             epub_book.add_item(c1)
             spine.append(c1)
 
-            if chapter.parent:
-                toc[chapter.parent.id][1].append(c1)
+            if parent_id:
+                toc[parent_id][1].append(c1)
             else:
-                if chapter.has_children():
-                    toc[chapter.id] = [c1, []]
+                if item['children']:
+                    toc[item['id']] = [c1, []]
                 else:
-                    toc[chapter.id] = c1
+                    toc[item['id']] = c1
         else:
-            epub_sec = epub.Section(chapter.name)
-            if chapter.parent:
-                toc[chapter.parent.id][1].append(epub_sec)
+            epub_sec = epub.Section(item['name'])
+            if parent_id:
+                toc[parent_id][1].append(epub_sec)
             else:
-                toc[chapter.id] = [epub_sec, []]
+                toc[item['id']] = [epub_sec, []]
 
     for i, attachment in enumerate(models.Attachment.objects.filter(version=book_version)):
         if ('static/' + os.path.basename(attachment.attachment.name)) not in embededImages:
@@ -483,7 +503,7 @@ def set_group_image(groupid, file_object, x_size, y_size):
 
     fh, fname = save_uploaded_as_file(file_object)
     try:
-        im = Image.open(fname)
+        im = thumbnails.open_image(fname, (x_size, y_size))
         im.thumbnail((x_size, y_size), Image.ANTIALIAS)
 
         new_path = '%s/%s' % (settings.MEDIA_ROOT, GROUP_IMAGE_UPLOAD_DIR)
@@ -533,7 +553,7 @@ def create_thumbnail(fname, size=(100, 100)):
     @return: Returns PIL Image object
     """
 
-    im = Image.open(fname)
+    im = thumbnails.open_image(fname, size)
     width, height = im.size
 
     if width > height:
@@ -600,6 +620,10 @@ def set_profile_image(user, file_object):
         profile = user.get_profile()
         profile.image = '%s%s.jpg' % (settings.PROFILE_IMAGE_UPLOAD_DIR, user.username)
         profile.save()
+
+        from booktype.apps.core.tasks import create_thumbnails
+
+        thumbnails.schedule(create_thumbnails, profile.image.path, 'profile')
     except:
         pass
 
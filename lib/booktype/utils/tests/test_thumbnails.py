@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+import mock
+import celery
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+import sputnik
+from booktype.utils import thumbnails
+from booktype.apps.core import tasks
+
+
+SIZES = {
+    'test': [(40, 40, True), (100, 50, False)]
+}
+
+
+class ThumbnailsTestCase(TestCase):
+    """
+    Tests thumbnail service in thumbnails.py module
+    """
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.settings = override_settings(DATA_ROOT=self.data_root, DATA_URL='/data/', THUMBNAIL_SIZES=SIZES)
+        self.settings.enable()
+
+        # tasks are executed right away
+        self.conf = celery.current_app.conf
+        self.eager = self.conf.CELERY_ALWAYS_EAGER
+        self.conf.CELERY_ALWAYS_EAGER = True
+
+    def tearDown(self):
+        for key in sputnik.rcon.keys('booktype:thumbnails:*'):
+            if self.data_root in key or (sputnik.rcon.get(key) or '').startswith(self.data_root):
+                sputnik.rcon.delete(key)
+
+        self.conf.CELERY_ALWAYS_EAGER = self.eager
+        self.settings.disable()
+        shutil.rmtree(self.data_root)
+
+    def _image(self, name, size, color='red', format='PNG'):
+        path = os.path.join(self.data_root, name)
+        Image.new('RGB', size, color).save(path, format)
+
+        return path
+
+    def test_get_size(self):
+        self.assertEqual(thumbnails.get_size('test', 10), (40, 40, True))
+        self.assertEqual(thumbnails.get_size('test', 60), (100, 50, False))
+        self.assertEqual(thumbnails.get_size('test', 1000), (100, 50, False))
+
+    def test_default_sizes(self):
+        self.assertEqual(thumbnails.get_sizes('attachment'), [(100, 100, True)])
+        self.assertRaises(ValueError, thumbnails.get_size, 'unknown', 100)
+
+    def test_create_thumbnails(self):
+        path = self._image('image.png', (400, 100))
+        names = thumbnails.create_thumbnails(path, 'test')
+
+        self.assertEqual(sorted(names.keys()), SIZES['test'])
+
+        for size, name in names.items():
+            self.assertTrue(name.startswith('thumbnails/'))
+            self.assertTrue(name.endswith('.jpg'))
+
+        cropped = Image.open(thumbnails.get_thumbnail_path(names[(40, 40, True)]))
+        scaled = Image.open(thumbnails.get_thumbnail_path(names[(100, 50, False)]))
+
+        self.assertEqual((cropped.format, cropped.size), ('JPEG', (40, 40)))
+        self.assertEqual(scaled.size, (100, 25))
+
+    def test_same_content(self):
+        first = thumbnails.create_thumbnails(self._image('first.png', (200, 200)), 'test')
+        second = thumbnails.create_thumbnails(self._image('second.png', (200, 200)), 'test')
+        other = thumbnails.create_thumbnails(self._image('other.png', (200, 200), 'blue'), 'test')
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_draft(self):
+        path = self._image('photo.jpg', (2000, 1000), format='JPEG')
+        im = thumbnails.open_image(path, (100, 50))
+
+        # big JPEG images are decoded at lower scale
+        self.assertTrue(im.size[0] < 2000 and im.size[0] >= 100)
+
+    def test_get_thumbnail(self):
+        path = self._image('image.png', (200, 200))
+        size = SIZES['test'][0]
+        name = thumbnails.get_thumbnail_name(thumbnails.get_digest(path), size)
+
+        # first request schedules the task, placeholder is shown in the meantime
+        self.assertEqual(thumbnails.get_thumbnail(path, 'test', size), None)
+        self.assertEqual(thumbnails.get_thumbnail(path, 'test', size), thumbnails.get_thumbnail_path(name))
+        self.assertEqual(thumbnails.get_thumbnail_url(name), '/data/%s' % name)
+        self.assertTrue(thumbnails.get_thumbnail_url(None).endswith(thumbnails.PLACEHOLDER))
+
+    def test_digest_cached(self):
+        path = self._image('image.png', (200, 200))
+        digest = thumbnails.get_digest(path)
+        key = 'booktype:thumbnails:digest:%s' % path
+        cached = sputnik.rcon.get(key)
+
+        self.assertTrue(cached.endswith(':%s' % digest))
+
+        # file is not read again while it is not changed
+        sputnik.rcon.set(key, cached.replace(digest, 'cached'))
+        self.assertEqual(thumbnails.get_digest(path), 'cached')
+
+        self._image('image.png', (300, 300))
+        self.assertNotEqual(thumbnails.get_digest(path), 'cached')
+
+    def test_scheduled_once(self):
+        path = self._image('image.png', (200, 200))
+        size = SIZES['test'][0]
+
+        with mock.patch.object(tasks.create_thumbnails, 'delay') as delay:
+            self.assertEqual(thumbnails.get_thumbnail(path, 'test', size), None)
+            self.assertEqual(thumbnails.get_thumbnail(path, 'test', size), None)
+
+        self.assertEqual(delay.call_count, 1)
+
+        # task removes pending mark
+        thumbnails.create_thumbnails(path, 'test')
+        self.assertEqual(sputnik.rcon.keys('booktype:thumbnails:pending:%s:*' % thumbnails.get_digest(path)), [])
+
+    def test_not_image(self):
+        path = os.path.join(self.data_root, 'notes.txt')
+
+        with open(path, 'w') as f:
+            f.write('some notes')
+
+        self.assertRaises(IOError, thumbnails.get_thumbnail, path, 'test', SIZES['test'][0])
@@ -0,0 +1,356 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Thumbnails of images.
+
+Thumbnails are created by Celery task (L{booktype.apps.core.tasks.create_thumbnails}) in all sizes configured in
+C{THUMBNAIL_SIZES} for that kind of image, never while rendering a response. Until they are ready, placeholder is
+shown. Task is sent only once while thumbnails are pending.
+
+Thumbnails are kept in C{DATA_ROOT/THUMBNAIL_UPLOAD_DIR} and are named by SHA1 of the image content and the size,
+so the same image stored many times (for example attachments copied to new book version) is thumbnailed only once.
+
+Redis keys:
+  - booktype:thumbnails:digest:<path> - SHA1 of the image as "<mtime>:<size>:<digest>", so the file is read again
+    only when it is changed.
+  - booktype:thumbnails:pending:<digest>:<kind> - Exists while task creating thumbnails is pending.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+from django.conf import settings
+
+import sputnik
+from booktype import constants
+
+try:
+    from PIL import Image
+except ImportError:
+    import Image
+
+
+logger = logging.getLogger('booktype')
+
+PLACEHOLDER = 'core/img/thumbnail-pending.png'
+
+# cached digest of a file expires after this many seconds and the file is read again
+DIGEST_TIMEOUT = 60 * 60 * 24 * 30
+
+# task is sent again if thumbnails are not ready after this many seconds
+PENDING_TIMEOUT = 60 * 10
+
+
+def get_sizes(kind):
+    """
+    Returns list of C{(width, height, crop)} tuples configured for this kind of image. Kinds which are not in
+    C{THUMBNAIL_SIZES} setting get default sizes.
+
+    @raise ValueError: If there are no sizes for this kind of image.
+    """
+
+    sizes = getattr(settings, 'THUMBNAIL_SIZES', constants.THUMBNAIL_SIZES)
+
+    if kind not in sizes:
+        sizes = constants.THUMBNAIL_SIZES
+
+    if not sizes.get(kind):
+        raise ValueError('No thumbnail sizes are configured for "%s" images.' % kind)
+
+    return [tuple(size) for size in sizes[kind]]
+
+
+def get_size(kind, width):
+    """
+    Returns configured size for this kind of image which is the closest to the wanted width. Smallest size
+    wider than C{width} is preferred.
+    """
+
+    sizes = sorted(get_sizes(kind))
+    wider = [size for size in sizes if size[0] >= width]
+
+    return wider[0] if wider else sizes[-1]
+
+
+def get_digest(path):
+    """
+    Returns SHA1 of the file content. Digest is kept in Redis and file is read again only when its modification
+    time or size is changed.
+    """
+
+    stat = os.stat(path)
+    key = 'booktype:thumbnails:digest:%s' % path
+    version = '%s:%s:' % (int(stat.st_mtime), stat.st_size)
+
+    try:
+        cached = sputnik.execute('get', key)
+    except Exception:
+        logger.exception('Could not read digest of %s.' % path)
+        cached = None
+
+    if cached and cached.startswith(version):
+        return cached[len(version):]
+
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            sha.update(chunk)
+
+    digest = sha.hexdigest()
+
+    try:
+        sputnik.execute('set', key, version + digest, ex=DIGEST_TIMEOUT)
+    except Exception:
+        logger.exception('Could not store digest of %s.' % path)
+
+    return digest
+
+
+def get_thumbnail_name(digest, size):
+    """
+    Returns name of the thumbnail relative to C{DATA_ROOT}.
+    """
+
+    width, height, crop = size
+    upload_dir = getattr(settings, 'THUMBNAIL_UPLOAD_DIR', constants.THUMBNAIL_UPLOAD_DIR)
+
+    return '%s%s/%s_%dx%d%s.jpg' % (upload_dir, digest[:2], digest, width, height, '_crop' if crop else '')
+
+
+def get_thumbnail_path(name):
+    return '%s/%s' % (settings.DATA_ROOT, name)
+
+
+def get_thumbnail_digest(name):
+    """
+    Returns digest of the image from the name of its thumbnail.
+    """
+
+    return os.path.basename(name).split('_')[0]
+
+
+def get_thumbnail_url(name):
+    """
+    Returns URL of the thumbnail or URL of the placeholder if there is no thumbnail yet.
+    """
+
+    if not name:
+        return '%s%s' % (settings.STATIC_URL, PLACEHOLDER)
+
+    return '%s%s' % (settings.DATA_URL, name)
+
+
+def get_placeholder_path():
+    return '%s/%s' % (settings.STATIC_ROOT, PLACEHOLDER)
+
+
+def open_image(path, size):
+    """
+    Opens image for thumbnailing. JPEG images are decoded in draft mode, directly at the smallest scale which is
+    still bigger than C{size}, which is much faster and uses less memory for big photographs.
+    """
+
+    im = Image.open(path)
+
+    if im.format == 'JPEG':
+        im.draft('RGB', (size[0], size[1]))
+
+    return im
+
+
+def create_thumbnail(path, size):
+    """
+    Creates one thumbnail and returns it as PIL Image. With crop, image is first cropped to the aspect ratio of
+    the thumbnail.
+    """
+
+    width, height, crop = size
+    im = open_image(path, size)
+
+    if crop:
+        ratio = float(width) / height
+        w, h = im.size
+
+        if w > h * ratio:
+            left = int((w - h * ratio) / 2)
+            im = im.crop((left, 0, left + int(h * ratio), h))
+        else:
+            upper = int((h - w / ratio) / 2)
+            im = im.crop((0, upper, w, upper + int(w / ratio)))
+
+    im.thumbnail((width, height), Image.ANTIALIAS)
+
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+
+    return im
+
+
+def create_thumbnails(path, kind):
+    """
+    Creates all missing thumbnails for the image. Thumbnail is written to temporary file and renamed, so nobody
+    can see half written file.
+
+    @type path: C{string}
+    @param path: Full path to the image
+    @type kind: C{string}
+    @param kind: Kind of image, key in C{THUMBNAIL_SIZES}
+    @rtype: C{dict}
+    @return: Returns dictionary C{{size: thumbnail_name}}
+    """
+
+    digest = get_digest(path)
+    names = {}
+
+    for size in get_sizes(kind):
+        names[size] = get_thumbnail_name(digest, size)
+        thumbnail_path = get_thumbnail_path(names[size])
+
+        if os.path.exists(thumbnail_path):
+            continue
+
+        directory = os.path.dirname(thumbnail_path)
+
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by someone else in the meantime
+                pass
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.jpg')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                create_thumbnail(path, size).save(f, 'JPEG')
+
+            os.rename(tmp_path, thumbnail_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    try:
+        sputnik.execute('delete', 'booktype:thumbnails:pending:%s:%s' % (digest, kind))
+    except Exception:
+        logger.exception('Could not remove pending mark for %s.' % path)
+
+    return names
+
+
+def delete_thumbnails(digest, kind):
+    """
+    Removes thumbnails of the image in all sizes configured for this kind of image.
+    """
+
+    for size in get_sizes(kind):
+        try:
+            os.remove(get_thumbnail_path(get_thumbnail_name(digest, size)))
+        except OSError:
+            pass
+
+
+def remove_orphans(digests, min_age=60 * 60):
+    """
+    Removes thumbnails of images which do not exist anymore. Files younger than C{min_age} seconds are kept,
+    because their images might not be stored yet.
+
+    @type digests: C{set}
+    @param digests: Digests of all images which have thumbnails
+    @type min_age: C{int}
+    @param min_age: Minimal age of the removed files in seconds
+    @rtype: C{int}
+    @return: Returns number of removed files
+    """
+
+    upload_dir = getattr(settings, 'THUMBNAIL_UPLOAD_DIR', constants.THUMBNAIL_UPLOAD_DIR)
+    oldest = time.time() - min_age
+    removed = 0
+
+    for directory, _, names in os.walk(get_thumbnail_path(upload_dir)):
+        for name in names:
+            path = os.path.join(directory, name)
+
+            if get_thumbnail_digest(name) in digests or os.path.getmtime(path) > oldest:
+                continue
+
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+
+    return removed
+
+
+def schedule(task, *args):
+    """
+    Sends task which creates thumbnails. If task can not be sent, because broker is not available, it is executed
+    immediately.
+
+    @type task: C{celery.Task}
+    @param task: Task which creates thumbnails
+    """
+
+    try:
+        task.delay(*args)
+    except Exception:
+        logger.exception('Could not send task %s, creating thumbnails now.' % task.name)
+        task(*args)
+
+
+def get_thumbnail(path, kind, size):
+    """
+    Returns full path of the thumbnail if it is ready. If not, thumbnails are scheduled and None is returned, so
+    caller should show a placeholder. Task is sent only once while thumbnails are pending.
+
+    @type path: C{string}
+    @param path: Full path to the image
+    @type kind: C{string}
+    @param kind: Kind of image, key in C{THUMBNAIL_SIZES}
+    @type size: C{tuple}
+    @param size: One of the sizes for this kind of image
+    @rtype: C{string}
+    @return: Returns path of the thumbnail or None
+    @raise IOError: If file is not an image.
+    """
+
+    digest = get_digest(path)
+    thumbnail_path = get_thumbnail_path(get_thumbnail_name(digest, size))
+
+    if os.path.exists(thumbnail_path):
+        return thumbnail_path
+
+    # only reads header of the file
+    Image.open(path)
+
+    try:
+        pending = not sputnik.execute('set', 'booktype:thumbnails:pending:%s:%s' % (digest, kind), path,
+                                      nx=True, ex=PENDING_TIMEOUT)
+    except Exception:
+        logger.exception('Could not mark thumbnails for %s as pending.' % path)
+        pending = False
+
+    if not pending:
+        from booktype.apps.core.tasks import create_thumbnails as create_thumbnails_task
+
+        schedule(create_thumbnails_task, path, kind)
+
+    return None
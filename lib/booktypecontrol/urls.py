@@ -19,7 +19,8 @@ from django.conf.urls import patterns, url
 from .views import (ControlCenterView, ControlCenterSettings, PersonInfoView,
                     EditPersonInfo, PasswordChangeView, BookRenameView,
                     DeleteGroupView, LicenseEditView, DeleteLicenseView,
-                    RoleEditView, DeleteRoleView)
+                    RoleEditView, DeleteRoleView, SputnikMetricsView,
+                    SputnikMetricsJSONView)
 
 urlpatterns = patterns(
     '',
@@ -45,4 +46,8 @@ urlpatterns = patterns(
         RoleEditView.as_view(), name="role_edit"),
     url(r'^roles/(?P<pk>\d+)/delete/$',
         DeleteRoleView.as_view(), name="delete_role"),
+
+    url(r'^sputnik/$', SputnikMetricsView.as_view(), name='sputnik_metrics'),
+    url(r'^sputnik/metrics.json$',
+        SputnikMetricsJSONView.as_view(), name='sputnik_metrics_json'),
 )
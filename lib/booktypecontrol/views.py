@@ -17,6 +17,7 @@
 
 import booki
 import sputnik
+import datetime
 import forms as control_forms
 
 from collections import Counter
@@ -29,11 +30,14 @@ from django.http import HttpResponseRedirect
 from django.utils.translation import ugettext as _
 from django.core.urlresolvers import reverse, reverse_lazy
 
-from django.views.generic import TemplateView, FormView
+from django.views.generic import View, TemplateView, FormView
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic import DetailView, UpdateView, DeleteView
 
-from braces.views import LoginRequiredMixin, SuperuserRequiredMixin
+from braces.views import LoginRequiredMixin, SuperuserRequiredMixin, JSONResponseMixin
+
+from sputnik import maintenance
+from sputnik.metrics import get_metrics
 
 from booktype.utils import misc
 from booktype.apps.core.models import Role
@@ -143,28 +147,27 @@ class ControlCenterView(BaseCCView, TemplateView):
         }
 
     def get_online_users(self):
-        client_list = sputnik.rkeys("ses:*:username")
-        online_users = {}
-
-        for us in client_list:
-            clientID = us[4:-9]
+        online_users = sputnik.getOnlineUsers()
+        user_books = {}
 
-            channel_list = []
-            for chan in sputnik.smembers('ses:%s:channels' % clientID):
+        for username, channels in online_users.iteritems():
+            book_ids = []
+            for chan in channels:
                 if chan.startswith('/booktype/book/'):
                     _s = chan.split('/')
-                    if len(_s) > 3:
-                        bookID = _s[3]
-                        try:
-                            b = Book.objects.get(pk=bookID)
-                            channel_list.append(b)
-                        except Book.DoesNotExist:
-                            pass
-
-            _u = sputnik.get(us)
-            online_users[_u] = channel_list
-
-        return online_users
+                    if len(_s) > 3 and _s[3].isdigit() and \
+                            int(_s[3]) not in book_ids:
+                        book_ids.append(int(_s[3]))
+            user_books[username] = book_ids
+
+        # all books in one query
+        books = Book.objects.in_bulk(
+            set(bid for ids in user_books.values() for bid in ids))
+
+        return dict(
+            (username, [books[bid] for bid in book_ids if bid in books])
+            for username, book_ids in user_books.iteritems()
+        )
 
 
 class ControlCenterSettings(BaseCCView, FormView):
@@ -444,3 +447,53 @@ class DeleteRoleView(BaseCCView, DeleteView):
     def get_success_url(self):
         messages.success(self.request, _('Role successfully deleted.'))
         return "%s#list-of-roles" % reverse('control_center:settings')
+
+
+def get_metrics_windows(request):
+    try:
+        return int(request.GET['windows'])
+    except (KeyError, ValueError):
+        return None
+
+
+class SputnikMetricsView(BaseCCView, TemplateView):
+    """
+    Renders metrics of Sputnik commands, slowest in total first, and
+    totals of Sputnik maintenance jobs
+    """
+
+    template_name = 'booktypecontrol/control_center_sputnik.html'
+    page_title = _('Admin Control Center')
+    title = page_title
+
+    def get_context_data(self, **kwargs):
+        context = super(SputnikMetricsView, self).get_context_data(**kwargs)
+        metrics = get_metrics(get_metrics_windows(self.request))
+
+        commands = []
+        for name, command in metrics['commands'].iteritems():
+            command['name'] = name
+            command['total'] = command['time'] * command['count']
+            commands.append(command)
+
+        context['commands'] = sorted(commands, key=lambda c: c['total'], reverse=True)
+        context['minutes'] = metrics['window'] * metrics['windows'] / 60
+
+        jobs = maintenance.get_stats()
+        for job in jobs.values():
+            job['last_run'] = datetime.datetime.fromtimestamp(
+                job.get('last_run', 0))
+        context['maintenance'] = sorted(jobs.items())
+        return context
+
+
+class SputnikMetricsJSONView(LoginRequiredMixin, SuperuserRequiredMixin,
+                             JSONResponseMixin, View):
+    """
+    Returns metrics of Sputnik commands and maintenance jobs as JSON
+    """
+
+    def get(self, request, *args, **kwargs):
+        metrics = get_metrics(get_metrics_windows(request))
+        metrics['maintenance'] = maintenance.get_stats()
+        return self.render_json_response(metrics)
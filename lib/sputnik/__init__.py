@@ -25,13 +25,46 @@ What is Sputnik?
 Sputnik keys
 ============
   - sputnik:channels - Redis Set of channel names.
+  - sputnik:last_access - Redis Sorted Set of all clients scored by timestamp of their last access.
   - sputnik:channel:<channel_name>:channel - Redis Set of clients for specific <channel_name>.
   - sputnik:channel:<channel_name>:users - Redis Set of usernames for specific <channel_name>.
+  - sputnik:channel:<channel_name>:presence - Redis Hash of number of clients every user has in specific <channel_name>.
+  - sputnik:channel:<channel_name>:log - Redis Sorted Set of Sputnik messages for specific <channel_name> scored by sequence number. Used only with "log" delivery.
+  - sputnik:channel:<channel_name>:sequence - Sequence number of the last message in the channel log.
+  - sputnik:channel:<channel_name>:pending - Redis Hash of the last log entry for every coalesce key. Used only with "log" delivery.
+  - sputnik:channel:<channel_name>:coalesced - Redis Hash of coalesce key for sequence number of every coalesced entry
+    in the channel log. Used only with "log" delivery.
+  - sputnik:topic:<channel_name> - Redis pub/sub topic for specific <channel_name>. Used only with C{SPUTNIK_PUBSUB}.
+  - sputnik:pubsub_clients - Redis Set of clients which get messages from pub/sub topics instead of their message queue.
+  - sputnik:maintenance - Redis Hash of totals for every maintenance job.
+  - sputnik:maintenance:channels_cursor - Position of the empty channels check in sputnik:channels.
+  - sputnik:online - Redis Set of C{<username>|<channel_name>} for every user which has at least one client in the channel.
+  - sputnik:metrics:<timestamp> - Redis Hash of metrics for all commands executed in the window which started at <timestamp>.
 
   - ses:<client_id>:channels - Redis Set of channel names for specific <client_id>.
   - ses:<client_id>:username - Username for specific <client_id>.
-  - ses:<client_id>:messages - Redis List of Sputnik messages for specific <client_id>.
-  - ses:<client_id>:last_access - Timestamp of client last access.
+  - ses:<client_id>:messages - Redis List of Sputnik messages for specific <client_id>. Capped to C{SPUTNIK_QUEUE_SIZE}
+    messages and expires after C{SPUTNIK_QUEUE_TTL} seconds without access.
+  - ses:<client_id>:pending - Redis Hash of the last queued message for every C{<channel_name>|<coalesce_key>} for
+    specific <client_id>.
+  - ses:<client_id>:cursors - Redis Hash of sequence numbers of the last read message in each channel log for specific <client_id>.
+
+Message delivery
+================
+  With "queue" delivery (default) every message is copied to the message queue of every subscribed client. That makes
+  one write per subscriber for every message.
+
+  With "log" delivery (C{SPUTNIK_DELIVERY = 'log'}) every channel keeps one capped log of messages. Clients remember
+  sequence number of the last message they have read in each channel and read only newer messages. That makes one write
+  per message no matter how many clients are subscribed.
+
+  Messages which are only telling the current state of something (chapter status, user mood...) can have coalesce
+  key. When new message with the same key is sent to the same channel, the old one is removed from the queues and
+  channel logs if client did not get it yet. Clients which are not polling often get only the newest state.
+
+  With C{SPUTNIK_PUBSUB = True} every message is also published once on the channel topic. WebSocket gateways on all
+  nodes listen to the topics and push messages to the clients connected to them. Those clients are in
+  sputnik:pubsub_clients and message queues are not filled for them. Polling clients get messages as before.
 
 Sputnik message
 ===============
@@ -39,18 +72,33 @@ Sputnik message
   Everything else is optional.
     
 
+Redis access
+============
+  All Redis commands go through one connection pool per process. Commands are plain atomic Redis commands, there
+  are no global locks around them. Commands issued inside of C{with sputnik.batch():} block are queued and sent
+  to Redis in one round trip when the block exits.
+
+  Every command is timed. Use L{get_stats} and L{reset_stats} to see how many commands current thread issued and
+  how much time it spent waiting for Redis.
+
+  Redis is not part of the database transaction. Use L{after_commit} for Redis commands which must not run before
+  database changes are visible to other processes.
+
 @todo: Remove obsolete code after changing redis client version. Redis did not support keys with spaces, so we had to encode keys.
-@todo: Should read info about redis database from settings.
 """
 
 from __future__ import with_statement 
 
 import time
 import json
+import math
 import redis
-import base64
+import logging
+import threading
 
 from django.conf import settings
+from django.db import transaction
+from django.core import signals
 
 try:
     REDIS_HOST = settings.REDIS_HOST
@@ -63,11 +111,291 @@ except AttributeError:
     REDIS_DB = 0
     REDIS_PASSWORD = None
 
-rcon = redis.Redis(host = REDIS_HOST,
-                   port = REDIS_PORT,
-                   db = REDIS_DB,
-                   password = REDIS_PASSWORD)
-#rcon.connect()
+# Maximum number of open connections to Redis per process. None means no limit.
+REDIS_MAX_CONNECTIONS = getattr(settings, 'REDIS_MAX_CONNECTIONS', None)
+
+# How messages are delivered to clients. With "queue" every message is copied to the message queue
+# of every subscribed client. With "log" channel keeps one log of messages and clients read it from their cursor.
+DELIVERY = getattr(settings, 'SPUTNIK_DELIVERY', 'queue')
+
+# Maximum number of messages kept in the channel log.
+CHANNEL_LOG_SIZE = getattr(settings, 'SPUTNIK_CHANNEL_LOG_SIZE', 1000)
+
+# Maximum number of seconds client can wait for new messages (long polling). 0 disables long polling.
+LONGPOLL_TIMEOUT = getattr(settings, 'SPUTNIK_LONGPOLL_TIMEOUT', 0)
+
+# How often (in seconds) channel logs are checked for new messages while client is waiting.
+LONGPOLL_INTERVAL = getattr(settings, 'SPUTNIK_LONGPOLL_INTERVAL', 0.5)
+
+# URL of the WebSocket gateway (manage.py sputnik_gateway), for example "ws://example.com:8001/_sputnik/ws/".
+# None means editors talk to the dispatcher over HTTP.
+WEBSOCKET_URL = getattr(settings, 'SPUTNIK_WEBSOCKET_URL', None)
+
+# Maximum number of messages client gets in one response. The rest waits for the next poll.
+POLL_BATCH_SIZE = getattr(settings, 'SPUTNIK_POLL_BATCH_SIZE', 100)
+
+# Maximum number of messages waiting in the queue of one client. Oldest messages are dropped.
+QUEUE_SIZE = getattr(settings, 'SPUTNIK_QUEUE_SIZE', 1000)
+
+# Message queue is deleted if nobody wrote to it or read from it for this many seconds.
+QUEUE_TTL = getattr(settings, 'SPUTNIK_QUEUE_TTL', 60*10)
+
+# How messages client has sent are committed to the database. With "message" every message is committed on its own.
+# With "batch" all messages from one request are committed together and every message runs in its own savepoint,
+# so failed message is rolled back alone. Databases without savepoints (SQLite) always use "message".
+TRANSACTION_MODE = getattr(settings, 'SPUTNIK_TRANSACTION_MODE', 'message')
+
+# Publish every channel message also on Redis pub/sub topic sputnik:topic:<channel_name>. Clients connected
+# to a WebSocket gateway get messages from the topic and are skipped by the list delivery.
+PUBSUB = getattr(settings, 'SPUTNIK_PUBSUB', False)
+
+# Deliver only the newest pending message for every coalesce key (see L{addMessageToChannel}).
+COALESCE = getattr(settings, 'SPUTNIK_COALESCE', True)
+
+# Responses bigger then this many bytes are compressed with gzip if client accepts it. None disables compression.
+COMPRESS_MIN_SIZE = getattr(settings, 'SPUTNIK_COMPRESS_MIN_SIZE', 1024)
+
+# Client is removed if it did not access Sputnik for this many seconds.
+CLIENT_TIMEOUT = getattr(settings, 'SPUTNIK_CLIENT_TIMEOUT', 60*2)
+
+# How often (in seconds) periodic maintenance runs and how many items it handles at once.
+MAINTENANCE_INTERVAL = getattr(settings, 'SPUTNIK_MAINTENANCE_INTERVAL', 30)
+MAINTENANCE_BATCH_SIZE = getattr(settings, 'SPUTNIK_MAINTENANCE_BATCH_SIZE', 100)
+
+# Maintenance jobs run by periodic task or sputnik_maintenance worker (see L{sputnik.maintenance}).
+MAINTENANCE_JOBS = getattr(settings, 'SPUTNIK_MAINTENANCE_JOBS', ('sputnik.maintenance.remove_timeout_clients',
+                                                                 'sputnik.maintenance.remove_empty_channels',
+                                                                 'booktype.apps.edit.locks.release_stale_locks'))
+
+# Record wall time, SQL queries and Redis commands of every executed message (see L{sputnik.metrics}).
+METRICS = getattr(settings, 'SPUTNIK_METRICS', True)
+
+# Metrics are aggregated in windows of this many seconds and only the last METRICS_RETENTION windows are kept.
+METRICS_WINDOW = getattr(settings, 'SPUTNIK_METRICS_WINDOW', 60)
+METRICS_RETENTION = getattr(settings, 'SPUTNIK_METRICS_RETENTION', 60)
+
+logger = logging.getLogger("booktype.sputnik")
+
+pool = redis.ConnectionPool(host = REDIS_HOST,
+                            port = REDIS_PORT,
+                            db = REDIS_DB,
+                            password = REDIS_PASSWORD,
+                            max_connections = REDIS_MAX_CONNECTIONS)
+
+rcon = redis.Redis(connection_pool = pool)
+
+# Per thread state. Holds stack of active batches and command statistics.
+_local = threading.local()
+
+
+def _get_batches():
+    if not hasattr(_local, 'batches'):
+        _local.batches = []
+
+    return _local.batches
+
+
+def _record(command, elapsed):
+    if not hasattr(_local, 'stats'):
+        _local.stats = {}
+
+    stat = _local.stats.setdefault(command, {'calls': 0, 'time': 0.0})
+    stat['calls'] += 1
+    stat['time'] += elapsed
+
+
+def get_stats():
+    """
+    Returns statistics for Redis commands issued by current thread since last call to L{reset_stats}.
+
+    Batched commands are counted once as I{pipeline}, because that is one round trip to Redis.
+
+    @rtype: C{dict}
+    @return: Returns dictionary C{{command: {'calls': number_of_calls, 'time': seconds}}}.
+    """
+
+    return dict((k, dict(v)) for k, v in getattr(_local, 'stats', {}).iteritems())
+
+
+def reset_stats():
+    """
+    Resets Redis command statistics for current thread.
+    """
+
+    _local.stats = {}
+
+
+def execute(command, *args, **kwargs):
+    """
+    Executes Redis command. Command is queued if there is active batch.
+
+    @type command: C{string}
+    @param command: Name of the redis client method (C{'sadd'}, C{'rpush'}, ...).
+    @return: Returns result of the command or None if command was queued.
+    """
+
+    batches = _get_batches()
+
+    if batches:
+        getattr(batches[-1].pipeline, command)(*args, **kwargs)
+        return None
+
+    start = time.time()
+
+    try:
+        return getattr(rcon, command)(*args, **kwargs)
+    finally:
+        _record(command, time.time() - start)
+
+
+class batch(object):
+    """
+    Context manager which sends all Sputnik commands issued inside of it to Redis in one round trip.
+
+    Helper functions return None inside of the batch. Results are available in C{results} attribute
+    after the block exits. Nested batches are part of the outer batch and have no results of their own.
+
+    Example::
+
+        with sputnik.batch() as b:
+            sputnik.sadd("sputnik:channels", channelName)
+            sputnik.push("ses:%s:messages" % client, message)
+
+        print b.results
+
+    @type transaction: C{bool}
+    @param transaction: Wrap commands in MULTI/EXEC so they are executed atomically.
+    """
+
+    def __init__(self, transaction = False):
+        self.transaction = transaction
+        self.pipeline = None
+        self.nested = False
+        self.results = None
+
+    def __enter__(self):
+        batches = _get_batches()
+
+        if batches:
+            self.nested = True
+            self.pipeline = batches[-1].pipeline
+        else:
+            self.pipeline = rcon.pipeline(transaction = self.transaction)
+
+        batches.append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _get_batches().pop()
+
+        if self.nested:
+            return False
+
+        if exc_type is not None:
+            self.pipeline.reset()
+            return False
+
+        start = time.time()
+
+        try:
+            self.results = self.pipeline.execute()
+        finally:
+            _record('pipeline', time.time() - start)
+            self.pipeline.reset()
+
+        return False
+
+
+def evalscript(script, keys = [], args = []):
+    """
+    Executes Lua script registered with C{rcon.register_script}. Script is queued if there is active batch.
+
+    @type script: C{redis.client.Script}
+    @param script: Registered script.
+    @type keys: C{list}
+    @param keys: List of keys script is using.
+    @type args: C{list}
+    @param args: List of arguments for the script.
+    @return: Returns result of the script or None if script was queued.
+    """
+
+    batches = _get_batches()
+
+    if batches:
+        script(keys = keys, args = args, client = batches[-1].pipeline)
+        return None
+
+    start = time.time()
+
+    try:
+        return script(keys = keys, args = args)
+    finally:
+        _record('evalsha', time.time() - start)
+
+
+def after_commit(callback, *args):
+    """
+    Calls function after current database transaction is committed. Without managed transaction it is called
+    right away. The same call is registered only once per transaction.
+
+    Sputnik dispatcher runs registered functions after every commit (see L{sputnik.views.process_messages}). For
+    other managed transactions they are run when request is finished.
+
+    @type callback: C{function}
+    @param callback: Function to call.
+    """
+
+    if not transaction.is_managed():
+        callback(*args)
+        return
+
+    if not hasattr(_local, 'after_commit'):
+        _local.after_commit = []
+
+    if (callback, args) not in _local.after_commit:
+        _local.after_commit.append((callback, args))
+
+
+def run_after_commit(**kwargs):
+    """
+    Calls functions registered with L{after_commit}. Must be called after transaction is committed.
+    """
+
+    callbacks = getattr(_local, 'after_commit', [])
+    _local.after_commit = []
+
+    for callback, args in callbacks:
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('Could not execute after commit function %s.' % callback.__name__)
+
+
+def after_commit_savepoint():
+    """
+    Returns marker of functions registered with L{after_commit} so far. Pass it to L{discard_after_commit} when
+    savepoint is rolled back.
+
+    @rtype: C{int}
+    @return: Returns number of registered functions
+    """
+
+    return len(getattr(_local, 'after_commit', []))
+
+
+def discard_after_commit(savepoint=0):
+    """
+    Forgets functions registered with L{after_commit}. Must be called after transaction is rolled back.
+
+    @type savepoint: C{int}
+    @param savepoint: Marker from L{after_commit_savepoint}. Only functions registered after it are forgotten.
+    """
+
+    _local.after_commit = getattr(_local, 'after_commit', [])[:savepoint]
+
+
+signals.request_finished.connect(run_after_commit)
 
 
 # Implement our own methods for redis communication. This had to be done before because previous versions of redis had problems
@@ -80,128 +408,500 @@ def rencode(key):
 def rdecode(key):
     return key
 
-def sismember(key, value):
-    import sputnik
+def _valid(key):
+    return key and key.strip() != ''
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('com'):
-            result = sputnik.rcon.sismember(key, rencode(value))
-        return result
+def sismember(key, value):
+    if _valid(key):
+        return execute('sismember', key, rencode(value))
 
     return False
 
 def sadd(key, value):
-    import sputnik
-
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('com'):
-            sputnik.rcon.sadd(key, rencode(value))
+    if _valid(key):
+        return execute('sadd', key, rencode(value))
 
     return False
 
 def rset(key, value):
-    import sputnik
-
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('com'):
-            sputnik.rcon.set(key, rencode(value))
+    if _valid(key):
+        return execute('set', key, rencode(value))
 
     return False
 
 def rpop(key):
-    import sputnik
-
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('com'):
-            result = rdecode(sputnik.rcon.rpop(key))
-        return result
+    if _valid(key):
+        return rdecode(execute('rpop', key))
 
     return None
 
-def srem(key, value):
-    import sputnik
+def bpop(key, timeout):
+    """
+    Pops message from the list. If list is empty it waits until timeout for the message to arrive.
+    Blocks the connection so it should not be used inside of the batch.
+
+    @type key: C{string}
+    @param key: List key.
+    @type timeout: C{float}
+    @param timeout: Number of seconds to wait.
+    @return: Returns message or None if nothing has arrived.
+    """
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('com'):
-            result = sputnik.rcon.srem(key, rencode(value))
+    if _valid(key):
+        result = execute('blpop', key, timeout = int(math.ceil(timeout)))
 
-        return result
+        if result:
+            return rdecode(result[1])
 
     return None
 
-def incr(key):
-    import sputnik
+def poprange(key, count = None):
+    """
+    Atomically pops up to count oldest messages from the list in one round trip.
+    Should not be used inside of the batch.
+
+    @type key: C{string}
+    @param key: List key.
+    @type count: C{int}
+    @param count: Maximum number of messages to pop. Default is C{SPUTNIK_POLL_BATCH_SIZE}.
+    @rtype: C{list}
+    @return: Returns list of messages in the order they were pushed.
+    """
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            result = sputnik.rcon.incr(key)
-        return result
+    if count is None:
+        count = POLL_BATCH_SIZE
 
+    if not _valid(key) or count < 1:
+        return []
 
-def get(key):
-    import sputnik
+    with batch(transaction = True) as b:
+        execute('lrange', key, 0, count - 1)
+        execute('ltrim', key, count, -1)
+        execute('expire', key, QUEUE_TTL)
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            result = rdecode(sputnik.rcon.get(key))
-        return result
+    return [rdecode(el) for el in b.results[0]]
 
-def set(key, value):
-    import sputnik
+def srem(key, value):
+    if _valid(key):
+        return execute('srem', key, rencode(value))
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            result = rdecode(sputnik.rcon.set(key, value))
-        return result
+    return None
 
+def incr(key):
+    if _valid(key):
+        return execute('incr', key)
 
-def smembers(key):
-    import sputnik
+def get(key):
+    if _valid(key):
+        return rdecode(execute('get', key))
 
-    result = []
+def set(key, value):
+    if _valid(key):
+        return execute('set', key, value)
 
-    if key and key.strip() != '':
+def smembers(key):
+    if _valid(key):
         try:
-            with sputnik.rcon.lock('com'):
-                result =  [rdecode(el) for el in list(sputnik.rcon.smembers(key))]
+            result = execute('smembers', key)
         except:
             from booki.utils.log import printStack
             printStack(None)
             return []
 
-    return result
-
+        if result is None:
+            return None
 
-def rkeys(key):
-    import sputnik
+        return [rdecode(el) for el in result]
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            result = [rdecode(el) for el in list(sputnik.rcon.keys(key))]
+    return []
 
-        return result
+def rkeys(key):
+    if _valid(key):
+        return [rdecode(el) for el in execute('keys', key) or []]
 
     return []
 
 def push(key, value):
-    import sputnik
-
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            result = sputnik.rcon.rpush(key, rencode(value))
-
-        return result
+    if _valid(key):
+        return execute('rpush', key, rencode(value))
 
     return None
 
 def rdelete(key):
-    import sputnik
+    if _valid(key):
+        execute('delete', key)
+
+
+
+# Pushes message to the message queue of every client subscribed to the channel.
+#   KEYS[1] - Redis Set of clients for the channel
+#   KEYS[2] - Redis Set of clients which get messages over pub/sub
+#   ARGV[1] - encoded Sputnik message
+#   ARGV[2] - client which should not receive the message
+#   ARGV[3] - maximum number of messages in the queue
+#   ARGV[4] - queue time to live in seconds
+#   ARGV[5] - coalesce key including the channel name, message replaces the previous message with the same key if it
+#             is still in the queue
+# Returns number of clients message was pushed to.
+FANOUT_SCRIPT = """
+local n = 0
+
+for _, client in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if client ~= ARGV[2] and string.find(client, '%S') and redis.call('SISMEMBER', KEYS[2], client) == 0 then
+        local queue = 'ses:' .. client .. ':messages'
+
+        if ARGV[5] ~= '' then
+            local pending = 'ses:' .. client .. ':pending'
+            local previous = redis.call('HGET', pending, ARGV[5])
+
+            if previous then
+                redis.call('LREM', queue, 1, previous)
+            end
+
+            redis.call('HSET', pending, ARGV[5], ARGV[1])
+            redis.call('EXPIRE', pending, ARGV[4])
+        end
+
+        redis.call('RPUSH', queue, ARGV[1])
+        redis.call('LTRIM', queue, -tonumber(ARGV[3]), -1)
+        redis.call('EXPIRE', queue, ARGV[4])
+        n = n + 1
+    end
+end
+
+return n
+"""
+
+
+
+def fanout(channelName, data, exclude = '', coalesce = ''):
+    """
+    Pushes already encoded message to message queues of all clients subscribed to the channel.
+
+    Uses L{FANOUT_SCRIPT} so it is only one round trip to Redis. Falls back to one pipeline
+    if Redis server does not support scripting, messages are not coalesced then.
+
+    @type channelName: C{string}
+    @param channelName: Channel name.
+    @type data: C{string}
+    @param data: Encoded Sputnik message.
+    @type exclude: C{string}
+    @param exclude: Client which should not receive the message.
+    @type coalesce: C{string}
+    @param coalesce: Coalesce key of the message.
+    @rtype: C{int}
+    @return: Returns number of clients message was pushed to.
+    """
+
+    channelKey = "sputnik:channel:%s:channel" % channelName
+
+    # client queue is shared by all channels client is subscribed to
+    if coalesce:
+        coalesce = "%s|%s" % (channelName, coalesce)
+
+    try:
+        return evalscript(fanout_script, [channelKey, "sputnik:pubsub_clients"], [data, exclude, QUEUE_SIZE, QUEUE_TTL, coalesce])
+    except redis.exceptions.ResponseError, e:
+        if 'unknown command' not in str(e):
+            raise
+
+    pubsub_clients = set(smembers("sputnik:pubsub_clients"))
+    clients = [c for c in smembers(channelKey) if c != exclude and c.strip() != '' and c not in pubsub_clients]
+
+    with batch():
+        for c in clients:
+            push("ses:%s:messages" % c, data)
+            execute('ltrim', "ses:%s:messages" % c, -QUEUE_SIZE, -1)
+            execute('expire', "ses:%s:messages" % c, QUEUE_TTL)
+
+    return len(clients)
+
+
+# Appends message to the shared log of the channel.
+#   KEYS[1] - Redis Sorted Set with the channel log
+#   KEYS[2] - last sequence number for the channel
+#   KEYS[3] - Redis Hash with the last entry for every coalesce key
+#   KEYS[4] - Redis Hash with coalesce key for sequence number of every coalesced entry
+#   ARGV[1] - encoded Sputnik message
+#   ARGV[2] - client which should not receive the message
+#   ARGV[3] - maximum number of messages kept in the log
+#   ARGV[4] - coalesce key, message replaces the previous message with the same key
+# Returns sequence number of the message.
+LOG_SCRIPT = """
+local seq = redis.call('INCR', KEYS[2])
+local entry = seq .. '|' .. ARGV[2] .. '|' .. ARGV[1]
+
+local function sequence(e)
+    return string.sub(e, 1, string.find(e, '|', 1, true) - 1)
+end
+
+if ARGV[4] ~= '' then
+    local previous = redis.call('HGET', KEYS[3], ARGV[4])
+
+    if previous then
+        redis.call('ZREM', KEYS[1], previous)
+        redis.call('HDEL', KEYS[4], sequence(previous))
+    end
+
+    redis.call('HSET', KEYS[3], ARGV[4], entry)
+    redis.call('HSET', KEYS[4], seq, ARGV[4])
+end
+
+redis.call('ZADD', KEYS[1], seq, entry)
+
+-- entries which fall out of the log are not pending anymore
+for _, trimmed in ipairs(redis.call('ZRANGE', KEYS[1], 0, -tonumber(ARGV[3]) - 1)) do
+    local key = redis.call('HGET', KEYS[4], sequence(trimmed))
+
+    if key then
+        redis.call('HDEL', KEYS[3], key)
+        redis.call('HDEL', KEYS[4], sequence(trimmed))
+    end
+end
+
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+
+return seq
+"""
+
+# Sets cursor of the client to the last message in the channel log.
+#   KEYS[1] - Redis Hash with client cursors
+#   KEYS[2] - last sequence number for the channel
+#   ARGV[1] - channel name
+CURSOR_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], redis.call('GET', KEYS[2]) or 0)
+"""
+
+# Reads new messages from logs of all channels client is subscribed to and moves client cursors.
+#   KEYS[1] - Redis Set of channel names for the client
+#   KEYS[2] - Redis Hash with client cursors
+# Returns list of log entries.
+READ_LOG_SCRIPT = """
+local result = {}
+
+for _, channel in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local cursor = redis.call('HGET', KEYS[2], channel)
+    local entries = {}
+
+    if cursor then
+        entries = redis.call('ZRANGEBYSCORE', 'sputnik:channel:' .. channel .. ':log', '(' .. cursor, '+inf')
+    else
+        cursor = redis.call('GET', 'sputnik:channel:' .. channel .. ':sequence') or 0
+    end
+
+    if #entries > 0 then
+        local last = entries[#entries]
+        cursor = string.sub(last, 1, string.find(last, '|', 1, true) - 1)
+    end
+
+    redis.call('HSET', KEYS[2], channel, cursor)
+
+    for _, entry in ipairs(entries) do
+        table.insert(result, entry)
+    end
+end
+
+return result
+"""
+
+# Adds client to the channel and counts it in the channel presence. User is added to the online users
+# when his first client opens the channel.
+#   KEYS[1] - Redis Set of clients for the channel
+#   KEYS[2] - Redis Set of channels for the client
+#   KEYS[3] - Redis Hash with number of clients for every user in the channel
+#   KEYS[4] - username of the client
+#   KEYS[5] - Redis Set of online users and their channels
+#   ARGV[1] - client
+#   ARGV[2] - channel name
+# Clients which opened the channel before presence was counted have no entry in the presence hash.
+# Entry is then seeded by counting clients of the user which are in the channel.
+# Returns 1 if client was not in the channel before.
+ADD_CLIENT_SCRIPT = """
+local function count_clients(username)
+    local n = 0
+
+    for _, client in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+        if redis.call('GET', 'ses:' .. client .. ':username') == username then
+            n = n + 1
+        end
+    end
+
+    return n
+end
+
+redis.call('SADD', KEYS[2], ARGV[2])
+
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+
+local username = redis.call('GET', KEYS[4])
+
+if username and string.find(username, '%S') then
+    if redis.call('HEXISTS', KEYS[3], username) == 0 then
+        redis.call('HSET', KEYS[3], username, count_clients(username))
+        redis.call('SADD', KEYS[5], username .. '|' .. ARGV[2])
+    elseif redis.call('HINCRBY', KEYS[3], username, 1) == 1 then
+        redis.call('SADD', KEYS[5], username .. '|' .. ARGV[2])
+    end
+end
+
+return 1
+"""
+
+# Removes client from the channel. User is removed from the channel users when his last client leaves.
+#   KEYS[1] - Redis Set of clients for the channel
+#   KEYS[2] - Redis Hash with number of clients for every user in the channel
+#   KEYS[3] - Redis Set of users in the channel
+#   KEYS[4] - username of the client
+#   KEYS[5] - channel cursors of the client
+#   KEYS[6] - Redis Set of online users and their channels
+#   ARGV[1] - client
+#   ARGV[2] - channel name
+# Missing presence entry is seeded the same way as in L{ADD_CLIENT_SCRIPT}, so clients which opened the
+# channel before presence was counted do not announce the user as gone while other clients remain.
+# Returns username if user has left the channel.
+REMOVE_CLIENT_SCRIPT = """
+local function count_clients(username)
+    local n = 0
+
+    for _, client in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+        if redis.call('GET', 'ses:' .. client .. ':username') == username then
+            n = n + 1
+        end
+    end
+
+    return n
+end
+
+redis.call('HDEL', KEYS[5], ARGV[2])
+
+if redis.call('SREM', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+
+local username = redis.call('GET', KEYS[4])
+
+if not username or not string.find(username, '%S') then
+    return false
+end
+
+if redis.call('HEXISTS', KEYS[2], username) == 0 then
+    -- client itself was already removed from the channel
+    redis.call('HSET', KEYS[2], username, count_clients(username) + 1)
+end
+
+if redis.call('HINCRBY', KEYS[2], username, -1) > 0 then
+    return false
+end
+
+redis.call('HDEL', KEYS[2], username)
+redis.call('SREM', KEYS[6], username .. '|' .. ARGV[2])
+
+if redis.call('SREM', KEYS[3], username) == 0 then
+    return false
+end
+
+return username
+"""
+
+fanout_script = rcon.register_script(FANOUT_SCRIPT)
+log_script = rcon.register_script(LOG_SCRIPT)
+cursor_script = rcon.register_script(CURSOR_SCRIPT)
+read_log_script = rcon.register_script(READ_LOG_SCRIPT)
+add_client_script = rcon.register_script(ADD_CLIENT_SCRIPT)
+remove_client_script = rcon.register_script(REMOVE_CLIENT_SCRIPT)
+
+
+def publish(channelName, data, exclude = '', coalesce = ''):
+    """
+    Delivers already encoded message to all clients subscribed to the channel.
+
+    Depending on L{DELIVERY} message is pushed to message queue of every client or it is
+    appended to the shared channel log. With L{PUBSUB} it is also published on the channel topic
+    as C{"<exclude>|<data>"}.
+
+    Message replaces pending message with the same coalesce key if L{COALESCE} is enabled.
+
+    @type channelName: C{string}
+    @param channelName: Channel name.
+    @type data: C{string}
+    @param data: Encoded Sputnik message.
+    @type exclude: C{string}
+    @param exclude: Client which should not receive the message.
+    @type coalesce: C{string}
+    @param coalesce: Coalesce key of the message.
+    """
+
+    if not COALESCE:
+        coalesce = ''
+
+    if DELIVERY == 'log':
+        evalscript(log_script,
+                   ["sputnik:channel:%s:log" % channelName, "sputnik:channel:%s:sequence" % channelName,
+                    "sputnik:channel:%s:pending" % channelName, "sputnik:channel:%s:coalesced" % channelName],
+                   [data, exclude, CHANNEL_LOG_SIZE, coalesce])
+    else:
+        fanout(channelName, data, exclude, coalesce)
+
+    if PUBSUB:
+        execute('publish', "sputnik:topic:%s" % channelName, "%s|%s" % (exclude or '', data))
+
+
+def readChannelLogs(client):
+    """
+    Reads new messages from logs of all channels client is subscribed to. Client cursors are moved
+    after the last read message.
+
+    @type client: C{string}
+    @param client: Unique Client ID.
+    @rtype: C{list}
+    @return: Returns list of encoded Sputnik messages.
+    """
+
+    entries = evalscript(read_log_script, ["ses:%s:channels" % client, "ses:%s:cursors" % client])
+
+    return _logMessages(client, entries)
+
+
+def _logMessages(client, entries):
+    messages = []
+
+    for entry in entries or []:
+        seq, sender, data = entry.split('|', 2)
+
+        if sender != client:
+            messages.append(data)
+
+    return messages
+
+
+def popMessages(clients):
+    """
+    Pops all waiting messages for many clients in one round trip.
+
+    @type clients: C{list}
+    @param clients: List of Client IDs.
+    @rtype: C{list}
+    @return: Returns list of encoded messages for every client, in the same order as clients.
+    """
+
+    if DELIVERY == 'log':
+        with batch() as b:
+            for client in clients:
+                evalscript(read_log_script, ["ses:%s:channels" % client, "ses:%s:cursors" % client])
+
+        return [_logMessages(client, entries) for client, entries in zip(clients, b.results)]
+
+    with batch(transaction = True) as b:
+        for client in clients:
+            execute('lrange', "ses:%s:messages" % client, 0, POLL_BATCH_SIZE - 1)
+            execute('ltrim', "ses:%s:messages" % client, POLL_BATCH_SIZE, -1)
+            execute('expire', "ses:%s:messages" % client, QUEUE_TTL)
+
+    return [[rdecode(el) for el in messages] for messages in b.results[::3]]
 
-    if key and key.strip() != '':
-        with sputnik.rcon.lock('con'):
-            sputnik.rcon.delete(key)
 
- 
 # must fix this rcon issue somehow. 
 # this is stupid but will work for now
 
@@ -246,7 +946,8 @@ def removeChannel(channelName):
 
 def addClientToChannel(channelName, client):
     """
-    Add client to channel.
+    Add client to channel. Client is counted in the channel presence under username
+    which has to be set before.
 
     @type channelName: C{string}
     @param channelName: Channel name.
@@ -254,12 +955,39 @@ def addClientToChannel(channelName, client):
     @param client: Unique Client ID.
     """
 
-    sadd("ses:%s:channels" % client, channelName)
-    sadd("sputnik:channel:%s:channel" % channelName, client)
+    if not _valid(client):
+        return
+
+    evalscript(add_client_script,
+               ["sputnik:channel:%s:channel" % channelName, "ses:%s:channels" % client,
+                "sputnik:channel:%s:presence" % channelName, "ses:%s:username" % client, "sputnik:online"],
+               [client, channelName])
+
+    if DELIVERY == 'log':
+        evalscript(cursor_script, ["ses:%s:cursors" % client, "sputnik:channel:%s:sequence" % channelName], [channelName])
+
+def getOnlineUsers():
+    """
+    Returns online users and channels they have open. Users without username are not counted.
+    It is one Redis command no matter how many clients are connected.
+
+    @rtype: C{dict}
+    @return: Returns dictionary C{{username: [channel_name, ...]}}.
+    """
+
+    users = {}
+
+    for entry in smembers("sputnik:online") or []:
+        username, channelName = entry.split('|', 1)
+        users.setdefault(username, []).append(channelName)
+
+    return users
 
 def removeClientFromChannel(request, channelName, client):
     """
-    Remove client from channel.
+    Remove client from channel. If it was the last client of the user in this channel, user is
+    removed from the channel users and C{user_remove} is sent to the channel. It is one round trip
+    no matter how many clients are in the channel. Should not be used inside of the batch.
 
     @type request: C{django.http.HttpRequest}
     @param request: Django Request.
@@ -268,35 +996,29 @@ def removeClientFromChannel(request, channelName, client):
     @type client: C{string}
     @param client: Unique Client ID.
     """
-    
-    import sputnik
-    srem("sputnik:channel:%s:channel" % channelName, client)
-
-    # get our username
-    userName = sputnik.get("ses:%s:username" % client)
-
-    # get all usernames
-    users = smembers("sputnik:channel:%s:users" % channelName)
 
     try:
-        # get all clients
-        allClients = []
-        for cl in smembers("sputnik:channel:%s:channel" % channelName):
-            allClients.append(sputnik.get("ses:%s:username" % cl))
-
-        for usr in users:
-            if usr not in allClients:
-                sputnik.srem("sputnik:channel:%s:users" % channelName, usr)
-                addMessageToChannel(request, channelName, {"command": "user_remove", "username": usr}, myself = True)
+        username = evalscript(remove_client_script,
+                              ["sputnik:channel:%s:channel" % channelName, "sputnik:channel:%s:presence" % channelName,
+                               "sputnik:channel:%s:users" % channelName, "ses:%s:username" % client,
+                               "ses:%s:cursors" % client, "sputnik:online"],
+                              [client, channelName])
+
+        if username:
+            addMessageToChannel(request, channelName, {"command": "user_remove", "username": username}, myself = True)
     except:
         from booki.utils.log import printStack
         printStack(None)
 
 
-def addMessageToChannel(request, channelName, message, myself = False ):
+def addMessageToChannel(request, channelName, message, myself = False, coalesce = None):
     """
     Add message to specific channel.
 
+    Messages which only tell the current state should have coalesce key, for example
+    C{"chapter_status:<chapter_id>"}. Client which did not get the previous message with the
+    same key yet will get only this one.
+
     @type request: C{django.http.HttpRequest}
     @param request: Django Request.
     @type channelName: C{string}
@@ -305,56 +1027,41 @@ def addMessageToChannel(request, channelName, message, myself = False ):
     @param message: Sputnik message.
     @type myself: C{bool}
     @keyword myself: Should client also recieve that message.
+    @type coalesce: C{string}
+    @keyword coalesce: Coalesce key of the message.
     """
 
-    import sputnik
+    addMessageToChannel2(getattr(request, 'clientID', None), getattr(request, 'sputnikID', None),
+                         channelName, message, myself, coalesce)
 
-    # TODO
-    # not iterable
-    try:
-        clnts = sputnik.smembers("sputnik:channel:%s:channel" % channelName)
-    except:
-        from booki.utils.log import printStack
-        printStack(None)
-        return
+def addMessageToChannel2(clientID, sputnikID, channelName, message, myself = False, coalesce = None):
+    """
+    Add message to specific channel without having Django Request.
+
+    Message is encoded only once and delivered to all subscribed clients with L{publish}.
+
+    @type clientID: C{string}
+    @param clientID: Client ID of the sender.
+    @type sputnikID: C{string}
+    @param sputnikID: Sputnik ID of the sender.
+    @type channelName: C{string}
+    @param channelName: Channel name.
+    @type message: C{dict}
+    @param message: Sputnik message.
+    @type myself: C{bool}
+    @keyword myself: Should client also recieve that message.
+    @type coalesce: C{string}
+    @keyword coalesce: Coalesce key of the message.
+    """
 
     message["channel"] = channelName
-    message["clientID"] = request.clientID
-
-    for c in clnts:
-        if not myself and c == request.sputnikID:
-            continue
-
-        if c.strip() != '':
-            try:
-                sputnik.push( "ses:%s:messages" % c, json.dumps(message))
-            except:
-                pass
-                
-def addMessageToChannel2(clientID, sputnikID, channelName, message, myself = False ):
-    import sputnik
-    import json
+    message["clientID"] = clientID
 
     try:
-        clnts = sputnik.smembers("sputnik:channel:%s:channel" % channelName)
+        publish(channelName, json.dumps(message), '' if myself else (sputnikID or ''), coalesce or '')
     except:
         from booki.utils.log import printStack
         printStack(None)
-        return
-
-    message["channel"] = channelName
-    message["clientID"] = clientID
-
-    for c in clnts:
-        if not myself and c == sputnikID:
-            continue
-
-        if c.strip() != '':
-            try:
-                sputnik.push( "ses:%s:messages" % c, json.dumps(message))
-            except:
-                logger.debug('*ERROR PUSH*')
-
 
 def removeClient(request, clientName):
     """
@@ -364,8 +1071,6 @@ def removeClient(request, clientName):
     @param request: Django Request.
     @type clientName: C{string}
     @param clientName: Unique Client ID.
-
-    @todo: Should remove all tracks of user existence on the system.
     """
 
     import sputnik
@@ -375,7 +1080,54 @@ def removeClient(request, clientName):
         srem("ses:%s:channels" % clientName, chnl)
 
     sputnik.rdelete("ses:%s:username" % clientName)
-    sputnik.rdelete("ses:%s:last_access" % clientName)
+    execute('zrem', "sputnik:last_access", clientName)
+    sputnik.rdelete("ses:%s:cursors" % clientName)
+    sputnik.rdelete("ses:%s:messages" % clientName)
+    sputnik.rdelete("ses:%s:pending" % clientName)
+    srem("sputnik:pubsub_clients", clientName)
+
+
+def setLastAccess(client, timestamp = None):
+    """
+    Set timestamp of client last access.
+
+    @type client: C{string}
+    @param client: Unique Client ID.
+    @type timestamp: C{float}
+    @param timestamp: Timestamp of the last access. Current time is used if it is not set.
+    """
+
+    if _valid(client) and client.find(' ') == -1:
+        execute('zadd', "sputnik:last_access", **{client: timestamp or time.time()})
+
+def getTimeoutClients(limit = None):
+    """
+    Returns clients which did not access Sputnik for more then L{CLIENT_TIMEOUT} seconds.
+
+    @type limit: C{int}
+    @param limit: Maximum number of clients to return.
+    @rtype: C{list}
+    @return: Returns list of Client IDs, the longest inactive first.
+    """
+
+    return execute('zrangebyscore', "sputnik:last_access", '-inf', time.time() - CLIENT_TIMEOUT,
+                   start = 0 if limit else None, num = limit) or []
+
+def removeTimeoutClients(request = None, limit = MAINTENANCE_BATCH_SIZE):
+    """
+    Remove clients which did not access Sputnik for more then L{CLIENT_TIMEOUT} seconds.
+
+    @type request: C{django.http.HttpRequest}
+    @param request: Django Request or None when it is called from background task.
+    @type limit: C{int}
+    @param limit: Maximum number of clients to remove.
+    @rtype: C{int}
+    @return: Returns number of removed clients.
+    """
+
+    clients = getTimeoutClients(limit)
+
+    for client in clients:
+        removeClient(request, client)
 
-    # TODO
-    # also, i should delete all messages
+    return len(clients)
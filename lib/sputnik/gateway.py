@@ -0,0 +1,363 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+WebSocket gateway for Sputnik.
+
+Gateway is a standalone process which keeps one WebSocket connection open for every editor.
+It speaks the same message protocol as the dispatcher view:
+
+  - client sends frame C{{"clientID": ..., "messages": [...]}}
+  - gateway replies with C{{"status": true, "result": true, "messages": [...]}}
+
+Messages from the client are executed by the same C{remote_<command>} functions as in the
+dispatcher, in a pool of worker threads because Django ORM is blocking. Messages for the
+connected clients are pushed to the socket as soon as they show up in Redis. One background
+thread collects messages for all connected clients in one Redis round trip, so there is no
+polling request per client.
+
+With C{SPUTNIK_PUBSUB} gateway listens to the channel topics instead and pushes every message
+to the clients subscribed to the channel. Many gateways can run on different nodes, every one
+of them delivers messages only to the clients connected to it.
+
+Requires Tornado.
+"""
+
+import json
+import time
+import logging
+import threading
+import urlparse
+
+from multiprocessing.pool import ThreadPool
+
+from django.db import transaction, close_connection
+from django.conf import settings
+from django.http import HttpRequest
+from django.contrib.auth import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.utils.importlib import import_module
+
+from tornado import ioloop, web, websocket
+
+import sputnik
+from sputnik.views import process_messages
+
+
+logger = logging.getLogger("booktype.sputnik")
+
+# how often should we look for new messages, in seconds
+DELIVERY_INTERVAL = 0.1
+
+# how often should we refresh last access of connected clients, in seconds
+ACCESS_INTERVAL = 10
+
+
+class SputnikSocket(websocket.WebSocketHandler):
+    """
+    One WebSocket connection. User is authenticated with the Django session cookie.
+    """
+
+    def initialize(self, gateway):
+        self.gateway = gateway
+        self.session_key = None
+        self.user = None
+        self.waiting = []
+
+    def check_origin(self, origin):
+        # gateway usually runs on a different port then the web application
+        return urlparse.urlparse(origin).hostname == self.request.host.split(':')[0]
+
+    def open(self):
+        self.session_key = self.get_cookie(settings.SESSION_COOKIE_NAME)
+        self.gateway.execute(self.gateway.authenticate, (self.session_key, ), self.on_authenticated)
+
+    def on_authenticated(self, user):
+        self.user = user or AnonymousUser()
+
+        # frames which came before user was loaded
+        for data in self.waiting:
+            self.on_message(data)
+
+        self.waiting = []
+
+    def on_message(self, data):
+        if self.user is None:
+            self.waiting.append(data)
+            return
+
+        try:
+            frame = json.loads(data)
+        except ValueError:
+            self.send({"status": False, "result": False, "messages": []})
+            return
+
+        self.gateway.execute(self.gateway.process,
+                             (self, self.session_key, self.user, frame.get('clientID', ''), frame.get('messages', [])),
+                             self.on_reply)
+
+    def on_reply(self, messages):
+        if messages is None:
+            self.send({"status": False, "result": False, "messages": []})
+        else:
+            self.send({"status": True, "result": True, "messages": messages})
+
+    def send(self, frame):
+        if self.ws_connection is not None:
+            self.write_message(json.dumps(frame))
+
+    def on_close(self):
+        # client is not removed from channels here, it is removed when it times out
+        self.gateway.unregister(self)
+
+
+class Gateway(object):
+    """
+    Keeps connected sockets and moves messages between them and the worker threads.
+
+    @type sputnik_map: C{list}
+    @param sputnik_map: Mapping of channels with specific python modules.
+    @type threads: C{int}
+    @param threads: Number of worker threads.
+    """
+
+    def __init__(self, sputnik_map, threads = 10):
+        self.sputnik_map = sputnik_map
+        self.pool = ThreadPool(threads)
+        self.loop = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        # sputnikID -> socket
+        self.sockets = {}
+
+        # channel name -> set of sputnikIDs, used only with pub/sub
+        self.channels = {}
+        self.client_channels = {}
+
+    def register(self, sputnikID, socket):
+        """
+        Remembers socket for the client. Returns True if client was not registered before.
+        """
+
+        with self.lock:
+            new = sputnikID not in self.sockets
+            self.sockets[sputnikID] = socket
+
+        return new
+
+    def unregister(self, socket):
+        with self.lock:
+            clients = [sputnikID for sputnikID, s in self.sockets.items() if s is socket]
+
+            for sputnikID in clients:
+                del self.sockets[sputnikID]
+
+                for channel in self.client_channels.pop(sputnikID, []):
+                    self.channels[channel].discard(sputnikID)
+
+                    if not self.channels[channel]:
+                        del self.channels[channel]
+
+        if sputnik.PUBSUB and clients:
+            # client might continue over HTTP, message queue should be filled again
+            self.pool.apply_async(self._remove_pubsub_clients, (clients, ))
+
+    def _remove_pubsub_clients(self, clients):
+        try:
+            with sputnik.batch():
+                for sputnikID in clients:
+                    sputnik.srem("sputnik:pubsub_clients", sputnikID)
+        except:
+            logger.exception("Sputnik - gateway could not remove pub/sub clients")
+
+    def subscribe(self, sputnikID, channels):
+        """
+        Updates list of channels client gets messages from over pub/sub.
+        """
+
+        with self.lock:
+            for channel in self.client_channels.get(sputnikID, []):
+                self.channels[channel].discard(sputnikID)
+
+                if not self.channels[channel]:
+                    del self.channels[channel]
+
+            self.client_channels[sputnikID] = set(channels)
+
+            for channel in channels:
+                self.channels.setdefault(channel, set()).add(sputnikID)
+
+    def execute(self, fnc, args, callback):
+        """
+        Calls fnc in a worker thread and then callback with the result in the IOLoop thread.
+        Callback gets None if fnc failed.
+        """
+
+        def _run():
+            try:
+                return fnc(*args)
+            except:
+                logger.exception("Sputnik - gateway could not execute %s" % fnc.__name__)
+            finally:
+                close_connection()
+
+        def _done(result):
+            self.loop.add_callback(callback, result)
+
+        self.pool.apply_async(_run, callback = _done)
+
+    def authenticate(self, session_key):
+        engine = import_module(settings.SESSION_ENGINE)
+
+        request = HttpRequest()
+        request.session = engine.SessionStore(session_key)
+
+        return get_user(request)
+
+    def process(self, socket, session_key, user, clientID, messages):
+        engine = import_module(settings.SESSION_ENGINE)
+
+        request = HttpRequest()
+        request.method = 'POST'
+        request.session = engine.SessionStore(session_key)
+        request.user = user
+        request.sputnikID = "%s:%s" % (session_key, clientID)
+        request.clientID  = clientID
+
+        with transaction.commit_manually():
+            try:
+                results = process_messages(request, messages, self.sputnik_map)
+            finally:
+                transaction.commit()
+
+        # remote_connect gives client new ID
+        sputnikID = request.sputnikID
+        new = self.register(sputnikID, socket)
+
+        if socket.ws_connection is None:
+            # socket was closed while messages were processed
+            self.unregister(socket)
+            return results
+
+        if sputnik.PUBSUB:
+            # messages might have changed list of channels client is subscribed to
+            self.subscribe(sputnikID, sputnik.smembers("ses:%s:channels" % sputnikID))
+
+            if new:
+                sputnik.sadd("sputnik:pubsub_clients", sputnikID)
+
+                # messages which were sent before client was added to sputnik:pubsub_clients
+                results.extend(json.loads(m) for m in sputnik.popMessages([sputnikID])[0])
+
+        return results
+
+    def deliver_forever(self):
+        """
+        Collects messages for all connected clients and pushes them to the sockets.
+        Runs in its own thread.
+        """
+
+        last_access = 0
+
+        while not self.stopped.is_set():
+            with self.lock:
+                clients = self.sockets.keys()
+
+            if clients:
+                try:
+                    if not sputnik.PUBSUB:
+                        for client, messages in zip(clients, sputnik.popMessages(clients)):
+                            if messages:
+                                self.loop.add_callback(self.push, client, messages)
+
+                    if time.time() - last_access > ACCESS_INTERVAL:
+                        last_access = time.time()
+
+                        with sputnik.batch():
+                            for client in clients:
+                                sputnik.setLastAccess(client, last_access)
+                except:
+                    logger.exception("Sputnik - gateway could not deliver messages")
+
+            self.stopped.wait(DELIVERY_INTERVAL)
+
+    def listen_forever(self):
+        """
+        Listens to all channel topics and pushes messages to the clients subscribed to the channel.
+        Runs in its own thread.
+        """
+
+        prefix = "sputnik:topic:"
+
+        while not self.stopped.is_set():
+            try:
+                pubsub = sputnik.rcon.pubsub(ignore_subscribe_messages = True)
+                pubsub.psubscribe(prefix + "*")
+
+                for item in pubsub.listen():
+                    if self.stopped.is_set():
+                        pubsub.close()
+                        break
+
+                    if item['type'] != 'pmessage':
+                        continue
+
+                    channel = item['channel'][len(prefix):]
+                    exclude, data = item['data'].split('|', 1)
+
+                    with self.lock:
+                        clients = [c for c in self.channels.get(channel, ()) if c != exclude]
+
+                    for client in clients:
+                        self.loop.add_callback(self.push, client, [data])
+            except:
+                logger.exception("Sputnik - gateway lost pub/sub connection")
+                self.stopped.wait(DELIVERY_INTERVAL)
+
+    def push(self, sputnikID, messages):
+        with self.lock:
+            socket = self.sockets.get(sputnikID)
+
+        if socket:
+            socket.send({"status": True, "result": True, "messages": [json.loads(m) for m in messages]})
+
+    def stop(self):
+        """
+        Stops delivery threads and worker threads. Listening thread stops when it gets the next message.
+        """
+
+        self.stopped.set()
+        self.pool.close()
+
+    def application(self, path):
+        return web.Application([(path, SputnikSocket, {"gateway": self})])
+
+    def run(self, address, port, path):
+        self.loop = ioloop.IOLoop.current()
+        self.application(path).listen(port, address = address)
+
+        targets = [self.deliver_forever]
+
+        if sputnik.PUBSUB:
+            targets.append(self.listen_forever)
+
+        for target in targets:
+            thread = threading.Thread(target = target)
+            thread.daemon = True
+            thread.start()
+
+        self.loop.start()
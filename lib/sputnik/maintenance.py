@@ -0,0 +1,189 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sputnik housekeeping.
+
+Maintenance jobs are functions listed in C{SPUTNIK_MAINTENANCE_JOBS}. Every job gets C{limit} argument, handles
+at most that many items and returns number of handled items. L{run_jobs} runs all of them once. It is called by
+periodic Celery task (L{sputnik.tasks.maintenance}) or by C{manage.py sputnik_maintenance} worker, never from
+regular requests.
+
+Totals for every job are kept in Redis Hash C{sputnik:maintenance} with fields C{<job>|<name>} where name is one of
+C{runs}, C{items}, C{errors}, C{time}, C{last_run} or C{last_items}.
+"""
+
+import time
+import logging
+import importlib
+
+import sputnik
+
+
+logger = logging.getLogger("booktype.sputnik")
+
+_jobs = {}
+
+
+def remove_timeout_clients(limit):
+    """
+    Removes clients which did not access Sputnik for C{SPUTNIK_CLIENT_TIMEOUT} seconds.
+    """
+
+    return sputnik.removeTimeoutClients(limit=limit)
+
+
+# Keys of the channel, clients first. All of them are removed with the empty channel.
+CHANNEL_KEYS = ('channel', 'users', 'presence', 'log', 'sequence', 'pending', 'coalesced')
+
+# Removes channels which have no clients. Checked and removed atomically, so client can not join in between.
+#   KEYS[1] - Redis Set of channel names
+#   KEYS[2..] - keys of every channel in the order of CHANNEL_KEYS, clients of the channel first
+#   ARGV[n] - name of the n-th channel
+# Returns number of removed channels.
+REMOVE_EMPTY_CHANNELS_SCRIPT = """
+local removed = 0
+local stride = (#KEYS - 1) / #ARGV
+
+for n, channel in ipairs(ARGV) do
+    local first = 2 + (n - 1) * stride
+
+    if redis.call('SCARD', KEYS[first]) == 0 then
+        redis.call('SREM', KEYS[1], channel)
+
+        for k = first + 1, first + stride - 1 do
+            redis.call('DEL', KEYS[k])
+        end
+
+        removed = removed + 1
+    end
+end
+
+return removed
+"""
+
+remove_empty_channels_script = sputnik.rcon.register_script(REMOVE_EMPTY_CHANNELS_SCRIPT)
+
+
+def remove_empty_channels(limit):
+    """
+    Removes channels without clients from the list of channels, together with their users, presence and log.
+    Checks about C{limit} channels and continues where it stopped next time.
+    """
+
+    cursor = int(sputnik.execute('get', "sputnik:maintenance:channels_cursor") or 0)
+    cursor, channels = sputnik.execute('sscan', "sputnik:channels", cursor, count=limit)
+
+    keys = ["sputnik:channels"]
+
+    for channel in channels:
+        keys += ["sputnik:channel:%s:%s" % (channel, kind) for kind in CHANNEL_KEYS]
+
+    removed = sputnik.evalscript(remove_empty_channels_script, keys, channels) if channels else 0
+    sputnik.execute('set', "sputnik:maintenance:channels_cursor", cursor)
+
+    return removed
+
+
+def get_jobs():
+    """
+    Returns list of C{(name, function)} for all jobs in C{SPUTNIK_MAINTENANCE_JOBS}. Jobs which can not be
+    imported are logged and skipped.
+    """
+
+    jobs = []
+
+    for path in sputnik.MAINTENANCE_JOBS:
+        if path not in _jobs:
+            module_name, name = path.rsplit('.', 1)
+
+            try:
+                _jobs[path] = getattr(importlib.import_module(module_name), name)
+            except (ImportError, AttributeError):
+                logger.exception("Could not load Sputnik maintenance job '%s'." % path)
+                _jobs[path] = None
+
+        if _jobs[path]:
+            jobs.append((path.rsplit('.', 1)[1], _jobs[path]))
+
+    return jobs
+
+
+def run_jobs(limit=None):
+    """
+    Runs every maintenance job once and records how many items it handled.
+
+    @type limit: C{int}
+    @param limit: Maximum number of items each job handles. Default is C{SPUTNIK_MAINTENANCE_BATCH_SIZE}.
+    @rtype: C{dict}
+    @return: Returns dictionary C{{job_name: number_of_items}}. Failed jobs have None.
+    """
+
+    if limit is None:
+        limit = sputnik.MAINTENANCE_BATCH_SIZE
+
+    handled = {}
+
+    for name, fnc in get_jobs():
+        start = time.time()
+        errors = 0
+
+        try:
+            items = fnc(limit=limit) or 0
+        except Exception:
+            logger.exception("Sputnik maintenance job '%s' failed." % name)
+            items = None
+            errors = 1
+
+        elapsed = (time.time() - start) * 1000.0
+        handled[name] = items
+
+        if items:
+            logger.info("Sputnik maintenance - %s handled %d items" % (name, items))
+
+        try:
+            with sputnik.batch():
+                sputnik.execute('hincrby', "sputnik:maintenance", "%s|runs" % name, 1)
+                sputnik.execute('hincrby', "sputnik:maintenance", "%s|items" % name, items or 0)
+                sputnik.execute('hincrby', "sputnik:maintenance", "%s|errors" % name, errors)
+                sputnik.execute('hincrbyfloat', "sputnik:maintenance", "%s|time" % name, elapsed)
+                sputnik.execute('hset', "sputnik:maintenance", "%s|last_run" % name, int(start))
+                sputnik.execute('hset', "sputnik:maintenance", "%s|last_items" % name, items or 0)
+        except Exception:
+            logger.exception("Could not record Sputnik maintenance metrics.")
+
+    return handled
+
+
+def get_stats():
+    """
+    Returns totals for every maintenance job which ever ran.
+
+    @rtype: C{dict}
+    @return: Returns dictionary C{{job_name: {runs, items, errors, time, last_run, last_items}}}. Time is average
+             run time in milliseconds and last_run is timestamp of the last run.
+    """
+
+    jobs = {}
+
+    for field, value in (sputnik.execute('hgetall', "sputnik:maintenance") or {}).iteritems():
+        name, key = field.rsplit('|', 1)
+        jobs.setdefault(name, {})[key] = float(value) if key == 'time' else int(value)
+
+    for job in jobs.itervalues():
+        job['time'] = job.get('time', 0.0) / max(job.get('runs', 0), 1)
+
+    return jobs
@@ -0,0 +1,412 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import json
+import time
+import importlib
+import contextlib
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import HttpRequest
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.text import compress_string
+from optparse import make_option
+
+import sputnik
+from sputnik.routing import RouteTable
+from sputnik.views import process_messages, msgpack
+
+
+BENCHMARK_CHANNEL = "/sputnik-benchmark/"
+
+BENCHMARK_MAP = ((r'^/sputnik-benchmark/$', 'sputnik.management.commands.sputnik_benchmark'), )
+
+
+def remote_benchmark_write(request, message):
+    """
+    Message handler for transactions benchmark. Writes one row and fails if message asks for it.
+    """
+
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO sputnik_benchmark (id, value) VALUES (%s, %s)", [message['row'], message['uid']])
+
+    if message.get('fail'):
+        raise ValueError()
+
+
+def legacy_fanout(channelName, message, sputnikID):
+    """
+    Channel fan-out as it was done before FANOUT_SCRIPT. Every push is locked and
+    message is encoded for every client.
+    """
+
+    with sputnik.rcon.lock('com'):
+        clients = list(sputnik.rcon.smembers("sputnik:channel:%s:channel" % channelName))
+
+    for c in clients:
+        if c == sputnikID:
+            continue
+
+        if c.strip() != '':
+            with sputnik.rcon.lock('con'):
+                sputnik.rcon.rpush("ses:%s:messages" % c, json.dumps(message))
+
+
+def legacy_resolve(sputnik_map, message):
+    """
+    Finds function for the message as dispatcher did before the route table.
+    """
+
+    for mpr in sputnik_map:
+        mtch = re.match(mpr[0], message.get("channel", ""))
+
+        if mtch:
+            _m = importlib.import_module(mpr[1])
+
+            return getattr(_m, "remote_%s" % message.get('command', ''), None), mtch.groupdict()
+
+    return None, {}
+
+
+def legacy_reorder_toc(book_version, items):
+    """
+    TOC reorder as it was done before L{booktype.apps.edit.channel.reorder_toc}. Every item and its parent are
+    fetched and saved one by one.
+    """
+
+    from booki.editor import models
+
+    weight = len(items)
+
+    for chap in items:
+        try:
+            toc_item = models.BookToc.objects.get(id__exact=int(chap[0]), version=book_version)
+            toc_item.weight = weight
+
+            parent = None
+            if chap[1] != 'root':
+                try:
+                    parent = models.BookToc.objects.get(id__exact=int(chap[1]), version=book_version)
+                except Exception:
+                    pass
+
+            toc_item.parent = parent
+            toc_item.save()
+        except Exception:
+            pass
+
+        weight -= 1
+
+
+class Command(BaseCommand):
+    args = "<benchmark> [<benchmark> ...]"
+    help = "Measures performance of Sputnik operations. Available benchmarks: fanout, dispatch, transactions, encoding, toc."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--subscribers',
+                    action='store',
+                    dest='subscribers',
+                    default='10,100,1000',
+                    help='Comma separated list of channel sizes for fanout benchmark.'),
+
+        make_option('--messages',
+                    action='store',
+                    type='int',
+                    dest='messages',
+                    default=1000,
+                    help='Number of messages for dispatch benchmark.'),
+
+        make_option('--batch',
+                    action='store',
+                    type='int',
+                    dest='batch',
+                    default=20,
+                    help='Number of messages in one request for transactions benchmark.'),
+
+        make_option('--chapters',
+                    action='store',
+                    type='int',
+                    dest='chapters',
+                    default=500,
+                    help='Number of chapters in the book for encoding and toc benchmarks.'),
+
+        make_option('--repeat',
+                    action='store',
+                    type='int',
+                    dest='repeat',
+                    default=20,
+                    help='How many times to repeat each measurement.'),
+        )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("You must specify at least one benchmark.")
+
+        for name in args:
+            benchmark = getattr(self, 'benchmark_%s' % name, None)
+
+            if not benchmark:
+                raise CommandError('Unknown benchmark "%s".' % name)
+
+            benchmark(**options)
+
+    def _measure(self, fnc, repeat):
+        start = time.time()
+
+        for n in range(repeat):
+            fnc()
+
+        return (time.time() - start) * 1000.0 / repeat
+
+    @contextlib.contextmanager
+    def _test_database(self):
+        """
+        Benchmarks which need database run against a new test database, never
+        against the configured one.
+        """
+
+        setup_test_environment()
+
+        if 'south' in settings.INSTALLED_APPS:
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def _cleanup(self, clients):
+        with sputnik.batch():
+            for c in clients:
+                sputnik.rdelete("ses:%s:messages" % c)
+
+            sputnik.rdelete("sputnik:channel:%s:channel" % BENCHMARK_CHANNEL)
+
+    def benchmark_fanout(self, **options):
+        message = {"command": "chapters_changed",
+                   "ui": "benchmark",
+                   "chapters": [[n, "Chapter %d" % n] for n in range(40)]}
+
+        self.stdout.write("Fan-out of one message, average of %d runs\n" % options['repeat'])
+        self.stdout.write("%12s %12s %12s %10s\n" % ("subscribers", "old (ms)", "new (ms)", "speedup"))
+
+        for size in [int(s) for s in options['subscribers'].split(',')]:
+            clients = ["benchmark:%d" % n for n in range(size)]
+
+            self._cleanup(clients)
+
+            with sputnik.batch():
+                for c in clients:
+                    sputnik.addClientToChannel(BENCHMARK_CHANNEL, c)
+
+            try:
+                old = self._measure(lambda: legacy_fanout(BENCHMARK_CHANNEL, dict(message), clients[0]),
+                                    options['repeat'])
+                new = self._measure(lambda: sputnik.addMessageToChannel2(None, clients[0], BENCHMARK_CHANNEL, dict(message)),
+                                    options['repeat'])
+            finally:
+                self._cleanup(clients)
+
+            self.stdout.write("%12d %12.2f %12.2f %9.1fx\n" % (size, old, new, old / max(new, 0.001)))
+
+    def benchmark_dispatch(self, **options):
+        # channel modules read from the database when they are imported
+        with self._test_database():
+            self._benchmark_dispatch(**options)
+
+    def _benchmark_dispatch(self, **options):
+        from booktype.urls import SPUTNIK_DISPATCHER
+
+        messages = [{"channel": "/booktype/book/%d/1.0/" % n, "command": "chapter_status"} for n in range(options['messages'] / 2)]
+        messages += [{"channel": "/booki/", "command": "ping"} for n in range(options['messages'] - len(messages))]
+
+        table = RouteTable(SPUTNIK_DISPATCHER)
+
+        def _old():
+            for message in messages:
+                legacy_resolve(SPUTNIK_DISPATCHER, message)
+
+        def _new():
+            for message in messages:
+                table.resolve(message["channel"], message["command"])
+
+        # import modules before measuring
+        _old()
+        _new()
+
+        old = self._measure(_old, options['repeat'])
+        new = self._measure(_new, options['repeat'])
+
+        self.stdout.write("Routing of %d messages, average of %d runs\n" % (len(messages), options['repeat']))
+        self.stdout.write("%12s %12s %10s\n" % ("old (ms)", "new (ms)", "speedup"))
+        self.stdout.write("%12.2f %12.2f %9.1fx\n" % (old, new, old / max(new, 0.001)))
+
+    def benchmark_transactions(self, **options):
+        with self._test_database():
+            self._benchmark_transactions(**options)
+
+    def _benchmark_transactions(self, **options):
+        request = HttpRequest()
+        rows = iter(xrange(1, 10 ** 9))
+
+        def _run(mode, fail):
+            sputnik.TRANSACTION_MODE = mode
+            messages = [{"channel": BENCHMARK_CHANNEL, "command": "benchmark_write", "uid": n, "row": rows.next(),
+                         "fail": fail and n == options['batch'] / 2}
+                        for n in range(options['batch'])]
+
+            with transaction.commit_manually():
+                try:
+                    process_messages(request, messages, BENCHMARK_MAP)
+                finally:
+                    transaction.commit()
+
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE sputnik_benchmark (id INTEGER PRIMARY KEY, value INTEGER)")
+        transaction.commit_unless_managed()
+
+        mode = sputnik.TRANSACTION_MODE
+
+        self.stdout.write("%d messages in one request on %s (savepoints: %s), average of %d runs\n" % (
+            options['batch'], connection.vendor, connection.features.uses_savepoints, options['repeat']))
+        self.stdout.write("%20s %12s %12s\n" % ("", "message (ms)", "batch (ms)"))
+
+        try:
+            for title, fail in (("all succeed", False), ("one fails", True)):
+                per_message = self._measure(lambda: _run('message', fail), options['repeat'])
+                per_batch = self._measure(lambda: _run('batch', fail), options['repeat'])
+
+                self.stdout.write("%20s %12.2f %12.2f\n" % (title, per_message, per_batch))
+        finally:
+            sputnik.TRANSACTION_MODE = mode
+
+    def benchmark_encoding(self, **options):
+        chapters = options['chapters']
+
+        # looks like reply to remote_init_editor
+        init_editor = {"chapters": [(n, "Chapter number %d" % n, "chapter-number-%d" % n, 1, 3, "root", n)
+                                    for n in range(chapters)],
+                       "metadata": [{"name": "title", "value": "Benchmark book"}],
+                       "hold": [],
+                       "users": ["<b>user%d</b>" % n for n in range(10)],
+                       "locks": {},
+                       "statuses": [(n, "Status %d" % n) for n in range(5)],
+                       "attachments": [{"id": n, "dimension": (800, 600), "status": 3, "name": "image%d.png" % n,
+                                        "created": "2014-01-01 12:00:00", "size": 123456}
+                                       for n in range(chapters / 5)],
+                       "onlineUsers": [("user%d" % n, "mood") for n in range(10)],
+                       "uid": 1, "status": True}
+
+        # looks like reply to remote_get_chapter
+        get_chapter = {"title": "Chapter number 1", "status": 3, "uid": 2,
+                       "content": "".join("<p>Paragraph %d of the chapter with some text in it, and some more "
+                                          "text so it looks like a real paragraph.</p>\n" % n for n in range(200))}
+
+        encodings = [("json", lambda d: json.dumps(d)),
+                     ("json+gzip", lambda d: compress_string(json.dumps(d)))]
+
+        if msgpack:
+            encodings += [("msgpack", lambda d: msgpack.packb(d)),
+                          ("msgpack+gzip", lambda d: compress_string(msgpack.packb(d)))]
+        else:
+            self.stdout.write("msgpack is not installed, skipping MessagePack.\n")
+
+        self.stdout.write("Encoding of poll responses for a book with %d chapters, average of %d runs\n" % (
+            chapters, options['repeat']))
+        self.stdout.write("%14s %20s %12s %12s\n" % ("response", "encoding", "size (B)", "time (ms)"))
+
+        for title, data in (("init_editor", {"status": True, "result": True, "messages": [init_editor]}),
+                            ("get_chapter", {"status": True, "result": True, "messages": [get_chapter]})):
+            for name, encode in encodings:
+                size = len(encode(data))
+                elapsed = self._measure(lambda: encode(data), options['repeat'])
+
+                self.stdout.write("%14s %20s %12d %12.2f\n" % (title, name, size, elapsed))
+
+    def benchmark_toc(self, **options):
+        with self._test_database():
+            self._benchmark_toc(options['chapters'], options['repeat'])
+
+    def _benchmark_toc(self, chapters, repeat):
+        from django.contrib.auth.models import User
+        from booki.editor import models
+        from booktype.utils.book import create_book
+        from booktype.apps.edit.channel import reorder_toc
+
+        user = User.objects.create_user('sputnik-benchmark', 'sputnik-benchmark@booktype.pro', 'benchmark')
+        book = create_book(user, 'Sputnik benchmark')
+        status = models.BookStatus.objects.filter(book=book).order_by("-weight")[0]
+
+        # one section for every 20 chapters
+        toc = []
+
+        for n in range(chapters):
+            if n % 20 == 0:
+                section = models.BookToc(version=book.version, book=book, name='Section %d' % n, weight=0, typeof=0)
+                section.save()
+                toc.append((section.id, 'root'))
+
+            chapter = models.Chapter(book=book, version=book.version, url_title='chapter-%d' % n,
+                                     title='Chapter %d' % n, status=status, content='')
+            chapter.save()
+
+            item = models.BookToc(version=book.version, book=book, name=chapter.title, chapter=chapter,
+                                  parent=section, weight=0, typeof=1)
+            item.save()
+            toc.append((item.id, section.id))
+
+        reorder_toc(book.version, toc)
+
+        # drag the last chapter to the top of the first section and back
+        moved = [toc[0], toc[-1]] + toc[1:-1]
+        orders = [moved, toc]
+
+        def _run(fnc):
+            connection.queries = []
+
+            for items in orders:
+                fnc(book.version, items)
+
+            return len(connection.queries) / len(orders)
+
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+
+        try:
+            old_queries = _run(legacy_reorder_toc)
+            new_queries = _run(reorder_toc)
+
+            old = self._measure(lambda: _run(legacy_reorder_toc), repeat) / len(orders)
+            new = self._measure(lambda: _run(reorder_toc), repeat) / len(orders)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+
+        self.stdout.write("Moving one chapter in a TOC with %d items on %s, average of %d runs\n" % (
+            len(toc), connection.vendor, repeat))
+        self.stdout.write("%12s %12s %12s %12s %10s\n" % ("old (ms)", "new (ms)", "old queries", "new queries",
+                                                         "speedup"))
+        self.stdout.write("%12.2f %12.2f %12d %12d %9.1fx\n" % (old, new, old_queries, new_queries,
+                                                              old / max(new, 0.001)))
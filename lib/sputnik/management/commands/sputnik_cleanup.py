@@ -0,0 +1,121 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+import sputnik
+
+
+def chunks(items, size):
+    for n in range(0, len(items), size):
+        yield items[n:n + size]
+
+
+class Command(BaseCommand):
+    help = """Reports Sputnik keys in Redis which belong to clients that are not connected anymore.
+Client is connected as long as it is in sputnik:last_access. Use --delete to remove orphaned keys."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--delete',
+                    action='store_true',
+                    dest='delete',
+                    default=False,
+                    help='Delete orphaned keys. Without it command only reports them.'),
+
+        make_option('--batch-size',
+                    action='store',
+                    type='int',
+                    dest='batch_size',
+                    default=1000,
+                    help='Number of keys checked in one Redis round trip.'),
+        )
+
+    requires_model_validation = False
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # ses:<client_id>:<kind>
+        client_keys = {}
+
+        for key in sputnik.rcon.scan_iter(match='ses:*:*', count=batch_size):
+            client, kind = key[4:].rsplit(':', 1)
+            client_keys.setdefault(client, []).append(key)
+
+        clients = client_keys.keys()
+        orphans = []
+
+        for part in chunks(clients, batch_size):
+            with sputnik.batch() as b:
+                for client in part:
+                    sputnik.execute('zscore', 'sputnik:last_access', client)
+
+            orphans.extend(client for client, score in zip(part, b.results) if score is None)
+
+        orphan_keys = [key for client in orphans for key in client_keys[client]]
+        queues = [key for key in orphan_keys if key.endswith(':messages')]
+        messages = 0
+
+        for part in chunks(queues, batch_size):
+            with sputnik.batch() as b:
+                for key in part:
+                    sputnik.execute('llen', key)
+
+            messages += sum(b.results)
+
+        # channel memberships of clients which are gone
+        memberships = {}
+
+        for key in sputnik.rcon.scan_iter(match='sputnik:channel:*:channel', count=batch_size):
+            members = list(sputnik.smembers(key))
+
+            for part in chunks(members, batch_size):
+                with sputnik.batch() as b:
+                    for client in part:
+                        sputnik.execute('zscore', 'sputnik:last_access', client)
+
+                stale = [client for client, score in zip(part, b.results) if score is None]
+
+                if stale:
+                    memberships.setdefault(key, []).extend(stale)
+
+        self.stdout.write("Clients with keys: %d\n" % len(clients))
+        self.stdout.write("Orphaned clients: %d\n" % len(orphans))
+        self.stdout.write("Orphaned keys: %d\n" % len(orphan_keys))
+        self.stdout.write("Messages in orphaned queues: %d\n" % messages)
+        self.stdout.write("Orphaned channel memberships: %d\n" % sum(len(m) for m in memberships.values()))
+
+        if not options['delete']:
+            return
+
+        # before orphaned keys are deleted, so presence of the user can still be updated
+        for key, stale in memberships.iteritems():
+            channel = key[len('sputnik:channel:'):-len(':channel')]
+
+            for client in stale:
+                sputnik.removeClientFromChannel(None, channel, client)
+
+        for client in orphans:
+            # notifies channels that user is gone
+            sputnik.removeClient(None, client)
+
+        for part in chunks(orphan_keys, batch_size):
+            with sputnik.batch():
+                for key in part:
+                    sputnik.rdelete(key)
+
+        self.stdout.write("Deleted.\n")
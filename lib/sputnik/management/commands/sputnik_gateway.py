@@ -0,0 +1,76 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.importlib import import_module
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    help = "Runs Sputnik WebSocket gateway. Requires Tornado."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--address',
+                    action='store',
+                    dest='address',
+                    default='',
+                    help='Address gateway should listen on.'),
+
+        make_option('--port',
+                    action='store',
+                    type='int',
+                    dest='port',
+                    default=8001,
+                    help='Port gateway should listen on.'),
+
+        make_option('--path',
+                    action='store',
+                    dest='path',
+                    default='/_sputnik/ws/',
+                    help='URL path of the WebSocket endpoint.'),
+
+        make_option('--threads',
+                    action='store',
+                    type='int',
+                    dest='threads',
+                    default=10,
+                    help='Number of worker threads executing client messages.'),
+
+        make_option('--map',
+                    action='store',
+                    dest='map',
+                    default='booktype.urls.SPUTNIK_DISPATCHER',
+                    help='Python path to the mapping of channels with python modules.'),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from sputnik.gateway import Gateway
+        except ImportError, e:
+            raise CommandError("Could not start gateway. Is Tornado installed? (%s)" % e)
+
+        module_name, attr = options['map'].rsplit('.', 1)
+
+        try:
+            sputnik_map = getattr(import_module(module_name), attr)
+        except (ImportError, AttributeError):
+            raise CommandError('Could not load Sputnik map "%s".' % options['map'])
+
+        self.stdout.write("Sputnik gateway listening on %s:%d%s\n" % (options['address'] or '*',
+                                                                      options['port'],
+                                                                      options['path']))
+
+        Gateway(sputnik_map, threads = options['threads']).run(options['address'], options['port'], options['path'])
@@ -0,0 +1,317 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+import random
+import datetime
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from optparse import make_option
+
+import sputnik
+
+
+LOADTEST_USERNAME = 'sputnik-loadtest'
+LOADTEST_PASSWORD = 'sputnik-loadtest'
+
+
+def percentile(values, p):
+    """
+    Returns value below which C{p} percent of sorted C{values} are (nearest rank).
+    """
+
+    if not values:
+        return 0.0
+
+    n = int(round(p / 100.0 * len(values) + 0.5)) - 1
+
+    return values[max(0, min(n, len(values) - 1))]
+
+
+class Results(object):
+    """
+    Latencies, Redis operations and errors collected from all simulated editors.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.redis_ops = {}
+        self.errors = {}
+
+    def add(self, command, elapsed, ops, ok):
+        with self.lock:
+            self.latencies.setdefault(command, []).append(elapsed)
+            self.redis_ops.setdefault(command, []).append(ops)
+            self.errors[command] = self.errors.get(command, 0) + (0 if ok else 1)
+
+    def requests(self):
+        return sum(len(v) for v in self.latencies.values())
+
+
+class Editor(object):
+    """
+    Simulated editor. Has its own session and talks to the dispatcher the same way editor in the browser does.
+    """
+
+    def __init__(self, results, dispatcher):
+        self.results = results
+        self.dispatcher = dispatcher
+        self.client = Client()
+        self.client_id = None
+        self.uid = 0
+
+        if not self.client.login(username=LOADTEST_USERNAME, password=LOADTEST_PASSWORD):
+            raise CommandError("Could not log in as %s." % LOADTEST_USERNAME)
+
+    @property
+    def sputnik_id(self):
+        return "%s:%s" % (self.client.session.session_key, self.client_id)
+
+    def post(self, name, messages):
+        """
+        Sends messages in one request. Records latency and number of Redis commands dispatcher issued.
+        Dispatcher runs in this thread so Sputnik statistics belong to this request only.
+        """
+
+        start = time.time()
+        response = self.client.post(self.dispatcher, {'clientID': self.client_id or '',
+                                                      'messages': json.dumps(messages)})
+        elapsed = (time.time() - start) * 1000.0
+
+        ops = sum(stat['calls'] for stat in sputnik.get_stats().values())
+        data = json.loads(response.content) if response.status_code == 200 else {}
+        ok = data.get('status', False) and all(r.get('status', True) for r in data.get('messages', [])
+                                                if 'uid' in r)
+
+        self.results.add(name, elapsed, ops, ok)
+
+        return data
+
+    def call(self, command, channel, **message):
+        self.uid += 1
+        message.update({'channel': channel, 'command': command, 'uid': self.uid})
+
+        data = self.post(command, [message])
+
+        for reply in data.get('messages', []):
+            if reply.get('uid') == self.uid:
+                return reply
+
+        return {}
+
+    def poll(self):
+        return self.post('poll', [])
+
+    def scenario(self, book_channel, chapters, iterations):
+        """
+        Editing session. Generator yields after every request so many editors can share one thread.
+        """
+
+        reply = self.call('connect', '/booki/', channels=['/booki/', '/chat/%s/' % book_channel.split('/')[3]])
+        self.client_id = reply.get('clientID')
+
+        if not self.client_id:
+            return
+
+        yield
+
+        self.call('subscribe', '/booki/', channels=[book_channel])
+        yield
+
+        for n in range(iterations):
+            self.call('ping', '/booki/')
+            yield
+
+            chapter_id = random.choice(chapters)
+
+            self.call('get_chapter', book_channel, chapterID=chapter_id, lock=True)
+            yield
+
+            self.call('chapter_save', book_channel, chapterID=chapter_id,
+                      content='<h1>Chapter %d</h1><p>Saved by simulated editor, iteration %d.</p>' % (chapter_id, n),
+                      footnotes={}, minor=False, comment='', author='', authorcomment='',
+                      **{'continue': False})
+            yield
+
+            self.poll()
+            yield
+
+        sputnik.removeClient(None, self.sputnik_id)
+
+
+class EditorThread(threading.Thread):
+    """
+    Runs scenarios of many editors in one thread, one request from each editor in turn.
+    """
+
+    def __init__(self, editors, *args):
+        threading.Thread.__init__(self)
+
+        self.scenarios = [editor.scenario(*args) for editor in editors]
+        self.error = None
+
+    def run(self):
+        try:
+            while self.scenarios:
+                for scenario in list(self.scenarios):
+                    try:
+                        scenario.next()
+                    except StopIteration:
+                        self.scenarios.remove(scenario)
+        except Exception, e:
+            self.error = e
+
+
+class Command(BaseCommand):
+    help = """Simulates editors working on one book and reports throughput, latency of every Sputnik command and
+number of Redis commands per request. Runs against the real dispatcher and Redis, but in a test database."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--clients',
+                    action='store',
+                    type='int',
+                    dest='clients',
+                    default=20,
+                    help='Number of simulated editors.'),
+
+        make_option('--iterations',
+                    action='store',
+                    type='int',
+                    dest='iterations',
+                    default=10,
+                    help='Number of edit cycles (ping, get_chapter, chapter_save, poll) per editor.'),
+
+        make_option('--threads',
+                    action='store',
+                    type='int',
+                    dest='threads',
+                    default=1,
+                    help='Number of threads sending requests. Editors are divided between threads.'),
+
+        make_option('--chapters',
+                    action='store',
+                    type='int',
+                    dest='chapters',
+                    default=20,
+                    help='Number of chapters in the book.'),
+        )
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['threads'] < 1:
+            raise CommandError("Number of clients and threads must be positive.")
+
+        setup_test_environment()
+
+        if 'south' in settings.INSTALLED_APPS:
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            if options['threads'] > 1 and connection.vendor == 'sqlite' and \
+                    connection.settings_dict['NAME'] == ':memory:':
+                raise CommandError("In-memory SQLite database can not be shared between threads. Use --threads=1 "
+                                   "or database with TEST_NAME.")
+
+            self.run(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def create_book(self, chapters):
+        from django.contrib.auth.models import User
+        from booki.editor import models
+        from booktype.utils.book import create_book
+
+        user = User.objects.create_user(LOADTEST_USERNAME, '%s@booktype.pro' % LOADTEST_USERNAME, LOADTEST_PASSWORD)
+        book = create_book(user, 'Sputnik load test')
+        status = models.BookStatus.objects.filter(book=book).order_by("-weight")[0]
+
+        chapter_ids = []
+
+        for n in range(chapters):
+            chapter = models.Chapter(book=book, version=book.version, url_title='chapter-%d' % n,
+                                     title='Chapter %d' % n, status=status, content='<h1>Chapter %d</h1>' % n,
+                                     created=datetime.datetime.now(), modified=datetime.datetime.now())
+            chapter.save()
+
+            models.BookToc(version=book.version, book=book, name=chapter.title, chapter=chapter,
+                           weight=chapters - n, typeof=1).save()
+
+            chapter_ids.append(chapter.id)
+
+        return book, chapter_ids
+
+    def run(self, **options):
+        book, chapters = self.create_book(options['chapters'])
+        book_channel = '/booktype/book/%d/%s/' % (book.id, book.version.get_version())
+
+        results = Results()
+        dispatcher = reverse('sputnik_dispatcher')
+        editors = [Editor(results, dispatcher) for n in range(options['clients'])]
+
+        threads = [EditorThread(editors[n::options['threads']], book_channel, chapters, options['iterations'])
+                   for n in range(options['threads'])]
+
+        start = time.time()
+
+        if len(threads) == 1:
+            # in-memory SQLite database is visible only to the thread which created it
+            threads[0].run()
+        else:
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        elapsed = time.time() - start
+
+        for thread in threads:
+            if thread.error:
+                raise CommandError("Simulated editor failed: %s" % thread.error)
+
+        for channel in (book_channel, '/chat/%d/' % book.id):
+            sputnik.rdelete("sputnik:channel:%s:channel" % channel)
+            sputnik.removeChannel(channel)
+
+        self.stdout.write("%d simulated editors, %d iterations, %d threads, Redis at %s:%s/%s\n" % (
+            options['clients'], options['iterations'], options['threads'],
+            sputnik.REDIS_HOST, sputnik.REDIS_PORT, sputnik.REDIS_DB))
+        self.stdout.write("%d requests in %.2f s, %.1f requests/s\n\n" % (
+            results.requests(), elapsed, results.requests() / max(elapsed, 0.001)))
+
+        self.stdout.write("%14s %9s %7s %10s %10s %10s %12s\n" % (
+            "command", "requests", "errors", "p50 (ms)", "p95 (ms)", "p99 (ms)", "redis ops"))
+
+        for command in ('connect', 'subscribe', 'ping', 'get_chapter', 'chapter_save', 'poll'):
+            latencies = sorted(results.latencies.get(command, []))
+            ops = results.redis_ops.get(command, [])
+
+            self.stdout.write("%14s %9d %7d %10.2f %10.2f %10.2f %12.1f\n" % (
+                command, len(latencies), results.errors.get(command, 0),
+                percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99),
+                float(sum(ops)) / max(len(ops), 1)))
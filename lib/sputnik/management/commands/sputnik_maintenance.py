@@ -0,0 +1,67 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_connection
+from optparse import make_option
+
+import sputnik
+from sputnik import maintenance
+
+
+class Command(BaseCommand):
+    help = """Runs Sputnik maintenance jobs (inactive clients, empty channels, stale chapter locks) every
+--interval seconds. Use it instead of celerybeat, or use --once to run them from cron."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--interval',
+                    action='store',
+                    type='int',
+                    dest='interval',
+                    default=sputnik.MAINTENANCE_INTERVAL,
+                    help='Number of seconds between two runs.'),
+
+        make_option('--batch-size',
+                    action='store',
+                    type='int',
+                    dest='batch_size',
+                    default=sputnik.MAINTENANCE_BATCH_SIZE,
+                    help='Maximum number of items every job handles in one run.'),
+
+        make_option('--once',
+                    action='store_true',
+                    dest='once',
+                    default=False,
+                    help='Run jobs once and exit.'),
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            handled = maintenance.run_jobs(options['batch_size'])
+
+            if int(options['verbosity']) > 1 or options['once']:
+                for name, items in sorted(handled.iteritems()):
+                    self.stdout.write("%s: %s\n" % (name, 'failed' if items is None else items))
+
+            # do not keep idle database connection open between runs
+            close_connection()
+
+            if options['once']:
+                break
+
+            time.sleep(options['interval'])
@@ -0,0 +1,268 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Metrics of executed Sputnik commands.
+
+For every executed message dispatcher records wall time, number of SQL queries, time spent in SQL and number
+of Redis commands. Metrics are aggregated per command in windows of C{SPUTNIK_METRICS_WINDOW} seconds. Every
+window is one Redis Hash C{sputnik:metrics:<timestamp>} which expires after C{SPUTNIK_METRICS_RETENTION}
+windows, so the last hour (by default) is always available. Wall time is also counted in histogram buckets
+(L{BUCKETS}) so percentiles can be estimated for any number of windows.
+
+Hash fields are C{<command>|<name>} where name is one of C{count}, C{errors}, C{time}, C{queries}, C{sql},
+C{redis} or C{le:<bucket>}.
+"""
+
+import time
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+import sputnik
+
+
+logger = logging.getLogger("booktype.sputnik")
+
+# upper bounds of histogram buckets in milliseconds, slower commands are counted in "inf"
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _redis_calls():
+    return sum(stat['calls'] for stat in sputnik.get_stats().itervalues())
+
+
+def _bucket(elapsed):
+    for bound in BUCKETS:
+        if elapsed <= bound:
+            return str(bound)
+
+    return 'inf'
+
+
+def window_start(timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+
+    return int(timestamp // sputnik.METRICS_WINDOW) * sputnik.METRICS_WINDOW
+
+
+class Sample(object):
+    """
+    Measurement of one executed command. Created by L{Collector.start}.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.ok = True
+        self.elapsed = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.redis = 0
+
+        self._queries = len(connection.queries)
+        self._redis = _redis_calls()
+        self._start = time.time()
+
+    def stop(self, ok):
+        self.elapsed = (time.time() - self._start) * 1000.0
+        self.ok = ok
+
+        queries = connection.queries[self._queries:]
+
+        self.queries = len(queries)
+        self.sql_time = sum(float(q.get('time') or 0) for q in queries) * 1000.0
+        self.redis = _redis_calls() - self._redis
+
+
+class Collector(object):
+    """
+    Collects samples of commands executed inside of C{with} block and writes them to Redis at the end.
+    SQL queries are logged by Django debug cursor while collector is active, even if C{DEBUG} is off.
+
+    Does nothing if C{SPUTNIK_METRICS} is off.
+    """
+
+    def __init__(self):
+        self.enabled = sputnik.METRICS
+        self.samples = []
+
+    def __enter__(self):
+        if self.enabled:
+            self._use_debug_cursor = connection.use_debug_cursor
+            self._queries = len(connection.queries)
+            connection.use_debug_cursor = True
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.enabled:
+            return
+
+        connection.use_debug_cursor = self._use_debug_cursor
+
+        # without DEBUG nobody resets the query log
+        if not settings.DEBUG:
+            del connection.queries[self._queries:]
+
+        try:
+            record(self.samples)
+        except Exception:
+            logger.exception("Could not record Sputnik metrics.")
+
+    def start(self, command):
+        """
+        Starts measurement of one command.
+
+        @type command: C{string}
+        @param command: Command name.
+        @rtype: L{Sample}
+        @return: Returns sample which has to be stopped when command is done or None if metrics are off.
+        """
+
+        if not self.enabled:
+            return None
+
+        sample = Sample(command)
+        self.samples.append(sample)
+
+        return sample
+
+
+def record(samples):
+    """
+    Adds samples to the metrics of the current window. Samples are aggregated by command first,
+    so it is one round trip to Redis.
+
+    @type samples: C{list}
+    @param samples: List of stopped L{Sample} objects.
+    """
+
+    if not samples:
+        return
+
+    totals = {}
+
+    for sample in samples:
+        t = totals.setdefault(sample.command, {'count': 0, 'errors': 0, 'time': 0.0, 'queries': 0,
+                                               'sql': 0.0, 'redis': 0, 'buckets': {}})
+        t['count'] += 1
+        t['errors'] += 0 if sample.ok else 1
+        t['time'] += sample.elapsed
+        t['queries'] += sample.queries
+        t['sql'] += sample.sql_time
+        t['redis'] += sample.redis
+
+        bucket = _bucket(sample.elapsed)
+        t['buckets'][bucket] = t['buckets'].get(bucket, 0) + 1
+
+    key = "sputnik:metrics:%d" % window_start()
+
+    with sputnik.batch():
+        for command, t in totals.iteritems():
+            for name in ('count', 'errors', 'queries', 'redis'):
+                if t[name]:
+                    sputnik.execute('hincrby', key, '%s|%s' % (command, name), t[name])
+
+            for name in ('time', 'sql'):
+                if t[name]:
+                    sputnik.execute('hincrbyfloat', key, '%s|%s' % (command, name), t[name])
+
+            for bucket, count in t['buckets'].iteritems():
+                sputnik.execute('hincrby', key, '%s|le:%s' % (command, bucket), count)
+
+        sputnik.execute('expire', key, sputnik.METRICS_WINDOW * sputnik.METRICS_RETENTION)
+
+
+def _percentile(histogram, count, p):
+    """
+    Returns upper bound of the bucket where C{p} percent of samples are, or None if it is in the last bucket.
+    """
+
+    target = p / 100.0 * count
+    seen = 0
+
+    for bound in BUCKETS:
+        seen += histogram.get(str(bound), 0)
+
+        if seen >= target:
+            return bound
+
+    return None
+
+
+def get_metrics(windows=None):
+    """
+    Returns metrics of all commands for the last C{windows} windows (including current one).
+
+    @type windows: C{int}
+    @param windows: Number of windows. Default is all kept windows (C{SPUTNIK_METRICS_RETENTION}).
+    @rtype: C{dict}
+    @return: Returns dictionary with C{window} (length of window in seconds), C{windows} and C{commands}.
+             Commands is dictionary C{{command: {count, errors, time, queries, sql, redis, histogram, p50, p95,
+             p99}}}. Times are averages in milliseconds, queries and redis are averages per command, histogram
+             is list of C{[upper_bound, count]} and percentiles are upper bounds of histogram buckets (None if
+             slower than the last bucket).
+    """
+
+    if windows is None:
+        windows = sputnik.METRICS_RETENTION
+
+    windows = max(1, min(int(windows), sputnik.METRICS_RETENTION))
+    current = window_start()
+
+    with sputnik.batch() as b:
+        for n in range(windows):
+            sputnik.execute('hgetall', "sputnik:metrics:%d" % (current - n * sputnik.METRICS_WINDOW))
+
+    totals = {}
+
+    for data in b.results:
+        for field, value in (data or {}).iteritems():
+            command, name = field.rsplit('|', 1)
+            t = totals.setdefault(command, {'histogram': {}})
+
+            if name.startswith('le:'):
+                t['histogram'][name[3:]] = t['histogram'].get(name[3:], 0) + int(value)
+            else:
+                t[name] = t.get(name, 0) + float(value)
+
+    commands = {}
+
+    for command, t in totals.iteritems():
+        count = int(t.get('count', 0))
+
+        if not count:
+            continue
+
+        histogram = t['histogram']
+
+        commands[command] = {'count': count,
+                             'errors': int(t.get('errors', 0)),
+                             'time': t.get('time', 0) / count,
+                             'queries': t.get('queries', 0) / count,
+                             'sql': t.get('sql', 0) / count,
+                             'redis': t.get('redis', 0) / count,
+                             'histogram': [[bound, histogram.get(str(bound), 0)] for bound in BUCKETS] +
+                                          [['inf', histogram.get('inf', 0)]],
+                             'p50': _percentile(histogram, count, 50),
+                             'p95': _percentile(histogram, count, 95),
+                             'p99': _percentile(histogram, count, 99)}
+
+    return {'window': sputnik.METRICS_WINDOW,
+            'windows': windows,
+            'commands': commands}
@@ -0,0 +1,234 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Routing of Sputnik messages to C{remote_<command>} functions.
+
+Sputnik map is a list of C{(channel_regex, module_name)} pairs. It is compiled once per process
+into L{RouteTable}. Routes are indexed by the first part of the channel name (C{/booki/},
+C{/chat/}...) so only a few regular expressions are tried for a new channel, and the match is
+remembered for channels which were already seen. Patterns which do not start with the whole first
+part of the channel name, or have alternatives (C{^/booki/|^/chat/}), are tried for every channel. Modules and functions are imported and looked
+up only once.
+"""
+
+import re
+import logging
+import importlib
+
+
+logger = logging.getLogger("booktype.sputnik")
+
+# characters which end literal prefix of the regular expression
+REGEX_SPECIAL = re.compile(r'[\\.^$*+?{}\[\]|()]')
+
+# maximum number of channel names remembered by one route table
+CHANNEL_CACHE_SIZE = 10000
+
+_tables = {}
+
+
+def has_alternation(pattern):
+    """
+    Returns True if regular expression has C{|} outside of groups and character classes. Such pattern
+    can match channels with any first part, not only the one before C{|}.
+    """
+
+    depth = 0
+    n = 0
+
+    while n < len(pattern):
+        char = pattern[n]
+
+        if char == '\\':
+            n += 1
+        elif char == '[':
+            # first character of the class (after negation) can be ]
+            n += 1
+
+            if pattern[n:n + 1] == '^':
+                n += 1
+
+            if pattern[n:n + 1] == ']':
+                n += 1
+
+            while n < len(pattern) and pattern[n] != ']':
+                if pattern[n] == '\\':
+                    n += 1
+
+                n += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+
+        n += 1
+
+    return False
+
+
+def channel_prefix(channel):
+    """
+    Returns first part of the channel name. For C{/booki/book/1/} it returns C{/booki/}.
+    """
+
+    parts = channel.split('/', 2)
+
+    if len(parts) < 3:
+        return None
+
+    return '/%s/' % parts[1]
+
+
+class Route(object):
+    def __init__(self, position, pattern, module_name):
+        self.position = position
+        self.regex = re.compile(pattern)
+        self.module_name = module_name
+        self.handlers = {}
+        self._module = None
+
+        literal = pattern.lstrip('^')
+        match = REGEX_SPECIAL.search(literal)
+
+        if match:
+            # quantifier makes the last literal character optional
+            if match.group() in '?*{':
+                literal = literal[:match.start() - 1]
+            else:
+                literal = literal[:match.start()]
+
+        # route is indexed only if literal part of the pattern has whole first part of the channel name,
+        # patterns with alternatives are always tried
+        self.prefix = None
+
+        if pattern.startswith('^') and not has_alternation(pattern):
+            prefix = channel_prefix(literal)
+
+            if prefix and literal.startswith(prefix):
+                self.prefix = prefix
+
+    @property
+    def module(self):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self.module_name)
+            except ImportError:
+                logger.exception("Could not import module '%s' for Sputnik." % self.module_name)
+                self._module = False
+
+        return self._module
+
+    def handler(self, command):
+        """
+        Returns C{remote_<command>} function from the route module or None if it does not exist.
+        """
+
+        try:
+            return self.handlers[command]
+        except KeyError:
+            pass
+
+        fnc = None
+
+        if self.module:
+            fnc = getattr(self.module, "remote_%s" % command, None)
+
+            if not callable(fnc):
+                fnc = None
+
+        self.handlers[command] = fnc
+
+        return fnc
+
+
+class RouteTable(object):
+    """
+    Compiled Sputnik map.
+
+    @type sputnik_map: C{list}
+    @param sputnik_map: Mapping of channels with specific python modules.
+    """
+
+    def __init__(self, sputnik_map):
+        self.routes = [Route(n, pattern, module_name) for n, (pattern, module_name) in enumerate(sputnik_map)]
+
+        # routes which can match any channel have to be tried for every message
+        self.generic = [route for route in self.routes if route.prefix is None]
+        self.index = {}
+
+        for route in self.routes:
+            if route.prefix is not None:
+                self.index.setdefault(route.prefix, list(self.generic)).append(route)
+
+        for routes in self.index.values():
+            routes.sort(key = lambda route: route.position)
+
+        # channel name -> (route, arguments)
+        self.channels = {}
+
+    def resolve(self, channel, command):
+        """
+        Finds function for the message.
+
+        @type channel: C{string}
+        @param channel: Channel name.
+        @type command: C{string}
+        @param command: Command name.
+        @rtype: C{tuple}
+        @return: Returns C{(function, arguments)} for the first route which matches the channel. Function is None
+                 if there is no route for the channel or route module has no such command.
+        """
+
+        try:
+            route, args = self.channels[channel]
+        except KeyError:
+            route, args = self.match(channel)
+
+            if len(self.channels) >= CHANNEL_CACHE_SIZE:
+                self.channels.clear()
+
+            self.channels[channel] = (route, args)
+
+        if route is None:
+            return None, {}
+
+        return route.handler(command), dict(args)
+
+    def match(self, channel):
+        for route in self.index.get(channel_prefix(channel), self.generic):
+            mtch = route.regex.match(channel)
+
+            if mtch:
+                return route, mtch.groupdict()
+
+        return None, {}
+
+
+def get_route_table(sputnik_map):
+    """
+    Returns compiled L{RouteTable} for the map. Tables are compiled once per process.
+    """
+
+    key = tuple(tuple(route) for route in sputnik_map)
+
+    try:
+        return _tables[key]
+    except KeyError:
+        table = _tables[key] = RouteTable(key)
+        return table
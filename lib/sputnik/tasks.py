@@ -0,0 +1,30 @@
+# This file is part of Booktype.
+# Copyright (c) 2012 Aleksandar Erkalovic <aleksandar.erkalovic@sourcefabric.org>
+#
+# Booktype is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Booktype is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Booktype.  If not, see <http://www.gnu.org/licenses/>.
+
+from datetime import timedelta
+from celery.task import periodic_task
+
+import sputnik
+from sputnik import maintenance as sputnik_maintenance
+
+
+@periodic_task(run_every=timedelta(seconds=sputnik.MAINTENANCE_INTERVAL), ignore_result=True)
+def maintenance():
+    """
+    Runs all Sputnik maintenance jobs (see L{sputnik.maintenance}).
+    """
+
+    return sputnik_maintenance.run_jobs()
@@ -0,0 +1,60 @@
+from django.test import TestCase
+import sputnik
+
+class BatchTest(TestCase):
+    KEY = 'sputnik:test:batch'
+
+    def setUp(self):
+        sputnik.rdelete(self.KEY)
+        sputnik.reset_stats()
+
+    def tearDown(self):
+        sputnik.rdelete(self.KEY)
+
+    def test_commands_are_queued(self):
+        with sputnik.batch() as b:
+            self.assertEqual(sputnik.push(self.KEY, 'a'), None)
+            self.assertEqual(sputnik.push(self.KEY, 'b'), None)
+
+            # nothing was sent to redis yet
+            self.assertEqual(sputnik.rcon.llen(self.KEY), 0)
+
+        self.assertEqual(b.results, [1, 2])
+        self.assertEqual(sputnik.rcon.lrange(self.KEY, 0, -1), ['a', 'b'])
+
+    def test_nested_batch(self):
+        with sputnik.batch() as outer:
+            with sputnik.batch() as inner:
+                sputnik.push(self.KEY, 'a')
+
+            sputnik.push(self.KEY, 'b')
+
+        self.assertEqual(inner.results, None)
+        self.assertEqual(outer.results, [1, 2])
+
+    def test_batch_discarded_on_error(self):
+        try:
+            with sputnik.batch():
+                sputnik.push(self.KEY, 'a')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(sputnik.rcon.llen(self.KEY), 0)
+
+    def test_stats(self):
+        sputnik.push(self.KEY, 'a')
+        sputnik.rpop(self.KEY)
+
+        with sputnik.batch():
+            sputnik.push(self.KEY, 'a')
+            sputnik.push(self.KEY, 'b')
+
+        stats = sputnik.get_stats()
+
+        self.assertEqual(stats['rpush']['calls'], 1)
+        self.assertEqual(stats['rpop']['calls'], 1)
+        self.assertEqual(stats['pipeline']['calls'], 1)
+
+        sputnik.reset_stats()
+        self.assertEqual(sputnik.get_stats(), {})
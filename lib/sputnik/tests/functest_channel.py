@@ -0,0 +1,218 @@
+import json
+
+from django.test import TestCase
+import sputnik
+
+class ChannelTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+    OTHER_CHANNEL = '/sputnik-other/'
+    CLIENTS = ['test:1', 'test:2', 'test:3']
+
+    def setUp(self):
+        self._cleanup()
+
+        for client in self.CLIENTS:
+            sputnik.addClientToChannel(self.CHANNEL, client)
+
+    def tearDown(self):
+        self._cleanup()
+
+    def _cleanup(self):
+        for client in self.CLIENTS:
+            sputnik.rdelete("ses:%s:messages" % client)
+            sputnik.rdelete("ses:%s:channels" % client)
+            sputnik.rdelete("ses:%s:pending" % client)
+
+        for channel in (self.CHANNEL, self.OTHER_CHANNEL):
+            sputnik.rdelete("sputnik:channel:%s:channel" % channel)
+
+    def _messages(self, client):
+        return [json.loads(m) for m in sputnik.rcon.lrange("ses:%s:messages" % client, 0, -1)]
+
+    def test_fanout(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'})
+
+        self.assertEqual(self._messages('test:1'), [])
+
+        for client in self.CLIENTS[1:]:
+            self.assertEqual(self._messages(client),
+                             [{'command': 'ping', 'channel': self.CHANNEL, 'clientID': '1'}])
+
+    def test_fanout_myself(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'}, myself=True)
+
+        for client in self.CLIENTS:
+            self.assertEqual(len(self._messages(client)), 1)
+
+    def test_coalesce(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': 1}, coalesce='status')
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'})
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': 2}, coalesce='status')
+
+        self.assertEqual([(m['command'], m.get('n')) for m in self._messages('test:2')],
+                         [('ping', None), ('status', 2)])
+
+    def test_coalesce_delivered(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': 1}, coalesce='status')
+        sputnik.popMessages(['test:2'])
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': 2}, coalesce='status')
+
+        self.assertEqual([m['n'] for m in self._messages('test:2')], [2])
+
+    def test_coalesce_channels(self):
+        sputnik.addClientToChannel(self.OTHER_CHANNEL, 'test:2')
+
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': 1}, coalesce='status')
+        sputnik.addMessageToChannel2('1', 'test:1', self.OTHER_CHANNEL, {'command': 'status', 'n': 2}, coalesce='status')
+
+        self.assertEqual(sorted((m['channel'], m['n']) for m in self._messages('test:2')),
+                         [(self.OTHER_CHANNEL, 2), (self.CHANNEL, 1)])
+
+    def test_pop_messages(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'})
+
+        messages = sputnik.popMessages(self.CLIENTS)
+
+        self.assertEqual([len(m) for m in messages], [0, 1, 1])
+        self.assertEqual(json.loads(messages[1][0])['command'], 'ping')
+        self.assertEqual(sputnik.popMessages(self.CLIENTS), [[], [], []])
+
+    def test_fanout_count(self):
+        self.assertEqual(sputnik.fanout(self.CHANNEL, '{}', 'test:2'), 2)
+        self.assertEqual(sputnik.fanout('/sputnik-empty/', '{}'), 0)
+
+
+class LogChannelTest(ChannelTest):
+    def setUp(self):
+        self._delivery = sputnik.DELIVERY
+        sputnik.DELIVERY = 'log'
+
+        super(LogChannelTest, self).setUp()
+
+    def tearDown(self):
+        super(LogChannelTest, self).tearDown()
+
+        sputnik.DELIVERY = self._delivery
+
+    def _cleanup(self):
+        super(LogChannelTest, self)._cleanup()
+
+        for client in self.CLIENTS:
+            sputnik.rdelete("ses:%s:cursors" % client)
+
+        for channel in (self.CHANNEL, self.OTHER_CHANNEL):
+            for kind in ('log', 'pending', 'coalesced', 'sequence'):
+                sputnik.rdelete("sputnik:channel:%s:%s" % (channel, kind))
+
+    def _messages(self, client):
+        return [json.loads(m) for m in sputnik.readChannelLogs(client)]
+
+    def test_fanout_count(self):
+        # there are no per client copies of the message
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'})
+
+        self.assertEqual(sputnik.rcon.zcard("sputnik:channel:%s:log" % self.CHANNEL), 1)
+        self.assertEqual(sputnik.rcon.llen("ses:test:2:messages"), 0)
+
+    def test_cursor(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'first'})
+
+        self.assertEqual([m['command'] for m in self._messages('test:2')], ['first'])
+        self.assertEqual(self._messages('test:2'), [])
+
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'second'})
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'third'})
+
+        self.assertEqual([m['command'] for m in self._messages('test:2')], ['second', 'third'])
+        self.assertEqual([m['command'] for m in self._messages('test:3')], ['first', 'second', 'third'])
+
+    def test_new_client_skips_history(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'old'})
+
+        sputnik.addClientToChannel(self.CHANNEL, 'test:4')
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'new'})
+
+        try:
+            self.assertEqual([m['command'] for m in self._messages('test:4')], ['new'])
+        finally:
+            sputnik.removeClient(None, 'test:4')
+
+    def test_log_size(self):
+        size = sputnik.CHANNEL_LOG_SIZE
+        sputnik.CHANNEL_LOG_SIZE = 5
+
+        try:
+            for n in range(10):
+                sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping', 'n': n})
+        finally:
+            sputnik.CHANNEL_LOG_SIZE = size
+
+        self.assertEqual([m['n'] for m in self._messages('test:2')], [5, 6, 7, 8, 9])
+
+    def test_log_size_coalesced(self):
+        size = sputnik.CHANNEL_LOG_SIZE
+        sputnik.CHANNEL_LOG_SIZE = 5
+
+        try:
+            for n in range(10):
+                sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'status', 'n': n},
+                                             coalesce='status:%d' % (n % 7))
+        finally:
+            sputnik.CHANNEL_LOG_SIZE = size
+
+        # pending entries are removed together with the log entries
+        self.assertEqual(sorted(sputnik.rcon.hkeys("sputnik:channel:%s:pending" % self.CHANNEL)),
+                         ['status:%d' % n for n in (0, 1, 2, 5, 6)])
+        self.assertEqual(sputnik.rcon.hlen("sputnik:channel:%s:coalesced" % self.CHANNEL), 5)
+        self.assertEqual([m['n'] for m in self._messages('test:2')], [5, 6, 7, 8, 9])
+
+
+class PubSubChannelTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+    CLIENTS = ['test:1', 'test:2', 'test:3']
+
+    def setUp(self):
+        self._pubsub = sputnik.PUBSUB
+        sputnik.PUBSUB = True
+
+        for client in self.CLIENTS:
+            sputnik.addClientToChannel(self.CHANNEL, client)
+
+        sputnik.sadd("sputnik:pubsub_clients", 'test:2')
+
+        self.pubsub = sputnik.rcon.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe("sputnik:topic:%s" % self.CHANNEL)
+
+    def tearDown(self):
+        sputnik.PUBSUB = self._pubsub
+        self.pubsub.close()
+
+        for client in self.CLIENTS:
+            sputnik.removeClient(None, client)
+
+        sputnik.rdelete("sputnik:channel:%s:channel" % self.CHANNEL)
+
+    def test_publish(self):
+        sputnik.addMessageToChannel2('1', 'test:1', self.CHANNEL, {'command': 'ping'})
+
+        item = None
+
+        for n in range(10):
+            item = self.pubsub.get_message(timeout=0.1)
+
+            if item:
+                break
+
+        exclude, data = item['data'].split('|', 1)
+
+        self.assertEqual(exclude, 'test:1')
+        self.assertEqual(json.loads(data)['command'], 'ping')
+
+        # pub/sub clients do not get message in their queue
+        self.assertEqual(sputnik.rcon.llen("ses:test:2:messages"), 0)
+        self.assertEqual(sputnik.rcon.llen("ses:test:3:messages"), 1)
+
+    def test_remove_client(self):
+        sputnik.removeClient(None, 'test:2')
+
+        self.assertFalse(sputnik.sismember("sputnik:pubsub_clients", 'test:2'))
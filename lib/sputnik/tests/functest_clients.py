@@ -0,0 +1,190 @@
+import json
+import time
+from StringIO import StringIO
+
+from django.test import TestCase
+import sputnik
+
+class TimeoutClientsTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+
+    def setUp(self):
+        sputnik.rdelete("sputnik:last_access")
+
+        for client in ['test:old', 'test:new']:
+            sputnik.addClientToChannel(self.CHANNEL, client)
+
+        sputnik.setLastAccess('test:old', time.time() - sputnik.CLIENT_TIMEOUT - 10)
+        sputnik.setLastAccess('test:new')
+
+    def tearDown(self):
+        sputnik.removeClient(None, 'test:old')
+        sputnik.removeClient(None, 'test:new')
+        sputnik.rdelete("sputnik:channel:%s:channel" % self.CHANNEL)
+
+    def test_get_timeout_clients(self):
+        self.assertEqual(sputnik.getTimeoutClients(), ['test:old'])
+
+    def test_remove_timeout_clients(self):
+        self.assertEqual(sputnik.removeTimeoutClients(), 1)
+        self.assertEqual(sputnik.removeTimeoutClients(), 0)
+
+        self.assertEqual(sputnik.smembers("sputnik:channel:%s:channel" % self.CHANNEL), ['test:new'])
+        self.assertEqual(sputnik.smembers("ses:test:old:channels"), [])
+        self.assertEqual(sputnik.rcon.zrange("sputnik:last_access", 0, -1), ['test:new'])
+
+    def test_remove_timeout_clients_limit(self):
+        sputnik.setLastAccess('test:new', time.time() - sputnik.CLIENT_TIMEOUT - 5)
+
+        self.assertEqual(sputnik.removeTimeoutClients(limit=1), 1)
+        self.assertEqual(sputnik.getTimeoutClients(), ['test:new'])
+
+
+class QueueTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+
+    def setUp(self):
+        for client in ['test:1', 'test:2']:
+            sputnik.addClientToChannel(self.CHANNEL, client)
+            sputnik.setLastAccess(client)
+
+        self._queue_size = sputnik.QUEUE_SIZE
+
+    def tearDown(self):
+        sputnik.QUEUE_SIZE = self._queue_size
+
+        for client in ['test:1', 'test:2', 'test:gone']:
+            sputnik.removeClient(None, client)
+
+        sputnik.rdelete("sputnik:channel:%s:channel" % self.CHANNEL)
+
+    def test_queue_size(self):
+        sputnik.QUEUE_SIZE = 3
+
+        for n in range(5):
+            sputnik.fanout(self.CHANNEL, str(n), 'test:1')
+
+        self.assertEqual(sputnik.rcon.lrange("ses:test:2:messages", 0, -1), ['2', '3', '4'])
+
+    def test_queue_ttl(self):
+        sputnik.fanout(self.CHANNEL, '{}', 'test:1')
+
+        self.assertTrue(0 < sputnik.rcon.ttl("ses:test:2:messages") <= sputnik.QUEUE_TTL)
+
+    def test_remove_client(self):
+        sputnik.fanout(self.CHANNEL, '{}', 'test:1')
+        sputnik.removeClient(None, 'test:2')
+
+        self.assertFalse(sputnik.rcon.exists("ses:test:2:messages"))
+
+    def test_cleanup_command(self):
+        from django.core.management import call_command
+
+        sputnik.addClientToChannel(self.CHANNEL, 'test:gone')
+        sputnik.fanout(self.CHANNEL, '{}', 'test:1')
+
+        call_command('sputnik_cleanup', delete=True, stdout=StringIO())
+
+        self.assertFalse(sputnik.rcon.exists("ses:test:gone:messages"))
+        self.assertFalse(sputnik.rcon.exists("ses:test:gone:channels"))
+        self.assertEqual(sorted(sputnik.smembers("sputnik:channel:%s:channel" % self.CHANNEL)), ['test:1', 'test:2'])
+        self.assertTrue(sputnik.rcon.exists("ses:test:2:messages"))
+
+    def test_cleanup_stale_membership(self):
+        from django.core.management import call_command
+
+        sputnik.set("ses:test:gone:username", 'carol')
+        sputnik.addClientToChannel(self.CHANNEL, 'test:gone')
+        sputnik.sadd("sputnik:channel:%s:users" % self.CHANNEL, 'carol')
+
+        # client lost its channels, it is only a member of the channel
+        sputnik.rdelete("ses:test:gone:channels")
+
+        call_command('sputnik_cleanup', delete=True, stdout=StringIO())
+
+        messages = [json.loads(m) for m in sputnik.rcon.lrange("ses:test:1:messages", 0, -1)]
+
+        self.assertEqual(sorted(sputnik.smembers("sputnik:channel:%s:channel" % self.CHANNEL)), ['test:1', 'test:2'])
+        self.assertIn(('user_remove', 'carol'), [(m['command'], m.get('username')) for m in messages])
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {})
+        self.assertFalse(sputnik.sismember("sputnik:online", "carol|%s" % self.CHANNEL))
+        self.assertFalse(sputnik.rcon.exists("ses:test:gone:username"))
+
+
+class PresenceTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+    CLIENTS = {'test:1': 'alice', 'test:2': 'alice', 'test:3': 'bob'}
+
+    def setUp(self):
+        for client, username in self.CLIENTS.items():
+            sputnik.set("ses:%s:username" % client, username)
+            sputnik.addClientToChannel(self.CHANNEL, client)
+
+        # clients add users to the channel when they open it
+        sputnik.sadd("sputnik:channel:%s:users" % self.CHANNEL, 'alice')
+        sputnik.sadd("sputnik:channel:%s:users" % self.CHANNEL, 'bob')
+
+    def tearDown(self):
+        for client in self.CLIENTS:
+            sputnik.removeClient(None, client)
+
+        for key in ['channel', 'users', 'presence']:
+            sputnik.rdelete("sputnik:channel:%s:%s" % (self.CHANNEL, key))
+
+    def _user_removes(self, client):
+        return [json.loads(m)['username'] for m in sputnik.rcon.lrange("ses:%s:messages" % client, 0, -1)
+                if json.loads(m)['command'] == 'user_remove']
+
+    def test_presence(self):
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {'alice': '2', 'bob': '1'})
+
+    def test_subscribe_twice(self):
+        sputnik.addClientToChannel(self.CHANNEL, 'test:1')
+
+        self.assertEqual(sputnik.rcon.hget("sputnik:channel:%s:presence" % self.CHANNEL, 'alice'), '2')
+
+    def test_remove_client(self):
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:1')
+
+        self.assertEqual(self._user_removes('test:3'), [])
+        self.assertTrue(sputnik.sismember("sputnik:channel:%s:users" % self.CHANNEL, 'alice'))
+
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:2')
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:2')
+
+        self.assertEqual(self._user_removes('test:3'), ['alice'])
+        self.assertEqual(sputnik.smembers("sputnik:channel:%s:users" % self.CHANNEL), ['bob'])
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {'bob': '1'})
+
+    def test_missing_presence(self):
+        # clients which opened the channel before presence was counted
+        sputnik.rdelete("sputnik:channel:%s:presence" % self.CHANNEL)
+
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:1')
+
+        self.assertEqual(self._user_removes('test:3'), [])
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {'alice': '1'})
+
+        sputnik.addClientToChannel(self.CHANNEL, 'test:1')
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:3')
+
+        self.assertEqual(self._user_removes('test:1'), ['bob'])
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {'alice': '2'})
+
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:1')
+        sputnik.removeClientFromChannel(None, self.CHANNEL, 'test:2')
+
+        self.assertEqual(sputnik.smembers("sputnik:channel:%s:users" % self.CHANNEL), [])
+        self.assertEqual(sputnik.rcon.hgetall("sputnik:channel:%s:presence" % self.CHANNEL), {})
+
+    def test_online_users(self):
+        self.assertEqual(sputnik.getOnlineUsers(), {'alice': [self.CHANNEL], 'bob': [self.CHANNEL]})
+
+        sputnik.removeClient(None, 'test:1')
+        sputnik.removeClient(None, 'test:3')
+
+        self.assertEqual(sputnik.getOnlineUsers(), {'alice': [self.CHANNEL]})
+
+        sputnik.removeClient(None, 'test:2')
+
+        self.assertEqual(sputnik.getOnlineUsers(), {})
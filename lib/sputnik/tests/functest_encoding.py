@@ -0,0 +1,61 @@
+import gzip
+import json
+import unittest
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+
+import sputnik
+from sputnik.views import msgpack
+
+class EncodingTest(TestCase):
+    CLIENT_ID = '98'
+
+    def setUp(self):
+        self.dispatcher = reverse('sputnik_dispatcher')
+        User.objects.create_user('booktype', 'booktype@booktype.pro', 'password')
+        self.client.login(username='booktype', password='password')
+
+        self.queue = "ses:%s:%s:messages" % (self.client.session.session_key, self.CLIENT_ID)
+        sputnik.rdelete(self.queue)
+
+    def tearDown(self):
+        sputnik.removeClient(None, "%s:%s" % (self.client.session.session_key, self.CLIENT_ID))
+
+    def _poll(self, **headers):
+        return self.client.post(self.dispatcher, {'clientID': self.CLIENT_ID, 'messages': '[]'}, **headers)
+
+    def test_gzip(self):
+        sputnik.push(self.queue, json.dumps({'command': 'ping', 'content': 'a' * sputnik.COMPRESS_MIN_SIZE}))
+
+        response = self._poll(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+        data = json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read())
+        self.assertEqual(data['messages'][0]['command'], 'ping')
+
+    def test_small_response(self):
+        response = self._poll(HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content)['messages'], [])
+
+    def test_gzip_not_accepted(self):
+        sputnik.push(self.queue, json.dumps({'command': 'ping', 'content': 'a' * sputnik.COMPRESS_MIN_SIZE}))
+
+        response = self._poll()
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(json.loads(response.content)['messages'][0]['command'], 'ping')
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        sputnik.push(self.queue, json.dumps({'command': 'ping'}))
+
+        response = self._poll(HTTP_ACCEPT='application/x-msgpack')
+
+        self.assertEqual(response['Content-Type'], 'application/x-msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['messages'], [{'command': 'ping'}])
@@ -0,0 +1,167 @@
+import json
+import threading
+from datetime import timedelta
+
+from django.utils import unittest
+from django.test.utils import override_settings
+
+import sputnik
+
+try:
+    from tornado import gen, httpclient, websocket
+    from tornado.testing import AsyncHTTPTestCase, gen_test
+    from sputnik.gateway import Gateway
+except ImportError:
+    AsyncHTTPTestCase = unittest.TestCase
+    gen_test = lambda f: f
+    Gateway = None
+
+
+MAP = ((r'^/sputnik-test/$', 'sputnik.tests.functest_gateway'), )
+CHANNEL = '/sputnik-test/'
+
+
+def remote_echo(request, message):
+    return {"text": message["text"], "sputnikID": request.sputnikID}
+
+
+def remote_subscribe(request, message):
+    sputnik.addClientToChannel(CHANNEL, request.sputnikID)
+
+
+def remote_notify(request, message):
+    sputnik.addMessageToChannel(request, CHANNEL, {"command": "notified", "text": message["text"]}, myself=True)
+
+
+@unittest.skipIf(Gateway is None, 'Tornado is not installed')
+class GatewayTest(AsyncHTTPTestCase):
+    SESSION = 'gateway-test'
+
+    def setUp(self):
+        # worker threads can not see in-memory test database
+        self.settings = override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+        self.settings.enable()
+
+        self.gateway = Gateway(MAP, threads=2)
+        self.threads = []
+        self.pubsub = sputnik.PUBSUB
+
+        super(GatewayTest, self).setUp()
+
+    def tearDown(self):
+        self.gateway.stop()
+
+        # listening thread waits for the next message
+        sputnik.rcon.publish('sputnik:topic:%s' % CHANNEL, '|{}')
+
+        for thread in self.threads:
+            thread.join(5)
+
+        for client in ['%s:1' % self.SESSION, '%s:2' % self.SESSION]:
+            sputnik.removeClient(None, client)
+
+        for key in ['channel', 'users', 'presence', 'log', 'sequence', 'pending', 'coalesced']:
+            sputnik.rdelete("sputnik:channel:%s:%s" % (CHANNEL, key))
+
+        sputnik.srem("sputnik:pubsub_clients", '%s:1' % self.SESSION)
+        sputnik.PUBSUB = self.pubsub
+        self.settings.disable()
+
+        super(GatewayTest, self).tearDown()
+
+    def get_app(self):
+        self.gateway.loop = self.io_loop
+
+        return self.gateway.application('/sputnik/')
+
+    def _start(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+        self.threads.append(thread)
+
+    @gen.coroutine
+    def _connect(self):
+        request = httpclient.HTTPRequest(self.get_url('/sputnik/').replace('http://', 'ws://'),
+                                         headers={'Cookie': 'sessionid=%s' % self.SESSION})
+        ws = yield websocket.websocket_connect(request)
+
+        raise gen.Return(ws)
+
+    @gen.coroutine
+    def _read(self, ws):
+        data = yield gen.with_timeout(timedelta(seconds=5), ws.read_message())
+
+        raise gen.Return(json.loads(data))
+
+    @gen.coroutine
+    def _send(self, ws, *messages):
+        ws.write_message(json.dumps({"clientID": "1",
+                                     "messages": [dict(m, channel=CHANNEL, uid=n) for n, m in enumerate(messages)]}))
+
+        frame = yield self._read(ws)
+
+        raise gen.Return(frame)
+
+    @gen_test
+    def test_process(self):
+        ws = yield self._connect()
+        frame = yield self._send(ws, {"command": "echo", "text": "hello"}, {"command": "unknown"})
+
+        self.assertEqual(frame['status'], True)
+        self.assertEqual(frame['messages'][0], {"text": "hello", "sputnikID": "%s:1" % self.SESSION,
+                                                "status": True, "uid": 0})
+        self.assertEqual(frame['messages'][1], {"result": False, "status": False, "uid": 1})
+        self.assertTrue(self.gateway.sockets.get('%s:1' % self.SESSION))
+
+        ws.close()
+
+    @gen_test
+    def test_invalid_frame(self):
+        ws = yield self._connect()
+        ws.write_message('not json')
+        frame = yield self._read(ws)
+
+        self.assertEqual(frame, {"status": False, "result": False, "messages": []})
+
+        ws.close()
+
+    @gen_test
+    def test_deliver(self):
+        self._start(self.gateway.deliver_forever)
+
+        ws = yield self._connect()
+        yield self._send(ws, {"command": "subscribe"})
+        frame = yield self._send(ws, {"command": "notify", "text": "hello"})
+
+        self.assertEqual(frame['messages'], [{"result": True, "status": True, "uid": 0}])
+
+        # message is pushed by the delivery thread
+        frame = yield self._read(ws)
+
+        self.assertEqual([(m['command'], m['text']) for m in frame['messages']], [('notified', 'hello')])
+
+        ws.close()
+
+    @gen_test
+    def test_listen(self):
+        sputnik.PUBSUB = True
+        self._start(self.gateway.listen_forever)
+
+        ws = yield self._connect()
+        yield self._send(ws, {"command": "subscribe"})
+
+        # listening thread has to be subscribed to the topics before message is sent
+        while not sputnik.rcon.execute_command('PUBSUB', 'NUMPAT'):
+            yield gen.sleep(0.01)
+
+        self.assertEqual(self.gateway.channels, {CHANNEL: set(['%s:1' % self.SESSION])})
+
+        # other client sends the message
+        sputnik.addMessageToChannel2('2', '%s:2' % self.SESSION, CHANNEL, {"command": "notified", "text": "hello"})
+        frame = yield self._read(ws)
+
+        self.assertEqual([(m['command'], m['text']) for m in frame['messages']], [('notified', 'hello')])
+
+        ws.close()
@@ -0,0 +1,90 @@
+import json
+import time
+import threading
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+
+import sputnik
+
+class LongPollTest(TestCase):
+    CLIENT_ID = '99'
+
+    def setUp(self):
+        self.dispatcher = reverse('sputnik_dispatcher')
+        User.objects.create_user('booktype', 'booktype@booktype.pro', 'password')
+        self.client.login(username='booktype', password='password')
+
+        self.queue = "ses:%s:%s:messages" % (self.client.session.session_key, self.CLIENT_ID)
+        sputnik.rdelete(self.queue)
+
+        self._timeout = sputnik.LONGPOLL_TIMEOUT
+        sputnik.LONGPOLL_TIMEOUT = 2
+
+    def tearDown(self):
+        sputnik.LONGPOLL_TIMEOUT = self._timeout
+        sputnik.rdelete(self.queue)
+        sputnik.removeClient(None, "%s:%s" % (self.client.session.session_key, self.CLIENT_ID))
+
+    def _poll(self, longpoll):
+        start = time.time()
+        response = self.client.post(self.dispatcher, {'clientID': self.CLIENT_ID,
+                                                      'messages': '[]',
+                                                      'longpoll': longpoll})
+
+        return json.loads(response.content)['messages'], time.time() - start
+
+    def test_message_waiting(self):
+        sputnik.push(self.queue, json.dumps({'command': 'ping'}))
+
+        messages, elapsed = self._poll(2)
+
+        self.assertEqual(messages, [{'command': 'ping'}])
+        self.assertTrue(elapsed < 1)
+
+    def test_messages_in_order(self):
+        for n in range(5):
+            sputnik.push(self.queue, json.dumps({'command': 'ping', 'n': n}))
+
+        _batch_size = sputnik.POLL_BATCH_SIZE
+        sputnik.POLL_BATCH_SIZE = 3
+
+        try:
+            first, elapsed = self._poll(0)
+            second, elapsed = self._poll(0)
+        finally:
+            sputnik.POLL_BATCH_SIZE = _batch_size
+
+        self.assertEqual([m['n'] for m in first], [0, 1, 2])
+        self.assertEqual([m['n'] for m in second], [3, 4])
+
+    def test_message_arrives(self):
+        timer = threading.Timer(0.3, lambda: sputnik.push(self.queue, json.dumps({'command': 'ping'})))
+        timer.start()
+
+        messages, elapsed = self._poll(2)
+        timer.join()
+
+        self.assertEqual(messages, [{'command': 'ping'}])
+        self.assertTrue(elapsed < 1.5)
+
+    def test_timeout(self):
+        messages, elapsed = self._poll(1)
+
+        self.assertEqual(messages, [])
+        self.assertTrue(elapsed >= 1)
+
+    def test_short_poll(self):
+        messages, elapsed = self._poll(0)
+
+        self.assertEqual(messages, [])
+        self.assertTrue(elapsed < 1)
+
+    def test_disabled(self):
+        sputnik.LONGPOLL_TIMEOUT = 0
+
+        messages, elapsed = self._poll(2)
+
+        self.assertEqual(messages, [])
+        self.assertTrue(elapsed < 1)
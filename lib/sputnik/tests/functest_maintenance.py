@@ -0,0 +1,79 @@
+import time
+
+from django.test import TestCase
+
+import sputnik
+from sputnik import maintenance
+
+
+def failing_job(limit):
+    raise ValueError()
+
+
+class MaintenanceTest(TestCase):
+    CHANNEL = '/sputnik-test/'
+    EMPTY_CHANNEL = '/sputnik-test-empty/'
+
+    def setUp(self):
+        self._jobs = sputnik.MAINTENANCE_JOBS
+
+        sputnik.rdelete("sputnik:maintenance")
+        sputnik.rdelete("sputnik:maintenance:channels_cursor")
+
+        sputnik.createChannel(self.CHANNEL)
+        sputnik.createChannel(self.EMPTY_CHANNEL)
+        sputnik.sadd("sputnik:channel:%s:users" % self.EMPTY_CHANNEL, 'alice')
+        sputnik.execute('zadd', "sputnik:channel:%s:log" % self.EMPTY_CHANNEL, '1||{}', 1)
+        sputnik.execute('set', "sputnik:channel:%s:sequence" % self.EMPTY_CHANNEL, 1)
+
+        sputnik.addClientToChannel(self.CHANNEL, 'test:old')
+        sputnik.addClientToChannel(self.CHANNEL, 'test:new')
+        sputnik.setLastAccess('test:old', time.time() - sputnik.CLIENT_TIMEOUT - 10)
+        sputnik.setLastAccess('test:new')
+
+    def tearDown(self):
+        sputnik.MAINTENANCE_JOBS = self._jobs
+
+        for client in ['test:old', 'test:new']:
+            sputnik.removeClient(None, client)
+
+        for channel in [self.CHANNEL, self.EMPTY_CHANNEL]:
+            sputnik.removeChannel(channel)
+            sputnik.rdelete("sputnik:channel:%s:channel" % channel)
+            for kind in maintenance.CHANNEL_KEYS:
+                sputnik.rdelete("sputnik:channel:%s:%s" % (channel, kind))
+
+        sputnik.rdelete("sputnik:maintenance")
+        sputnik.rdelete("sputnik:maintenance:channels_cursor")
+
+    def test_run_jobs(self):
+        sputnik.MAINTENANCE_JOBS = ('sputnik.maintenance.remove_timeout_clients',
+                                    'sputnik.maintenance.remove_empty_channels')
+
+        handled = maintenance.run_jobs(limit=1000)
+
+        self.assertEqual(handled['remove_timeout_clients'], 1)
+        self.assertTrue(handled['remove_empty_channels'] >= 1)
+
+        self.assertEqual(sputnik.getTimeoutClients(), [])
+        self.assertTrue(sputnik.hasChannel(self.CHANNEL))
+        self.assertFalse(sputnik.hasChannel(self.EMPTY_CHANNEL))
+        self.assertEqual(sputnik.smembers("sputnik:channel:%s:users" % self.EMPTY_CHANNEL), [])
+        self.assertEqual(sputnik.rcon.keys("sputnik:channel:%s:*" % self.EMPTY_CHANNEL), [])
+
+        stats = maintenance.get_stats()['remove_timeout_clients']
+
+        self.assertEqual(stats['runs'], 1)
+        self.assertEqual(stats['items'], 1)
+        self.assertEqual(stats['last_items'], 1)
+        self.assertEqual(stats['errors'], 0)
+
+    def test_failing_job(self):
+        sputnik.MAINTENANCE_JOBS = ('sputnik.tests.functest_maintenance.failing_job',
+                                    'sputnik.tests.functest_maintenance.missing_job',
+                                    'sputnik.maintenance.remove_timeout_clients')
+
+        handled = maintenance.run_jobs()
+
+        self.assertEqual(handled, {'failing_job': None, 'remove_timeout_clients': 1})
+        self.assertEqual(maintenance.get_stats()['failing_job']['errors'], 1)
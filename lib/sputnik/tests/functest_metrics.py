@@ -0,0 +1,57 @@
+from django.test import TransactionTestCase
+from django.db import transaction
+from django.http import HttpRequest
+from django.contrib.auth.models import User
+
+import sputnik
+from sputnik import metrics
+from sputnik.views import process_messages
+
+
+MAP = ((r'^/sputnik-test/$', 'sputnik.tests.functest_metrics'), )
+
+
+def remote_work(request, message):
+    User.objects.filter(username='nobody').count()
+    sputnik.get('sputnik:metrics-test')
+
+    if message.get('fail'):
+        raise ValueError()
+
+
+class MetricsTest(TransactionTestCase):
+    def setUp(self):
+        self._metrics = sputnik.METRICS
+        self.key = "sputnik:metrics:%d" % metrics.window_start()
+        sputnik.rdelete(self.key)
+
+    def tearDown(self):
+        sputnik.METRICS = self._metrics
+        sputnik.rdelete(self.key)
+
+    def _process(self, *messages):
+        with transaction.commit_manually():
+            try:
+                process_messages(HttpRequest(), [dict(m, channel='/sputnik-test/', command='work') for m in messages],
+                                 MAP)
+            finally:
+                transaction.rollback()
+
+    def test_record(self):
+        sputnik.METRICS = True
+        self._process({}, {}, {'fail': True})
+
+        work = metrics.get_metrics(1)['commands']['work']
+
+        self.assertEqual(work['count'], 3)
+        self.assertEqual(work['errors'], 1)
+        self.assertEqual(work['queries'], 1)
+        self.assertEqual(work['redis'], 1)
+        self.assertEqual(sum(count for bound, count in work['histogram']), 3)
+        self.assertTrue(work['p50'] <= work['p95'] <= work['p99'])
+
+    def test_disabled(self):
+        sputnik.METRICS = False
+        self._process({})
+
+        self.assertEqual(metrics.get_metrics(1)['commands'], {})
@@ -0,0 +1,118 @@
+import mock
+
+from django.test import TransactionTestCase
+from django.db import transaction, connection, connections, DatabaseError, DEFAULT_DB_ALIAS
+from django.http import HttpRequest
+from django.contrib.auth.models import User
+
+import sputnik
+from sputnik.views import process_messages
+
+
+MAP = ((r'^/sputnik-test/$', 'sputnik.tests.functest_transactions'), )
+
+# usernames of messages whose after commit functions were called
+COMMITTED = []
+
+
+def remote_create_user(request, message):
+    User.objects.create_user(message['username'], '%s@booktype.pro' % message['username'], 'password')
+    sputnik.after_commit(COMMITTED.append, message['username'])
+
+    if message.get('fail'):
+        raise ValueError()
+
+
+def remote_commit_user(request, message):
+    remote_create_user(request, message)
+    transaction.commit()
+
+
+class TransactionModeTest(TransactionTestCase):
+    def setUp(self):
+        self._mode = sputnik.TRANSACTION_MODE
+        del COMMITTED[:]
+
+    def tearDown(self):
+        sputnik.TRANSACTION_MODE = self._mode
+
+    def _messages(self, second='create_user'):
+        return [{"channel": "/sputnik-test/", "command": "create_user", "uid": 1, "username": "first"},
+                {"channel": "/sputnik-test/", "command": second, "uid": 2, "username": "second"},
+                {"channel": "/sputnik-test/", "command": "create_user", "uid": 3, "username": "third"}]
+
+    def _run(self, messages):
+        with transaction.commit_manually():
+            try:
+                return process_messages(HttpRequest(), messages, MAP)
+            finally:
+                transaction.rollback()
+
+    def _process(self):
+        messages = self._messages()
+        messages[1]['fail'] = True
+        results = self._run(messages)
+
+        self.assertEqual([r['status'] for r in results], [True, False, True])
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['first', 'third'])
+        self.assertEqual(COMMITTED, ['first', 'third'])
+
+    def _savepoints(self, **kwargs):
+        # SQLite backend does not use savepoints, only SQL statements are left out
+        methods = dict(_savepoint=mock.DEFAULT, _savepoint_rollback=mock.DEFAULT, _savepoint_commit=mock.DEFAULT)
+        methods.update(kwargs)
+
+        return mock.patch.multiple(connections[DEFAULT_DB_ALIAS], **methods)
+
+    def test_message_mode(self):
+        sputnik.TRANSACTION_MODE = 'message'
+        self._process()
+
+    def test_batch_mode(self):
+        sputnik.TRANSACTION_MODE = 'batch'
+        self._process()
+
+    def test_savepoints(self):
+        sputnik.TRANSACTION_MODE = 'batch'
+        messages = self._messages()
+        messages[1]['fail'] = True
+
+        with mock.patch.object(connection.features, 'uses_savepoints', True):
+            with self._savepoints() as savepoints:
+                results = self._run(messages)
+
+        self.assertEqual([r['status'] for r in results], [True, False, True])
+        self.assertEqual(savepoints['_savepoint'].call_count, 3)
+        self.assertEqual(savepoints['_savepoint_rollback'].call_count, 1)
+        self.assertEqual(savepoints['_savepoint_commit'].call_count, 2)
+
+        # functions registered by failed message are not called
+        self.assertEqual(COMMITTED, ['first', 'third'])
+
+    def test_savepoint_error(self):
+        sputnik.TRANSACTION_MODE = 'batch'
+
+        with mock.patch.object(connection.features, 'uses_savepoints', True):
+            with self._savepoints(_savepoint_commit=mock.Mock(side_effect=[None, DatabaseError(), None])):
+                results = self._run(self._messages())
+
+        # whole transaction is rolled back
+        self.assertEqual([r['status'] for r in results], [False, False, True])
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['third'])
+        self.assertEqual(COMMITTED, ['third'])
+
+    def test_function_commits(self):
+        sputnik.TRANSACTION_MODE = 'batch'
+        messages = self._messages(second='commit_user')
+        messages[2]['fail'] = True
+
+        with mock.patch.object(connection.features, 'uses_savepoints', True):
+            with self._savepoints() as savepoints:
+                results = self._run(messages)
+
+        # rest of the batch is committed message by message
+        self.assertEqual([r['status'] for r in results], [True, True, False])
+        self.assertEqual(savepoints['_savepoint'].call_count, 2)
+        self.assertEqual(savepoints['_savepoint_commit'].call_count, 1)
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['first', 'second'])
+        self.assertEqual(COMMITTED, ['first', 'second'])
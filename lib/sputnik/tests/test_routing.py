@@ -0,0 +1,72 @@
+import unittest
+
+from sputnik.routing import RouteTable, get_route_table, has_alternation
+
+
+def remote_ping(request, message, **kwargs):
+    return {"pong": kwargs}
+
+remote_not_callable = 'ping'
+
+
+MAP = (
+    (r'^/booki/$', 'sputnik.tests.test_routing'),
+    (r'^/booki/book/(?P<bookid>\d+)/$', 'sputnik.tests.test_routing'),
+    (r'^/missing/$', 'sputnik.tests.does_not_exist'),
+    (r'.*/any/$', 'sputnik.tests.test_routing'),
+)
+
+
+class RouteTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = RouteTable(MAP)
+
+    def test_index(self):
+        self.assertEqual([r.position for r in self.table.index['/booki/']], [0, 1, 3])
+        self.assertEqual([r.position for r in self.table.generic], [3])
+
+    def test_resolve(self):
+        fnc, args = self.table.resolve('/booki/', 'ping')
+
+        self.assertEqual(fnc, remote_ping)
+        self.assertEqual(args, {})
+
+    def test_resolve_arguments(self):
+        fnc, args = self.table.resolve('/booki/book/12/', 'ping')
+
+        self.assertEqual(fnc, remote_ping)
+        self.assertEqual(args, {'bookid': '12'})
+
+        # cached channel
+        self.assertEqual(self.table.resolve('/booki/book/12/', 'ping')[1], {'bookid': '12'})
+
+    def test_generic_route(self):
+        self.assertEqual(self.table.resolve('/chat/any/', 'ping')[0], remote_ping)
+
+    def test_alternation(self):
+        table = RouteTable(((r'^/booki/$|^/chat/$', 'sputnik.tests.test_routing'),
+                            (r'^/book(i|s)/list/$', 'sputnik.tests.test_routing'),
+                            (r'^/optional/?$', 'sputnik.tests.test_routing')))
+
+        self.assertEqual([r.prefix for r in table.routes], [None, None, None])
+        self.assertEqual(table.resolve('/chat/', 'ping')[0], remote_ping)
+        self.assertEqual(table.resolve('/booki/', 'ping')[0], remote_ping)
+        self.assertEqual(table.resolve('/books/list/', 'ping')[0], remote_ping)
+        self.assertEqual(table.resolve('/optional', 'ping')[0], remote_ping)
+
+    def test_has_alternation(self):
+        self.assertTrue(has_alternation(r'^/booki/|^/chat/'))
+        self.assertFalse(has_alternation(r'^/booki/(a|b)/$'))
+        self.assertFalse(has_alternation(r'^/booki/[|]/$'))
+        self.assertFalse(has_alternation(r'^/booki/\|/$'))
+        self.assertFalse(has_alternation(r'^/booki/[]|]/$'))
+
+    def test_unknown(self):
+        self.assertEqual(self.table.resolve('/booki/', 'unknown'), (None, {}))
+        self.assertEqual(self.table.resolve('/booki/', 'not_callable'), (None, {}))
+        self.assertEqual(self.table.resolve('/nothing/', 'ping'), (None, {}))
+        self.assertEqual(self.table.resolve('', 'ping'), (None, {}))
+        self.assertEqual(self.table.resolve('/missing/', 'ping'), (None, {}))
+
+    def test_table_is_cached(self):
+        self.assertTrue(get_route_table(MAP) is get_route_table(list(MAP)))
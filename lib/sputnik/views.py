@@ -18,78 +18,274 @@ import re
 import logging
 import json
 import time
-import decimal
-import importlib
 
-from django.db import transaction
+from django.db import transaction, connection, DatabaseError
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.core.exceptions import ObjectDoesNotExist, SuspiciousOperation, PermissionDenied
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 import redis
 import sputnik
+from sputnik.routing import get_route_table
+from sputnik.metrics import Collector
 
 
 logger = logging.getLogger("booktype.sputnik")
 
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
 
 def set_last_access(request):
     try:
-        if request.sputnikID and request.sputnikID.find(' ') == -1:
-            sputnik.set("ses:%s:last_access" % request.sputnikID, time.time())
+        sputnik.setLastAccess(request.sputnikID)
     except:
         logger.error("Sputnik - CAN NOT SET TIMESTAMP.")
 
 
-def remove_timeout_clients(request):
-    _now = time.time() 
+def log_redis_stats(request):
+    stats = sputnik.get_stats()
+
+    logger.debug("Sputnik - %s Redis round trips in %.2fms for client %s" % (
+        sum(s['calls'] for s in stats.values()),
+        sum(s['time'] for s in stats.values()) * 1000,
+        getattr(request, 'sputnikID', None)))
+
+
+def collect_messages(request, clientID, timeout = 0):
+    """
+    Collects messages waiting for the client. If there are no messages and timeout is set,
+    waits up to timeout seconds for the first message to arrive (long polling).
+    """
+
+    if sputnik.DELIVERY == 'log':
+        return collect_log_messages(request, clientID, timeout)
+
+    results = []
+
+    if not clientID or clientID.find(' ') != -1:
+        return results
+
+    key = "ses:%s:%s:messages" % (request.session.session_key, clientID)
 
     try:
-        for k in sputnik.rkeys("ses:*:last_access"):
-            tm = sputnik.get(k)
-
-            if type(tm) in [type(' '), type(u' ')]:
-                try:
-                    tm = decimal.Decimal(tm)
-                except:
-                    continue
-
-        # timeout after 2 minute
-            if  tm and decimal.Decimal("%f" % _now) - tm > 60*2:
-                sputnik.removeClient(request, k[4:-12])
+        messages = sputnik.poprange(key)
     except:
-        logger.debug("Sputnik - can not get all the last accesses")
+        logger.error("Sputnik - Could not get messages from the queue session: %s clientID:%s" % (request.session.session_key, clientID))
+        messages = []
+
+    if not messages and timeout > 0:
+        try:
+            v = sputnik.bpop(key, timeout)
+
+            if v:
+                # other messages might have arrived together with the first one
+                messages = [v] + sputnik.poprange(key, sputnik.POLL_BATCH_SIZE - 1)
+        except:
+            logger.error("Sputnik - Could not wait for messages session: %s clientID:%s" % (request.session.session_key, clientID))
+
+    for v in messages:
+        try:
+            results.append(json.loads(v))
+        except:
+            pass
+
+    return results
 
 
-def collect_messages(request, clientID):
+def collect_log_messages(request, clientID, timeout = 0):
     results = []
-    n = 0
 
-    while True:
-        v = None
+    if not clientID or clientID.find(' ') != -1:
+        return results
+
+    deadline = time.time() + timeout
 
+    while True:
         try:
-            if clientID and clientID.find(' ') == -1:
-                v = sputnik.rpop("ses:%s:%s:messages" % (request.session.session_key, clientID))
+            messages = sputnik.readChannelLogs("%s:%s" % (request.session.session_key, clientID))
         except:
-            # Limit only to 20 messages
-            if n > 20:
-                break            
+            logger.error("Sputnik - Could not read channel logs session: %s clientID:%s" % (request.session.session_key, clientID))
+            return results
 
-            logger.error("Sputnik - Coult not get the latest message from the queue session: %s clientID:%s" %(request.session.session_key, clientID))
+        # there is no blocking read for channel logs, check them again after a short sleep
+        if messages or time.time() + sputnik.LONGPOLL_INTERVAL > deadline:
+            break
 
-        n += 1
-
-        if not v: break
+        time.sleep(sputnik.LONGPOLL_INTERVAL)
 
+    for v in messages:
         try:
             results.append(json.loads(v))
         except:
             pass
-    
+
     return results
 
 
 
+def encode_response(request, data):
+    """
+    Encodes Sputnik response. Response is encoded with MessagePack if client accepts it and msgpack
+    is installed, otherwise it is JSON. Responses bigger then SPUTNIK_COMPRESS_MIN_SIZE are
+    compressed with gzip if client accepts it.
+
+    @type request: C{django.http.HttpRequest}
+    @param request: Client Request object
+    @type data: C{dict}
+    @param data: Response data.
+    @rtype: C{HttpResponse}
+    @return: Return C{django.http.HttpResponse} object.
+    """
+
+    if msgpack and MSGPACK_MIMETYPE in request.META.get('HTTP_ACCEPT', ''):
+        content, mimetype = msgpack.packb(data), MSGPACK_MIMETYPE
+    else:
+        content, mimetype = json.dumps(data), "text/json"
+
+    resp = HttpResponse(content, mimetype=mimetype)
+    patch_vary_headers(resp, ('Accept', 'Accept-Encoding'))
+
+    if sputnik.COMPRESS_MIN_SIZE is not None and len(content) >= sputnik.COMPRESS_MIN_SIZE and \
+            re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        compressed = compress_string(content)
+
+        if len(compressed) < len(content):
+            resp.content = compressed
+            resp['Content-Encoding'] = 'gzip'
+            resp['Content-Length'] = str(len(compressed))
+
+    return resp
+
+
+def process_messages(request, messages, sputnik_map):
+    """
+    Executes messages client has sent. Every message is routed to C{remote_<command>} function
+    in the module mapped to the message channel (see L{sputnik.routing}). Unknown commands get reply
+    with status False. Must be called inside of manually managed transaction.
+
+    Messages are committed one by one or, with C{SPUTNIK_TRANSACTION_MODE = 'batch'}, all together
+    with one savepoint per message. Functions must not commit or roll back the transaction themselves,
+    otherwise rest of the batch falls back to committing messages one by one. Functions registered
+    with L{sputnik.after_commit} are called after every commit. Wall time, SQL queries and Redis
+    commands of every message are recorded in L{sputnik.metrics}.
+
+    @type request: C{django.http.HttpRequest}
+    @param request: Client Request object. It must have C{sputnikID} and C{clientID} set.
+    @type messages: C{list}
+    @param messages: List of Sputnik messages.
+    @type sputnik_map: C{list}
+    @param sputnik_map: Mapping of channels with specific python modules.
+    @rtype: C{list}
+    @return: Returns list of replies for the client.
+    """
+
+    results = []
+    routes = get_route_table(sputnik_map)
+    use_savepoints = sputnik.TRANSACTION_MODE == 'batch' and connection.features.uses_savepoints
+
+    with Collector() as metrics:
+        _process_messages(request, messages, routes, use_savepoints, metrics, results)
+
+    return results
+
+
+def _process_messages(request, messages, routes, use_savepoints, metrics, results):
+    # replies of messages which are not committed yet
+    pending = []
+
+    for message in messages:
+        channel = message.get("channel") or ""
+        command = message.get("command") or ""
+
+        fnc, a = routes.resolve(channel, command)
+
+        if not fnc:
+            logger.warning("Could not find function '%s' for Sputnik channel '%s'!" % (command, channel))
+            results.append({"result": False, "status": False, "uid": message.get("uid", None)})
+            continue
+
+        execute_status = True
+        ret = None
+        sample = metrics.start(command)
+
+        if use_savepoints:
+            sid = transaction.savepoint()
+            callbacks = sputnik.after_commit_savepoint()
+
+        # Catch different kind of errors
+        # For now they all do the same thing but this might change in the future
+        try:
+            ret = fnc(request, message, **a)
+        except ObjectDoesNotExist:
+            execute_status = False
+        except SuspiciousOperation:
+            execute_status = False
+        except PermissionDenied:
+            execute_status = False
+        except:
+            execute_status = False
+
+        # For different compatibility reasons return result and status now
+        if not ret:
+            ret = {"result": execute_status}
+
+        # result and some other things might be a problem here
+        ret["status"] = execute_status
+        ret["uid"] = message.get("uid", None)
+
+        results.append(ret)
+        pending.append(ret)
+
+        # commit and rollback forget all savepoints
+        if use_savepoints and not connection.savepoint_state:
+            logger.warning("Function '%s' for Sputnik channel '%s' manages transaction itself, "
+                           "rest of the messages is committed one by one." % (command, channel))
+            use_savepoints = False
+
+        if use_savepoints:
+            try:
+                if not execute_status:
+                    transaction.savepoint_rollback(sid)
+                    sputnik.discard_after_commit(callbacks)
+                else:
+                    transaction.savepoint_commit(sid)
+            except DatabaseError:
+                logger.exception("Could not release savepoint of '%s' for Sputnik channel '%s'." % (command, channel))
+
+                # transaction can not be used anymore, nothing since the last commit is stored
+                transaction.rollback()
+                sputnik.discard_after_commit()
+
+                for ret in pending:
+                    ret["status"] = False
+
+                pending = []
+        elif not execute_status:
+            transaction.rollback()
+            sputnik.discard_after_commit()
+            pending = []
+        else:
+            transaction.commit()
+            sputnik.run_after_commit()
+            pending = []
+
+        if sample:
+            sample.stop(execute_status)
+
+    # one commit for all messages
+    if use_savepoints:
+        transaction.commit()
+        sputnik.run_after_commit()
+
+
 @transaction.commit_manually
 def dispatcher(request, **sputnik_dict):
     """
@@ -100,6 +296,8 @@ def dispatcher(request, **sputnik_dict):
           List of messages client is sending to server.
       - C{request.POST['clientID']} 
           Unique client ID for this connection.
+      - C{request.POST['longpoll']}
+          Optional. Number of seconds to wait for new messages if there are none. Limited by SPUTNIK_LONGPOLL_TIMEOUT.
 
     This is just another Django view.
 
@@ -117,6 +315,8 @@ def dispatcher(request, **sputnik_dict):
     results = []
     clientID = None
 
+    sputnik.reset_stats()
+
     if request.method != 'POST':
         status_code = False
 
@@ -135,65 +335,28 @@ def dispatcher(request, **sputnik_dict):
             request.sputnikID = "%s:%s" % (request.session.session_key, clientID)
             request.clientID  = clientID
 
-        for message in messages:            
-            for mpr in sputnik_dict['map']:
-                mtch = re.match(mpr[0], message.get("channel", ""))
-
-                if mtch:
-                    a =  mtch.groupdict()
-
-                    try:
-                        _m = importlib.import_module(mpr[1])
-                    except ImportError:
-                        _m = None
-
-                    if _m:
-                        # should do hasattr first and then getattr
-                        fnc = getattr(_m, "remote_%s" % message.get('command', ''))
-
-                        if fnc:
-                            execute_status = True
-                            ret = None
-
-                            # Catch different kind of errors
-                            # For now they all do the same thing but this might change in the future
-                            try:
-                                ret = fnc(request, message, **a)
-                            except ObjectDoesNotExist:
-                                execute_status = False
-                            except SuspiciousOperation:
-                                execute_status = False
-                            except PermissionDenied:
-                                execute_status = False
-                            except:
-                                execute_status = False
-                                
-                            # For different compatibility reasons return result and status now
-                            if not ret:
-                                ret = {"result": execute_status}
-
-                            # result and some other things might be a problem here
-                            ret["status"] = execute_status
-                            ret["uid"] = message.get("uid", None)
-
-                            results.append(ret)
-
-                            if not execute_status:
-                                transaction.rollback()
-                            else:
-                                transaction.commit()
-                        else:
-                            logger.error("Could not find function '%s' for Sputnik channel '%d'!" % (message.get('command', ''), message.get('channel', '')))
+        results.extend(process_messages(request, messages, sputnik_dict['map']))
+
+        # Long polling. Wait for messages only if client asked for it and there are no replies to send back.
+        try:
+            timeout = min(float(request.POST.get("longpoll", 0)), sputnik.LONGPOLL_TIMEOUT)
+        except (TypeError, ValueError):
+            timeout = 0
+
+        if results or timeout < 0:
+            timeout = 0
+
+        # Do not keep database transaction open while waiting
+        if timeout:
+            transaction.commit()
+            sputnik.run_after_commit()
 
         # Collect other messages waiting for this user
-        results.extend(collect_messages(request, clientID))
+        results.extend(collect_messages(request, clientID, timeout))
 
         # Set timestamp for this access
         set_last_access(request)
 
-        # This will be moved to background workers
-        remove_timeout_clients(request)
-
     # Besides status we are still using result
     return_objects = {"status": status_code, "result": status_code, "messages": results}
 
@@ -201,11 +364,15 @@ def dispatcher(request, **sputnik_dict):
     # In the future we should change this and return different kind of statuses in case of error
 
     try:
-        resp = HttpResponse(json.dumps(return_objects), mimetype="text/json")
+        resp = encode_response(request, return_objects)
     except:
         transaction.rollback()
+        sputnik.discard_after_commit()
     else:
         transaction.commit()
+        sputnik.run_after_commit()
+
+    log_redis_stats(request)
 
     return resp
 